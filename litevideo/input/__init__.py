@@ -10,7 +10,9 @@ from litevideo.input.wer import WER
 from litevideo.input.decoding import Decoding, DecodeTERC4
 from litevideo.input.chansync import ChanSync
 from litevideo.input.analysis import SyncPolarity, ResolutionDetection
-from litevideo.input.analysis import FrameExtraction
+from litevideo.input.analysis import FrameExtraction, FrameStatistics
+from litevideo.input.tiles import TileChangeDetector
+from litevideo.input.scaler import Downscaler
 from litevideo.input.dma import DMA
 
 from litex.soc.interconnect import stream
@@ -45,7 +47,13 @@ class TimingDelayChannel(Module):
 
 class HDMIIn(Module, AutoCSR):
     def __init__(self, pads, dram_port=None, n_dma_slots=2, fifo_depth=512, device="xc6",
-                 default_edid=_default_edid, clkin_freq=148.5e6, split_mmcm=False, mode="ycbcr422", hdmi=False):
+                 default_edid=_default_edid, clkin_freq=148.5e6, split_mmcm=False, mode="ycbcr422", hdmi=False,
+                 pixels_per_clock=1, capture_cd="pix", burst_length=1, with_statistics=False,
+                 with_change_detection=False, scaled_dram_port=None, loopback_dw=None,
+                 charsync_parallel_search=False):
+        if dram_port is not None and loopback_dw is not None:
+            raise ValueError("Loopback and DMA capture are exclusive")
+
         if hasattr(pads, "scl"):
             self.submodules.edid = EDID(pads, default_edid)
         self.submodules.clocking = clocking_cls[device](pads, clkin_freq, split_mmcm)
@@ -59,7 +67,7 @@ class HDMIIn(Module, AutoCSR):
             if hasattr(cap, "serdesstrobe"):
                 self.comb += cap.serdesstrobe.eq(self.clocking.serdesstrobe)
 
-            charsync = CharSync()
+            charsync = CharSync(parallel_search=charsync_parallel_search)
             setattr(self.submodules, name + "_charsync", charsync)
             self.comb += charsync.raw_data.eq(cap.d)
 
@@ -133,12 +141,40 @@ class HDMIIn(Module, AutoCSR):
         self.submodules.resdetection = ResolutionDetection()
         self.comb += [
             self.resdetection.valid_i.eq(self.syncpol.valid_o),
+            self.resdetection.hsync.eq(self.syncpol.hsync),
             self.resdetection.de.eq(self.syncpol.de),
             self.resdetection.vsync.eq(self.syncpol.vsync)
         ]
+        self.mode_ev = self.resdetection.ev
 
-        if dram_port is not None:
-            self.submodules.frame = FrameExtraction(dram_port.dw, fifo_depth, mode)
+        if with_statistics:
+            self.submodules.statistics = FrameStatistics()
+            self.comb += [
+                self.statistics.valid_i.eq(self.syncpol.valid_o),
+                self.statistics.de.eq(self.syncpol.de),
+                self.statistics.vsync.eq(self.syncpol.vsync),
+                self.statistics.r.eq(self.syncpol.r),
+                self.statistics.g.eq(self.syncpol.g),
+                self.statistics.b.eq(self.syncpol.b)
+            ]
+
+        if with_change_detection:
+            self.submodules.change_detection = TileChangeDetector()
+            self.comb += [
+                self.change_detection.valid_i.eq(self.syncpol.valid_o),
+                self.change_detection.de.eq(self.syncpol.de),
+                self.change_detection.vsync.eq(self.syncpol.vsync),
+                self.change_detection.r.eq(self.syncpol.r),
+                self.change_detection.g.eq(self.syncpol.g),
+                self.change_detection.b.eq(self.syncpol.b)
+            ]
+
+        if dram_port is not None or loopback_dw is not None:
+            # with pixels_per_clock > 1, capture_cd is a clock domain at 1/pixels_per_clock of pix
+            # (or faster) provided by the design
+            word_width = dram_port.dw if dram_port is not None else loopback_dw
+            self.submodules.frame = FrameExtraction(word_width, fifo_depth, mode,
+                pixels_per_clock=pixels_per_clock, cd=capture_cd)
             self.comb += [
                 self.frame.valid_i.eq(self.syncpol.valid_o),
                 self.frame.de.eq(self.syncpol.de),
@@ -148,9 +184,47 @@ class HDMIIn(Module, AutoCSR):
                 self.frame.b.eq(self.syncpol.b)
             ]
 
-
-            self.submodules.dma = DMA(dram_port, n_dma_slots)
-            self.comb += self.frame.frame.connect(self.dma.frame)
+        if dram_port is not None:
+            self.submodules.dma = DMA(dram_port, n_dma_slots, burst_length)
+            self.comb += [
+                self.frame.frame.connect(self.dma.frame),
+                self.dma.pause.eq(self.resdetection.pause),
+                self.dma.frame_skipped.eq(self.frame.frame_skipped.o)
+            ]
             self.ev = self.dma.ev
+        elif loopback_dw is not None:
+            # frames streamed to a VideoOutCore (loopback_stream) instead of memory
+            self.loopback_source = self.frame.frame
+
+        if scaled_dram_port is not None:
+            # downscaled copy of the frames, captured to its own slots
+            self.submodules.downscaler = Downscaler()
+            self.comb += [
+                self.downscaler.valid_i.eq(self.syncpol.valid_o),
+                self.downscaler.de_i.eq(self.syncpol.de),
+                self.downscaler.vsync_i.eq(self.syncpol.vsync),
+                self.downscaler.r_i.eq(self.syncpol.r),
+                self.downscaler.g_i.eq(self.syncpol.g),
+                self.downscaler.b_i.eq(self.syncpol.b)
+            ]
+
+            self.submodules.scaled_frame = FrameExtraction(scaled_dram_port.dw, fifo_depth, mode,
+                pixels_per_clock=pixels_per_clock, cd=capture_cd)
+            self.comb += [
+                self.scaled_frame.valid_i.eq(self.downscaler.valid_o),
+                self.scaled_frame.de.eq(self.downscaler.de_o),
+                self.scaled_frame.vsync.eq(self.downscaler.vsync_o),
+                self.scaled_frame.r.eq(self.downscaler.r_o),
+                self.scaled_frame.g.eq(self.downscaler.g_o),
+                self.scaled_frame.b.eq(self.downscaler.b_o)
+            ]
+
+            self.submodules.scaled_dma = DMA(scaled_dram_port, n_dma_slots, burst_length)
+            self.comb += [
+                self.scaled_frame.frame.connect(self.scaled_dma.frame),
+                self.scaled_dma.pause.eq(self.resdetection.pause),
+                self.scaled_dma.frame_skipped.eq(self.scaled_frame.frame_skipped.o)
+            ]
+            self.scaled_ev = self.scaled_dma.ev
 
-    autocsr_exclude = {"ev"}
+    autocsr_exclude = {"ev", "mode_ev", "scaled_ev"}
@@ -1,7 +1,12 @@
+from functools import reduce
+from operator import or_
+from math import gcd
+
 from migen import *
-from migen.genlib.cdc import MultiReg, PulseSynchronizer
+from migen.genlib.cdc import MultiReg, PulseSynchronizer, GrayCounter, GrayDecoder
 
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.interconnect import stream
 
 from litevideo.input.common import channel_layout
@@ -72,14 +77,49 @@ class SyncPolarity(Module):
 
 
 class ResolutionDetection(Module, AutoCSR):
+    """Resolution detection
+
+    Measures the active resolution (hres, vres) and the timings of the frames: the total, sync width,
+    front porch and back porch of the lines (in pixels, from the hsync rising edges) and of the
+    frames (in lines), and the frame period in sys clock cycles.
+
+    Mode changes are signaled by events: changed when the resolution or the totals of a frame differ
+    from the previous frame (or when the input is lost), stable when they stayed the same for
+    stable_frames frames (0 disables it). A change is signaled on the first line whose width or
+    total differs, or that exceeds the previous frame; a frame with fewer lines is only detected
+    at its end. With pause_on_change, a change also sets pause (used to pause the capture DMA)
+    until software writes resume.
+    """
     def __init__(self, nbits=11):
         self.valid_i = Signal()
+        self.hsync = Signal()
         self.vsync = Signal()
         self.de = Signal()
 
         self._hres = CSRStatus(nbits)
         self._vres = CSRStatus(nbits)
 
+        self._htotal = CSRStatus(nbits + 1)
+        self._hsync_width = CSRStatus(nbits)
+        self._hfront_porch = CSRStatus(nbits)
+        self._hback_porch = CSRStatus(nbits)
+        self._vtotal = CSRStatus(nbits + 1)
+        self._vsync_width = CSRStatus(nbits)
+        self._vfront_porch = CSRStatus(nbits)
+        self._vback_porch = CSRStatus(nbits)
+        self._frame_period = CSRStatus(32)
+
+        self._stable_frames = CSRStorage(8)
+        self._pause_on_change = CSRStorage()
+        self._resume = CSR()
+        self._paused = CSRStatus()
+        self.pause = Signal()
+
+        self.submodules.ev = EventManager()
+        self.ev.changed = EventSourcePulse()
+        self.ev.stable = EventSourcePulse()
+        self.ev.finalize()
+
         # # #
 
         # Detect DE transitions
@@ -129,9 +169,481 @@ class ResolutionDetection(Module, AutoCSR):
             )
         self.specials += MultiReg(vcounter_st, self._vres.status)
 
+        # Detect HSYNC/VSYNC/DE edges
+        hsync_r = Signal()
+        p_hsync = Signal()
+        n_hsync = Signal()
+        n_vsync = Signal()
+        p_de = Signal()
+        self.sync.pix += hsync_r.eq(self.hsync)
+        self.comb += [
+            p_hsync.eq(self.hsync & ~hsync_r),
+            n_hsync.eq(~self.hsync & hsync_r),
+            n_vsync.eq(~self.vsync & vsync_r),
+            p_de.eq(self.de & ~de_r)
+        ]
+
+        # Horizontal timings (position in the line, from the hsync rising edge)
+        hpos = Signal(nbits + 1)
+        hsync_width = Signal(nbits)
+        hde_end = Signal(nbits + 1)
+        hde_seen = Signal()
+        htotal_st = Signal(nbits + 1)
+        hsync_width_st = Signal(nbits)
+        hfront_porch_st = Signal(nbits)
+        hback_porch_st = Signal(nbits)
+        self.sync.pix += [
+            If(p_hsync,
+                hpos.eq(1)
+            ).Else(
+                hpos.eq(hpos + 1)
+            ),
+            If(n_hsync,
+                hsync_width.eq(hpos)
+            ),
+            If(pn_de,
+                hde_end.eq(hpos)
+            ),
+            If(~self.valid_i,
+                htotal_st.eq(0),
+                hsync_width_st.eq(0),
+                hfront_porch_st.eq(0),
+                hback_porch_st.eq(0),
+                hde_seen.eq(0)
+            ).Else(
+                If(p_hsync,
+                    htotal_st.eq(hpos),
+                    hsync_width_st.eq(hsync_width),
+                    If(hde_seen,
+                        hfront_porch_st.eq(hpos - hde_end)
+                    ),
+                    hde_seen.eq(0)
+                ),
+                If(p_de,
+                    hback_porch_st.eq(hpos - hsync_width)
+                ),
+                If(pn_de,
+                    hde_seen.eq(1)
+                )
+            )
+        ]
+        self.specials += [
+            MultiReg(htotal_st, self._htotal.status),
+            MultiReg(hsync_width_st, self._hsync_width.status),
+            MultiReg(hfront_porch_st, self._hfront_porch.status),
+            MultiReg(hback_porch_st, self._hback_porch.status)
+        ]
+
+        # Vertical timings (line of the frame, from the vsync rising edge)
+        vline = Signal(nbits + 1)
+        vsync_width = Signal(nbits)
+        vde_end = Signal(nbits + 1)
+        vde_seen = Signal()
+        vtotal_st = Signal(nbits + 1)
+        vsync_width_st = Signal(nbits)
+        vfront_porch_st = Signal(nbits)
+        vback_porch_st = Signal(nbits)
+        self.sync.pix += [
+            If(p_vsync,
+                vline.eq(0)
+            ).Elif(p_hsync,
+                vline.eq(vline + 1)
+            ),
+            If(n_vsync,
+                vsync_width.eq(vline + 1)
+            ),
+            If(pn_de,
+                vde_end.eq(vline)
+            ),
+            If(~self.valid_i,
+                vtotal_st.eq(0),
+                vsync_width_st.eq(0),
+                vfront_porch_st.eq(0),
+                vback_porch_st.eq(0),
+                vde_seen.eq(0)
+            ).Else(
+                If(p_vsync,
+                    vtotal_st.eq(vline + 1),
+                    vsync_width_st.eq(vsync_width),
+                    If(vde_seen,
+                        vfront_porch_st.eq(vline - vde_end)
+                    ),
+                    vde_seen.eq(0)
+                ),
+                If(p_de & ~vde_seen,
+                    vback_porch_st.eq(vline - vsync_width),
+                    vde_seen.eq(1)
+                )
+            )
+        ]
+        self.specials += [
+            MultiReg(vtotal_st, self._vtotal.status),
+            MultiReg(vsync_width_st, self._vsync_width.status),
+            MultiReg(vfront_porch_st, self._vfront_porch.status),
+            MultiReg(vback_porch_st, self._vback_porch.status)
+        ]
+
+        # Frame period (sys clock cycles between vsync rising edges)
+        self.submodules.frame_start = PulseSynchronizer("pix", "sys")
+        self.comb += self.frame_start.i.eq(self.valid_i & p_vsync)
+        valid_sys = Signal()
+        self.specials += MultiReg(self.valid_i, valid_sys)
+        period_counter = Signal(32)
+        self.sync += [
+            If(self.frame_start.o,
+                period_counter.eq(1)
+            ).Elif(period_counter != (2**32 - 1),
+                period_counter.eq(period_counter + 1)
+            ),
+            If(~valid_sys,
+                self._frame_period.status.eq(0)
+            ).Elif(self.frame_start.o,
+                self._frame_period.status.eq(period_counter)
+            )
+        ]
+
+        # Mode change detection (resolution and totals of each frame compared to the previous frame)
+        valid_r = Signal()
+        last_hres = Signal(nbits)
+        last_vres = Signal(nbits)
+        last_htotal = Signal(nbits + 1)
+        last_vtotal = Signal(nbits + 1)
+        signature = Signal(2*nbits + 2*(nbits + 1))
+        last_signature = Signal(len(signature))
+        line_changed = Signal()     # a line of the frame differs from the previous frame
+        frame_changed = Signal()    # the change of the frame was already signaled
+        mismatch = Signal()
+        stable_frames = Signal(8)
+        stable_count = Signal(8)
+        changed = Signal()
+        stable = Signal()
+        self.specials += MultiReg(self._stable_frames.storage, stable_frames, "pix")
+        self.comb += [
+            signature.eq(Cat(hcounter_st, vcounter, htotal_st, vline + 1)),
+            Cat(last_hres, last_vres, last_htotal, last_vtotal).eq(last_signature),
+            line_changed.eq(self.valid_i & (
+                (pn_de & ((hcounter != last_hres) | (vcounter >= last_vres))) |
+                (p_hsync & ~p_vsync & ((hpos != last_htotal) | ((vline + 1) >= last_vtotal))))),
+            mismatch.eq(frame_changed | line_changed | (signature != last_signature)),
+            changed.eq((valid_r & ~self.valid_i) |
+                       (line_changed & ~frame_changed) |
+                       (self.valid_i & p_vsync & mismatch & ~frame_changed)),
+            stable.eq(self.valid_i & p_vsync & ~mismatch &
+                      (stable_frames != 0) & (stable_count == (stable_frames - 1)))
+        ]
+        self.sync.pix += [
+            valid_r.eq(self.valid_i),
+            If(self.valid_i & p_vsync,
+                last_signature.eq(signature),
+                frame_changed.eq(0)
+            ).Elif(line_changed,
+                frame_changed.eq(1)
+            ),
+            If(changed | (self.valid_i & p_vsync & mismatch),
+                stable_count.eq(0)
+            ).Elif(self.valid_i & p_vsync & (stable_count != (2**8 - 1)),
+                stable_count.eq(stable_count + 1)
+            )
+        ]
+
+        self.submodules.changed = PulseSynchronizer("pix", "sys")
+        self.submodules.stable = PulseSynchronizer("pix", "sys")
+        self.comb += [
+            self.changed.i.eq(changed),
+            self.stable.i.eq(stable),
+            self.ev.changed.trigger.eq(self.changed.o),
+            self.ev.stable.trigger.eq(self.stable.o),
+            self._paused.status.eq(self.pause)
+        ]
+        self.sync += \
+            If(self._resume.re,
+                self.pause.eq(0)
+            ).Elif(self.changed.o & self._pause_on_change.storage,
+                self.pause.eq(1)
+            )
+
+
+class FrameStatistics(Module, AutoCSR):
+    """Frame statistics
+
+    Computes statistics of the frames without reading them back from memory: the number of active
+    pixels, the sum, minimum and maximum of the luma, r, g and b values of the last frame, and a
+    256-bin histogram of the channel selected by channel (0: luma, 1: r, 2: g, 3: b).
+
+    The histogram memory holds 2 banks of 256 bins: frames are accumulated alternately in each
+    bank and bank is the one holding the last frame. Setting freeze (taken into account on the
+    next frame) stops the accumulation so that the last frame can be read consistently: the
+    pixels, sums, minimums, maximums and bank then keep reporting this frame. The bank of a new
+    frame is cleared in the 256 pixel clocks following the start of vsync. The histogram is
+    read-only from the CSR bus.
+    """
+    def __init__(self):
+        # in pix clock domain
+        self.valid_i = Signal()
+        self.vsync = Signal()
+        self.de = Signal()
+        self.r = Signal(8)
+        self.g = Signal(8)
+        self.b = Signal(8)
+
+        self._channel = CSRStorage(2)
+        self._freeze = CSRStorage()
+        self._bank = CSRStatus()
+        self._pixels = CSRStatus(32)
+        channels = ["y", "r", "g", "b"]
+        for name in channels:
+            setattr(self, "_sum_" + name, CSRStatus(32, name="sum_" + name))
+            setattr(self, "_min_" + name, CSRStatus(8, name="min_" + name))
+            setattr(self, "_max_" + name, CSRStatus(8, name="max_" + name))
+        self.specials.histogram = Memory(32, 2*256)
+        self.histogram.bus_read_only = True
+
+        # # #
+
+        # luma
+        rgb2ycbcr = RGB2YCbCr()
+        self.submodules += ClockDomainsRenamer("pix")(rgb2ycbcr)
+        self.comb += [
+            rgb2ycbcr.sink.valid.eq(self.valid_i),
+            rgb2ycbcr.sink.r.eq(self.r),
+            rgb2ycbcr.sink.g.eq(self.g),
+            rgb2ycbcr.sink.b.eq(self.b),
+            rgb2ycbcr.source.ready.eq(1)
+        ]
+
+        # delay the other signals by the latency of the conversion
+        delayed = []
+        for s in [self.vsync, self.de, self.r, self.g, self.b]:
+            for i in range(rgb2ycbcr.latency):
+                next_s = Signal(len(s))
+                self.sync.pix += next_s.eq(s)
+                s = next_s
+            delayed.append(s)
+        vsync, de, r, g, b = delayed
+        values = [rgb2ycbcr.source.y, r, g, b]
+        pixel_valid = Signal()
+        self.comb += pixel_valid.eq(rgb2ycbcr.source.valid & de)
+
+        vsync_r = Signal()
+        new_frame = Signal()
+        self.comb += new_frame.eq(vsync & ~vsync_r)
+        self.sync.pix += vsync_r.eq(vsync)
+
+        channel = Signal(2)
+        freeze = Signal()
+        self.specials += [
+            MultiReg(self._channel.storage, channel, "pix"),
+            MultiReg(self._freeze.storage, freeze, "pix")
+        ]
+        frozen = Signal()   # the current frame is not accumulated
+        self.sync.pix += If(new_frame, frozen.eq(freeze))
+
+        # sums, minimums and maximums (only latched at the end of an accumulated frame)
+        pixels = Signal(32)
+        pixels_frame = Signal(32)
+        self.sync.pix += \
+            If(new_frame,
+                If(~frozen, pixels_frame.eq(pixels)),
+                pixels.eq(0)
+            ).Elif(pixel_valid,
+                pixels.eq(pixels + 1)
+            )
+        self.specials += MultiReg(pixels_frame, self._pixels.status)
+        for name, value in zip(channels, values):
+            acc_sum = Signal(32, name="acc_sum_" + name)
+            acc_min = Signal(8, name="acc_min_" + name)
+            acc_max = Signal(8, name="acc_max_" + name)
+            frame_sum = Signal(32, name="frame_sum_" + name)
+            frame_min = Signal(8, name="frame_min_" + name)
+            frame_max = Signal(8, name="frame_max_" + name)
+            self.sync.pix += \
+                If(new_frame,
+                    If(~frozen,
+                        frame_sum.eq(acc_sum),
+                        frame_min.eq(acc_min),
+                        frame_max.eq(acc_max)
+                    ),
+                    acc_sum.eq(0),
+                    acc_min.eq(2**8 - 1),
+                    acc_max.eq(0)
+                ).Elif(pixel_valid,
+                    acc_sum.eq(acc_sum + value),
+                    If(value < acc_min, acc_min.eq(value)),
+                    If(value > acc_max, acc_max.eq(value))
+                )
+            self.specials += [
+                MultiReg(frame_sum, getattr(self, "_sum_" + name).status),
+                MultiReg(frame_min, getattr(self, "_min_" + name).status),
+                MultiReg(frame_max, getattr(self, "_max_" + name).status)
+            ]
+
+        # histogram
+        bank = Signal()         # bank accumulating the current frame
+        last_bank = Signal()    # bank holding the last accumulated frame
+        clearing = Signal()
+        clear_adr = Signal(8)
+        self.sync.pix += [
+            If(new_frame,
+                If(~frozen,
+                    last_bank.eq(bank)
+                ),
+                If(~freeze,
+                    bank.eq(~bank),
+                    clearing.eq(1),
+                    clear_adr.eq(0)
+                )
+            ).Elif(clearing,
+                clear_adr.eq(clear_adr + 1),
+                If(clear_adr == (2**8 - 1),
+                    clearing.eq(0)
+                )
+            )
+        ]
+        self.specials += MultiReg(last_bank, self._bank.status)
+
+        rdport = self.histogram.get_port(clock_domain="pix")
+        wrport = self.histogram.get_port(write_capable=True, clock_domain="pix")
+        self.specials += rdport, wrport
+
+        # stage 0: read of the bin
+        value = Signal(8)
+        self.comb += [
+            value.eq(Array(values)[channel]),
+            rdport.adr.eq(Cat(value, bank))
+        ]
+        update = Signal()
+        update_adr = Signal(9)
+        self.sync.pix += [
+            update.eq(pixel_valid & ~frozen & ~clearing),
+            update_adr.eq(rdport.adr)
+        ]
+
+        # stage 1: increment of the bin (forwarding the write of the previous pixel)
+        last_we = Signal()
+        last_adr = Signal(9)
+        last_dat = Signal(32)
+        count = Signal(32)
+        self.comb += \
+            If(last_we & (last_adr == update_adr),
+                count.eq(last_dat)
+            ).Else(
+                count.eq(rdport.dat_r)
+            )
+        self.comb += \
+            If(clearing,
+                wrport.adr.eq(Cat(clear_adr, bank)),
+                wrport.dat_w.eq(0),
+                wrport.we.eq(1)
+            ).Else(
+                wrport.adr.eq(update_adr),
+                wrport.dat_w.eq(count + 1),
+                wrport.we.eq(update)
+            )
+        self.sync.pix += [
+            last_we.eq(wrport.we),
+            last_adr.eq(wrport.adr),
+            last_dat.eq(wrport.dat_w)
+        ]
+
+
+class CaptureGearbox(Module):
+    """Capture gearbox
+
+    Groups the pixels of the pix clock domain by pixels_per_clock (first pixel in lsbs) and moves
+    them to the cd clock domain, which can then run at 1/pixels_per_clock of the pixel clock.
+    Groups are aligned on the start of the lines (de rising edge).
+    """
+    def __init__(self, pixels_per_clock, cd, fifo_depth=8):
+        # in pix clock domain
+        self.valid_i = Signal()
+        self.vsync_i = Signal()
+        self.de_i = Signal()
+        self.r_i = Signal(8)
+        self.g_i = Signal(8)
+        self.b_i = Signal(8)
+
+        # in cd clock domain
+        self.valid_o = Signal()
+        self.vsync_o = Signal()
+        self.de_o = Signal()
+        self.r_o = Signal(8*pixels_per_clock)
+        self.g_o = Signal(8*pixels_per_clock)
+        self.b_o = Signal(8*pixels_per_clock)
+
+        # # #
+
+        cdc = stream.AsyncFIFO([("vsync", 1), ("de", 1),
+                                ("r", 8*pixels_per_clock),
+                                ("g", 8*pixels_per_clock),
+                                ("b", 8*pixels_per_clock)], fifo_depth)
+        cdc = ClockDomainsRenamer({"write": "pix", "read": cd})(cdc)
+        self.submodules += cdc
+
+        de_r = Signal()
+        count = Signal(max=pixels_per_clock)
+        pos = Signal(max=pixels_per_clock)  # position of the pixel in its group
+        self.comb += pos.eq(Mux(self.de_i & ~de_r, 0, count))
+        self.sync.pix += [
+            de_r.eq(self.de_i),
+            If(self.valid_i,
+                count.eq(pos + 1)
+            ),
+            [If(self.valid_i & (pos == i),
+                cdc.sink.r[8*i:8*(i+1)].eq(self.r_i),
+                cdc.sink.g[8*i:8*(i+1)].eq(self.g_i),
+                cdc.sink.b[8*i:8*(i+1)].eq(self.b_i)
+            ) for i in range(pixels_per_clock)],
+            cdc.sink.valid.eq(self.valid_i & (pos == (pixels_per_clock - 1))),
+            cdc.sink.vsync.eq(self.vsync_i),
+            cdc.sink.de.eq(self.de_i)
+        ]
+
+        sync = getattr(self.sync, cd)
+        self.comb += cdc.source.ready.eq(1)
+        sync += [
+            self.valid_o.eq(cdc.source.valid),
+            If(cdc.source.valid,
+                self.vsync_o.eq(cdc.source.vsync),
+                self.de_o.eq(cdc.source.de),
+                self.r_o.eq(cdc.source.r),
+                self.g_o.eq(cdc.source.g),
+                self.b_o.eq(cdc.source.b)
+            )
+        ]
+
 
 class FrameExtraction(Module, AutoCSR):
-    def __init__(self, word_width, fifo_depth, mode="ycbcr422"):
+    """Frame extraction
+
+    Converts the active pixels of the frames and packs them in words of word_width bits (first
+    pixel in msbs, the word order read by the video output) for the DMA. The word holding the last
+    pixel of a line is flagged with eol and the last word of a frame is padded with zeros.
+
+    Pixel formats (mode): ycbcr422 (16 bits), rgb (32 bits, b in lsbs), rgb24 (24 bits, pixels
+    straddle the words), rgb565 (16 bits, r in lsbs, as the rgb565 mode of the video output) and
+    y8 (8 bits luma).
+
+    Only the pixels of the region of interest are captured: the window of roi_width x roi_height
+    pixels at roi_x, roi_y (a 0 width/height extends it to the end of the lines/frame), decimated
+    by 2**hdecimation and 2**vdecimation. In ycbcr422 mode, roi_x is rounded down to an even
+    pixel.
+
+    Only one frame out of frame_divider (0: all frames) is captured, the skipped frames are not
+    written to the FIFO, are counted in skipped_frames and pulse frame_skipped (the skipped event of
+    the DMA).
+
+    The FIFO level (as seen from the read side) is monitored: fifo_level_max is the maximum level of
+    the last frame and a histogram of the level (sampled every cycle, 16 bins of fifo_depth/16
+    words) is read through fifo_histogram_select/fifo_histogram and cleared by
+    fifo_histogram_clear. The first word of a frame lost by an overflow is located in
+    overflow_x/overflow_y: position in the input frame of the last group of pixels_per_clock pixels
+    written to the word.
+
+    With pixels_per_clock > 1, the pixels are grouped by a CaptureGearbox and converted/packed
+    pixels_per_clock at a time in the cd clock domain, which then only needs to run at
+    1/pixels_per_clock of the pixel clock. Line lengths must be multiples of pixels_per_clock.
+    """
+    def __init__(self, word_width, fifo_depth, mode="ycbcr422", pixels_per_clock=1, cd="pix"):
         # in pix clock domain
         self.valid_i = Signal()
         self.vsync = Signal()
@@ -141,113 +653,483 @@ class FrameExtraction(Module, AutoCSR):
         self.b = Signal(8)
 
         # in sys clock domain
-        word_layout = [("sof", 1), ("pixels", word_width)]
+        word_layout = [("sof", 1), ("eol", 1), ("pixels", word_width)]
         self.frame = stream.Endpoint(word_layout)
         self.busy = Signal()
 
         self._overflow = CSR()
 
+        roi_bits = 12
+        self._roi_x = CSRStorage(roi_bits)
+        self._roi_y = CSRStorage(roi_bits)
+        self._roi_width = CSRStorage(roi_bits)
+        self._roi_height = CSRStorage(roi_bits)
+        self._hdecimation = CSRStorage(2)
+        self._vdecimation = CSRStorage(2)
+
+        self._frame_divider = CSRStorage(8)
+        self._skipped_frames = CSRStatus(32)
+
+        self._fifo_level_max = CSRStatus(bits_for(fifo_depth))
+        self._fifo_histogram_select = CSRStorage(4)
+        self._fifo_histogram = CSRStatus(32)
+        self._fifo_histogram_clear = CSR()
+        self._overflow_x = CSRStatus(roi_bits)
+        self._overflow_y = CSRStatus(roi_bits)
+
+        if pixels_per_clock not in [1, 2, 4]:
+            raise ValueError("Unsupported {} pixels per clock".format(pixels_per_clock))
+        if pixels_per_clock > 1 and cd == "pix":
+            raise ValueError("{} pixels per clock requires a slower clock domain than pix".format(pixels_per_clock))
+
         # # #
 
-        # start of frame detection
-        vsync = self.vsync
-        vsync_r = Signal()
-        self.new_frame = new_frame = Signal()
-        self.comb += new_frame.eq(vsync & ~vsync_r)
-        self.sync.pix += vsync_r.eq(vsync)
+        sync = getattr(self.sync, cd)
+
+        # pixels grouping
+        if pixels_per_clock > 1:
+            self.submodules.gearbox = gearbox = CaptureGearbox(pixels_per_clock, cd)
+            self.comb += [
+                gearbox.valid_i.eq(self.valid_i),
+                gearbox.vsync_i.eq(self.vsync),
+                gearbox.de_i.eq(self.de),
+                gearbox.r_i.eq(self.r),
+                gearbox.g_i.eq(self.g),
+                gearbox.b_i.eq(self.b)
+            ]
+            valid_i, vsync, de = gearbox.valid_o, gearbox.vsync_o, gearbox.de_o
+            r, g, b = gearbox.r_o, gearbox.g_o, gearbox.b_o
+        else:
+            valid_i, vsync, de = self.valid_i, self.vsync, self.de
+            r, g, b = self.r, self.g, self.b
 
         if mode == "ycbcr422":
+            pixel_width = 16
             de_r = Signal()
-            self.sync.pix += de_r.eq(self.de)
+            sync += de_r.eq(de)
+
+            if pixels_per_clock == 1:
+                rgb2ycbcr = RGB2YCbCr()
+                self.submodules += ClockDomainsRenamer(cd)(rgb2ycbcr)
+                chroma_downsampler = YCbCr444to422()
+                self.submodules += ClockDomainsRenamer(cd)(chroma_downsampler)
+                self.comb += [
+                    rgb2ycbcr.sink.valid.eq(valid_i),
+                    rgb2ycbcr.sink.r.eq(r),
+                    rgb2ycbcr.sink.g.eq(g),
+                    rgb2ycbcr.sink.b.eq(b),
+                    rgb2ycbcr.source.connect(chroma_downsampler.sink),
+                    chroma_downsampler.source.ready.eq(1),
+                    chroma_downsampler.datapath.first.eq(de & ~de_r) # XXX need clean up
+                ]
+                latency = rgb2ycbcr.latency + chroma_downsampler.latency
+                pixels_valid = chroma_downsampler.source.valid
+                encoded_pixels = Cat(chroma_downsampler.source.y,
+                                     chroma_downsampler.source.cb_cr)
+            else:
+                # one converter per pixel, chroma is averaged on pairs of pixels of the group
+                ycbcr = []
+                for i in range(pixels_per_clock):
+                    rgb2ycbcr = RGB2YCbCr()
+                    self.submodules += ClockDomainsRenamer(cd)(rgb2ycbcr)
+                    self.comb += [
+                        rgb2ycbcr.sink.valid.eq(valid_i),
+                        rgb2ycbcr.sink.r.eq(r[8*i:8*(i+1)]),
+                        rgb2ycbcr.sink.g.eq(g[8*i:8*(i+1)]),
+                        rgb2ycbcr.sink.b.eq(b[8*i:8*(i+1)]),
+                        rgb2ycbcr.source.ready.eq(1)
+                    ]
+                    ycbcr.append(rgb2ycbcr.source)
+                latency = rgb2ycbcr.latency + 1
+                pixels_valid = Signal()
+                encoded_pixels = Signal(16*pixels_per_clock)
+                sync += pixels_valid.eq(ycbcr[0].valid)
+                for i in range(0, pixels_per_clock, 2):
+                    cb_sum = Signal(9)
+                    cr_sum = Signal(9)
+                    self.comb += [
+                        cb_sum.eq(ycbcr[i].cb + ycbcr[i+1].cb),
+                        cr_sum.eq(ycbcr[i].cr + ycbcr[i+1].cr)
+                    ]
+                    sync += [
+                        encoded_pixels[16*i:16*(i+1)].eq(Cat(ycbcr[i].y, cb_sum[1:])),
+                        encoded_pixels[16*(i+1):16*(i+2)].eq(Cat(ycbcr[i+1].y, cr_sum[1:]))
+                    ]
+
+        elif mode == "y8":
+            pixel_width = 8
+            luma = []
+            for i in range(pixels_per_clock):
+                rgb2ycbcr = RGB2YCbCr()
+                self.submodules += ClockDomainsRenamer(cd)(rgb2ycbcr)
+                self.comb += [
+                    rgb2ycbcr.sink.valid.eq(valid_i),
+                    rgb2ycbcr.sink.r.eq(r[8*i:8*(i+1)]),
+                    rgb2ycbcr.sink.g.eq(g[8*i:8*(i+1)]),
+                    rgb2ycbcr.sink.b.eq(b[8*i:8*(i+1)]),
+                    rgb2ycbcr.source.ready.eq(1)
+                ]
+                luma.append(rgb2ycbcr.source.y)
+            latency = rgb2ycbcr.latency
+            pixels_valid = rgb2ycbcr.source.valid
+            encoded_pixels = Cat(*luma)
+        elif mode == "rgb565":
+            # same pixel format and word order as the rgb565 mode of the video output (r in lsbs)
+            pixel_width = 16
+            latency = 0
+            pixels_valid = valid_i
+            encoded_pixels = Cat(*[Cat(r[8*i+3:8*(i+1)], g[8*i+2:8*(i+1)], b[8*i+3:8*(i+1)])
+                                   for i in range(pixels_per_clock)])
+        elif mode == "rgb24":
+            pixel_width = 24
+            latency = 0
+            pixels_valid = valid_i
+            encoded_pixels = Cat(*[Cat(b[8*i:8*(i+1)], g[8*i:8*(i+1)], r[8*i:8*(i+1)])
+                                   for i in range(pixels_per_clock)])
+        elif mode == "rgb":
+            pixel_width = 32
+            latency = 0
+            pixels_valid = valid_i
+            encoded_pixels = Cat(*[Cat(b[8*i:8*(i+1)], g[8*i:8*(i+1)], r[8*i:8*(i+1)], Replicate(0, 8))
+                                   for i in range(pixels_per_clock)])
+        else:
+            raise ValueError("Unsupported capture mode {}".format(mode))
+
+        # delay the timing signals by the latency of the conversion
+        for i in range(latency):
+            next_de = Signal()
+            next_vsync = Signal()
+            sync += [
+                next_de.eq(de),
+                next_vsync.eq(vsync)
+            ]
+            de = next_de
+            vsync = next_vsync
+
+        # region of interest selection (on the converted pixels)
+        roi_x_i = Signal(roi_bits)
+        roi_x = Signal(roi_bits)
+        roi_y = Signal(roi_bits)
+        roi_width = Signal(roi_bits)
+        roi_height = Signal(roi_bits)
+        hdecimation = Signal(2)
+        vdecimation = Signal(2)
+        self.specials += [
+            MultiReg(self._roi_x.storage, roi_x_i, cd),
+            MultiReg(self._roi_y.storage, roi_y, cd),
+            MultiReg(self._roi_width.storage, roi_width, cd),
+            MultiReg(self._roi_height.storage, roi_height, cd),
+            MultiReg(self._hdecimation.storage, hdecimation, cd),
+            MultiReg(self._vdecimation.storage, vdecimation, cd)
+        ]
+        if mode == "ycbcr422":
+            # keep the chroma pairs aligned
+            self.comb += roi_x.eq(Cat(0, roi_x_i[1:]))
+        else:
+            self.comb += roi_x.eq(roi_x_i)
+
+        if mode == "ycbcr422" and pixels_per_clock == 1:
+            # select on the previous pixel, the current one holds the other chroma of the pair
+            sel_valid = Signal()
+            sel_de = Signal()
+            sel_vsync = Signal()
+            sel_pixels = Signal(pixel_width)
+            sync += [
+                sel_valid.eq(pixels_valid),
+                sel_de.eq(de),
+                sel_vsync.eq(vsync),
+                sel_pixels.eq(encoded_pixels)
+            ]
+            partner_chroma = [encoded_pixels[8:16]]
+        else:
+            sel_valid, sel_de, sel_vsync, sel_pixels = pixels_valid, de, vsync, encoded_pixels
+            if mode == "ycbcr422":
+                partner_chroma = [encoded_pixels[16*(i^1)+8:16*(i^1)+16] for i in range(pixels_per_clock)]
+
+        sel_de_r = Signal()
+        sel_vsync_r = Signal()
+        sel_new_frame = Signal()
+        line_end = Signal()
+        self.comb += [
+            sel_new_frame.eq(sel_vsync & ~sel_vsync_r),
+            line_end.eq(sel_de_r & ~sel_de)
+        ]
+        sync += [
+            sel_de_r.eq(sel_de),
+            sel_vsync_r.eq(sel_vsync)
+        ]
+
+        # frame rate divider
+        frame_divider = Signal(8)
+        frame_count = Signal(8)
+        capture = Signal()
+        self.specials += MultiReg(self._frame_divider.storage, frame_divider, cd)
+        sync += \
+            If(sel_new_frame,
+                If(frame_count == 0,
+                    capture.eq(1),
+                    If(frame_divider != 0,
+                        frame_count.eq(frame_divider - 1)
+                    )
+                ).Else(
+                    capture.eq(0),
+                    frame_count.eq(frame_count - 1)
+                )
+            )
+
+        self.submodules.frame_skipped = PulseSynchronizer(cd, "sys")
+        self.comb += self.frame_skipped.i.eq(sel_new_frame & (frame_count != 0))
+        self.sync += \
+            If(self.frame_skipped.o,
+                self._skipped_frames.status.eq(self._skipped_frames.status + 1)
+            )
+
+        x = Signal(roi_bits)  # position of the first pixel of the group
+        y = Signal(roi_bits)
+        sync += [
+            If(~sel_de,
+                x.eq(0)
+            ).Elif(sel_valid,
+                x.eq(x + pixels_per_clock)
+            ),
+            If(sel_new_frame,
+                y.eq(0)
+            ).Elif(line_end,
+                y.eq(y + 1)
+            )
+        ]
+
+        hstep = Signal(4)
+        vstep = Signal(4)
+        self.comb += [
+            hstep.eq(1 << hdecimation),
+            vstep.eq(1 << vdecimation)
+        ]
+
+        dy = Signal(roi_bits)
+        line_selected = Signal()
+        self.comb += [
+            dy.eq(y - roi_y),
+            line_selected.eq(capture &
+                             (y >= roi_y) &
+                             ((roi_height == 0) | (y < (roi_y + roi_height))) &
+                             ((dy & (vstep - 1)) == 0))
+        ]
 
-            rgb2ycbcr = RGB2YCbCr()
-            self.submodules += ClockDomainsRenamer("pix")(rgb2ycbcr)
-            chroma_downsampler = YCbCr444to422()
-            self.submodules += ClockDomainsRenamer("pix")(chroma_downsampler)
+        lanes = []  # selected pixels of the group
+        keep = []
+        for i in range(pixels_per_clock):
+            xi = Signal(roi_bits + 1, name="x" + str(i))
+            dx = Signal(roi_bits, name="dx" + str(i))
+            lane_keep = Signal(name="keep" + str(i))
+            lane = Signal(pixel_width, name="lane" + str(i))
+            pixel = sel_pixels[pixel_width*i:pixel_width*(i+1)]
             self.comb += [
-                rgb2ycbcr.sink.valid.eq(self.valid_i),
-                rgb2ycbcr.sink.r.eq(self.r),
-                rgb2ycbcr.sink.g.eq(self.g),
-                rgb2ycbcr.sink.b.eq(self.b),
-                rgb2ycbcr.source.connect(chroma_downsampler.sink),
-                chroma_downsampler.source.ready.eq(1),
-                chroma_downsampler.datapath.first.eq(self.de & ~de_r) # XXX need clean up
+                xi.eq(x + i),
+                dx.eq(xi - roi_x),
+                lane_keep.eq(sel_valid & sel_de & line_selected &
+                             (xi >= roi_x) &
+                             ((roi_width == 0) | (xi < (roi_x + roi_width))) &
+                             ((dx & (hstep - 1)) == 0))
             ]
-            # XXX need clean up
-            de = self.de
-            for i in range(rgb2ycbcr.latency + chroma_downsampler.latency):
-                next_de = Signal()
-                next_vsync = Signal()
-                self.sync.pix += [
-                    next_de.eq(de),
-                    next_vsync.eq(vsync)
+            if mode == "ycbcr422":
+                # decimated pixels all come from the same position in the chroma pairs, odd
+                # pixels of the output take the chroma of the other pixel of the pair
+                swap_chroma = Signal(name="swap_chroma" + str(i))
+                self.comb += [
+                    swap_chroma.eq(Array([0, dx[1], dx[2], dx[3]])[hdecimation]),
+                    lane[:8].eq(pixel[:8]),
+                    lane[8:16].eq(Mux(swap_chroma, partner_chroma[i], pixel[8:16]))
                 ]
-                de = next_de
-                vsync = next_vsync
-
-
-            # pack pixels into words
-            self.cur_word = cur_word = Signal(word_width)
-            self.cur_word_valid = cur_word_valid = Signal()
-            encoded_pixel = Signal(16)
-            self.comb += encoded_pixel.eq(Cat(chroma_downsampler.source.y,
-                                              chroma_downsampler.source.cb_cr)),
-            pack_factor = word_width//16
-            assert(pack_factor & (pack_factor - 1) == 0)  # only support powers of 2
-            self.pack_counter = pack_counter = Signal(max=pack_factor)
-            self.sync.pix += [
-                cur_word_valid.eq(0),
-                If(new_frame,
-                    cur_word_valid.eq(pack_counter == (pack_factor - 1)),
-                    pack_counter.eq(0),
-                ).Elif(chroma_downsampler.source.valid & de,
-                    [If(pack_counter == (pack_factor-i-1),
-                        cur_word[16*i:16*(i+1)].eq(encoded_pixel)) for i in range(pack_factor)],
-                    cur_word_valid.eq(pack_counter == (pack_factor - 1)),
-                    pack_counter.eq(pack_counter + 1)
-                )
+            else:
+                self.comb += lane.eq(pixel)
+            lanes.append(lane)
+            keep.append(lane_keep)
+
+        # the last selected pixel of a line is flagged with eol: the last group with selected
+        # pixels is held until the next one or until the end of the line
+        n = pixels_per_clock
+        held_lanes = [Signal(pixel_width, name="held_lane" + str(i)) for i in range(n)]
+        held_keep = [Signal(name="held_keep" + str(i)) for i in range(n)]
+        held_x = Signal(roi_bits)  # position of the held group
+        held_y = Signal(roi_bits)
+        group_selected = Signal()
+        push = Signal()
+        self.comb += [
+            group_selected.eq(reduce(or_, keep)),
+            push.eq((group_selected | line_end) & reduce(or_, held_keep))
+        ]
+        sync += \
+            If(sel_new_frame,
+                [held_keep[i].eq(0) for i in range(n)]
+            ).Elif(group_selected,
+                [held_lanes[i].eq(lanes[i]) for i in range(n)],
+                [held_keep[i].eq(keep[i]) for i in range(n)],
+                held_x.eq(x),
+                held_y.eq(y)
+            ).Elif(line_end,
+                [held_keep[i].eq(0) for i in range(n)]
+            )
+
+        push_lanes = []  # pushed pixels (with their eol flag) of the group
+        push_keep = []
+        for i in range(n):
+            lane_keep = Signal(name="push_keep" + str(i))
+            lane = Signal(pixel_width + 1, name="push_lane" + str(i))
+            self.comb += [
+                lane_keep.eq(push & held_keep[i]),
+                lane[:pixel_width].eq(held_lanes[i]),
+                lane[pixel_width].eq(line_end & held_keep[i] & ~reduce(or_, [0] + held_keep[i+1:]))
             ]
-        else: # rgb case...should probably rewrite to call out unsupported modes instead of defaulting to rgb
-            de = self.de
-
-            # pack pixels into words
-            self.cur_word = cur_word = Signal(word_width)
-            self.cur_word_valid = cur_word_valid = Signal()
-            encoded_pixel = Signal(32)
-            dummy8 = Signal(8)
-            self.comb += encoded_pixel.eq(Cat(self.b,self.g,self.r, dummy8)),
-            pack_factor = word_width//32
-            assert(pack_factor & (pack_factor - 1) == 0)  # only support powers of 2
-            self.pack_counter = pack_counter = Signal(max=pack_factor)
-            self.sync.pix += [
-                cur_word_valid.eq(0),
-                If(new_frame,
-                    cur_word_valid.eq(pack_counter == (pack_factor - 1)),
-                    pack_counter.eq(0),
-                ).Elif(self.valid_i & de,
-                    [If(pack_counter == (pack_factor-i-1),
-                        cur_word[32*i:32*(i+1)].eq(encoded_pixel)) for i in range(pack_factor)],
-                    cur_word_valid.eq(pack_counter == (pack_factor - 1)),
-                    pack_counter.eq(pack_counter + 1)
+            push_lanes.append(lane)
+            push_keep.append(lane_keep)
+
+        # compaction of the selected pixels in groups of pixels_per_clock pixels
+        fill = Signal(max=max(n, 2))
+        pending = [Signal(pixel_width + 1, name="pending" + str(i)) for i in range(n - 1)]
+        prefix = [Signal(max=n + 1, name="prefix" + str(i)) for i in range(n + 1)]
+        slots = [Signal(pixel_width + 1, name="slot" + str(j)) for j in range(2*n)]
+        self.comb += prefix[0].eq(0)
+        self.comb += [prefix[i+1].eq(prefix[i] + push_keep[i]) for i in range(n)]
+        for j in range(2*n):
+            cases = [(fill > j, slots[j].eq(pending[j]))] if j < (n - 1) else []
+            cases += [(push_keep[i] & ((fill + prefix[i]) == j), slots[j].eq(push_lanes[i])) for i in range(n)]
+            stmt = If(cases[0][0], cases[0][1])
+            for cond, action in cases[1:]:
+                stmt = stmt.Elif(cond, action)
+            self.comb += stmt
+        total = Signal(max=2*n)
+        self.comb += total.eq(fill + prefix[n])
+
+        # the position of a group is the one of the last pushed group of pixels it holds
+        group_valid = Signal()
+        group = Signal((pixel_width + 1)*n)
+        group_x = Signal(roi_bits)
+        group_y = Signal(roi_bits)
+        sync += [
+            group_valid.eq(0),
+            If(sel_new_frame,
+                # flush the last pixels of the frame
+                group_valid.eq(fill != 0),
+                group.eq(Cat(*slots[:n])),
+                group_x.eq(held_x),
+                group_y.eq(held_y),
+                fill.eq(0)
+            ).Elif(push,
+                If(total >= n,
+                    group_valid.eq(1),
+                    group.eq(Cat(*slots[:n])),
+                    group_x.eq(held_x),
+                    group_y.eq(held_y),
+                    [pending[i].eq(slots[n+i]) for i in range(n - 1)],
+                    fill.eq(total - n)
+                ).Else(
+                    [pending[i].eq(slots[i]) for i in range(n - 1)],
+                    fill.eq(total)
                 )
-            ]
+            )
+        ]
+
+        # start of frame (after the flush of the compaction)
+        self.new_frame = new_frame = Signal()
+        new_frame_d = Signal()
+        sync += [
+            new_frame_d.eq(sel_new_frame),
+            new_frame.eq(new_frame_d)
+        ]
+
+        # pack pixels into words: the groups are written (first pixel in msbs) in a shift register
+        # holding a whole number of groups and words, words are emitted as soon as they are complete
+        group_width = pixel_width*pixels_per_clock
+        if word_width < group_width:
+            raise ValueError("Word width {} is smaller than a group of {} pixels".format(
+                word_width, pixels_per_clock))
+        packer_width = group_width*word_width//gcd(group_width, word_width)
+        ngroups = packer_width//group_width
+        nwords = packer_width//word_width
+        shift_register = Signal(packer_width)
+        words = [shift_register[packer_width - word_width*(i+1):packer_width - word_width*i]
+                 for i in range(nwords)]
+
+        self.cur_word = cur_word = Signal(word_width)
+        self.cur_word_valid = cur_word_valid = Signal()
+        cur_word_index = Signal(max=max(nwords, 2))
+        cur_word_sof = Signal()
+        cur_word_eol = Signal()
+        cur_word_x = Signal(roi_bits)  # position of the last group written to the word
+        cur_word_y = Signal(roi_bits)
+        self.comb += cur_word.eq(Array(words)[cur_word_index])
+
+        group_pixels = [group[(pixel_width + 1)*i:(pixel_width + 1)*i + pixel_width] for i in range(n)]
+        group_eols = [group[(pixel_width + 1)*i + pixel_width] for i in range(n)]
+        encoded_group = Signal(group_width)  # first pixel of the group in msbs
+        self.comb += encoded_group.eq(Cat(*reversed(group_pixels)))
 
+        self.pack_counter = pack_counter = Signal(max=max(ngroups, 2))
+        sof_pending = Signal()
+        eol_pending = Signal()
+        pack_cases = {}
+        flush_cases = {}
+        for k in range(ngroups):
+            start, end = k*group_width, (k + 1)*group_width
+            pack_cases[k] = [shift_register[packer_width - end:packer_width - start].eq(encoded_group)]
+            last_word_start = ((end - 1)//word_width)*word_width
+            if start <= last_word_start and end%word_width:
+                # the group starts a word: clear the rest of the word (padding of a partial word)
+                pack_cases[k].append(shift_register[packer_width - last_word_start - word_width:packer_width - end].eq(0))
+            if end//word_width > start//word_width:
+                # the group completes a word, pixels after the end of the word go in the next one
+                boundary = (end//word_width)*word_width
+                in_word = [start + (i + 1)*pixel_width <= boundary for i in range(n)]
+                pack_cases[k] += [
+                    cur_word_valid.eq(1),
+                    cur_word_index.eq(end//word_width - 1),
+                    cur_word_sof.eq(sof_pending),
+                    cur_word_eol.eq(reduce(or_, [eol_pending] + [group_eols[i] for i in range(n) if in_word[i]])),
+                    sof_pending.eq(0),
+                    eol_pending.eq(reduce(or_, [0] + [group_eols[i] for i in range(n) if not in_word[i]]))
+                ]
+            else:
+                pack_cases[k].append(eol_pending.eq(reduce(or_, [eol_pending] + group_eols)))
+            if start%word_width:
+                # partial word at the end of a frame
+                flush_cases[k] = [
+                    cur_word_valid.eq(1),
+                    cur_word_index.eq(start//word_width)
+                ]
+
+        sync += [
+            cur_word_valid.eq(0),
+            If(new_frame,
+                Case(pack_counter, flush_cases),
+                cur_word_sof.eq(sof_pending),
+                cur_word_eol.eq(eol_pending),
+                sof_pending.eq(1),
+                eol_pending.eq(0),
+                pack_counter.eq(0)
+            ).Elif(group_valid,
+                Case(pack_counter, pack_cases),
+                cur_word_x.eq(group_x),
+                cur_word_y.eq(group_y),
+                If(pack_counter == (ngroups - 1),
+                    pack_counter.eq(0)
+                ).Else(
+                    pack_counter.eq(pack_counter + 1)
+                )
+            )
+        ]
 
         # FIFO
         fifo = stream.AsyncFIFO(word_layout, fifo_depth)
-        fifo = ClockDomainsRenamer({"write": "pix", "read": "sys"})(fifo)
+        fifo = ClockDomainsRenamer({"write": cd, "read": "sys"})(fifo)
         self.submodules += fifo
         self.fifo = fifo
         self.comb += [
             fifo.sink.pixels.eq(cur_word),
+            fifo.sink.sof.eq(cur_word_sof),
+            fifo.sink.eol.eq(cur_word_eol),
             fifo.sink.valid.eq(cur_word_valid)
         ]
-        self.sync.pix += \
-            If(new_frame,
-                fifo.sink.sof.eq(1)
-            ).Elif(cur_word_valid,
-                fifo.sink.sof.eq(0)
-            )
 
         self.comb += [
             fifo.source.connect(self.frame),
@@ -257,7 +1139,7 @@ class FrameExtraction(Module, AutoCSR):
         # overflow detection
         pix_overflow = Signal()
         pix_overflow_reset = Signal()
-        self.sync.pix += [
+        sync += [
             If(fifo.sink.valid & ~fifo.sink.ready,
                 pix_overflow.eq(1)
             ).Elif(pix_overflow_reset,
@@ -267,8 +1149,8 @@ class FrameExtraction(Module, AutoCSR):
 
         sys_overflow = Signal()
         self.specials += MultiReg(pix_overflow, sys_overflow)
-        self.submodules.overflow_reset = PulseSynchronizer("sys", "pix")
-        self.submodules.overflow_reset_ack = PulseSynchronizer("pix", "sys")
+        self.submodules.overflow_reset = PulseSynchronizer("sys", cd)
+        self.submodules.overflow_reset_ack = PulseSynchronizer(cd, "sys")
         self.comb += [
             pix_overflow_reset.eq(self.overflow_reset.o),
             self.overflow_reset_ack.i.eq(pix_overflow_reset)
@@ -285,3 +1167,64 @@ class FrameExtraction(Module, AutoCSR):
             ).Elif(self.overflow_reset_ack.o,
                 overflow_mask.eq(0)
             )
+
+        # position of the first overflow of the frame (carried with the word, not the position of
+        # the selection which is ahead of the FIFO write)
+        overflow_latched = Signal()
+        overflow_x = Signal(roi_bits)
+        overflow_y = Signal(roi_bits)
+        sync += \
+            If(sel_new_frame,
+                overflow_latched.eq(0)
+            ).Elif(fifo.sink.valid & ~fifo.sink.ready & ~overflow_latched,
+                overflow_latched.eq(1),
+                overflow_x.eq(cur_word_x),
+                overflow_y.eq(cur_word_y)
+            )
+        self.specials += [
+            MultiReg(overflow_x, self._overflow_x.status),
+            MultiReg(overflow_y, self._overflow_y.status)
+        ]
+
+        # FIFO level (words written, synchronized to sys, minus words read)
+        level_bits = log2_int(fifo_depth) + 1
+        produce = ClockDomainsRenamer(cd)(GrayCounter(level_bits))
+        produce_decoder = GrayDecoder(level_bits)
+        self.submodules += produce, produce_decoder
+        produce_sys = Signal(level_bits)
+        consume = Signal(level_bits)
+        level = Signal(level_bits)
+        self.specials += MultiReg(produce.q, produce_sys)
+        self.comb += [
+            produce.ce.eq(fifo.sink.valid & fifo.sink.ready),
+            produce_decoder.i.eq(produce_sys),
+            level.eq(produce_decoder.o - consume)
+        ]
+        self.sync += If(fifo.source.valid & fifo.source.ready, consume.eq(consume + 1))
+
+        level_max = Signal(bits_for(fifo_depth))
+        self.sync += \
+            If(fifo.source.valid & fifo.source.ready & fifo.source.sof,
+                self._fifo_level_max.status.eq(level_max),
+                level_max.eq(level)
+            ).Elif(level > level_max,
+                level_max.eq(level)
+            )
+
+        # FIFO level histogram
+        nbins = 16
+        histogram = Array(Signal(32, name="histogram" + str(i)) for i in range(nbins))
+        level_bin = Signal(max=nbins)
+        self.comb += \
+            If(level >= fifo_depth,
+                level_bin.eq(nbins - 1)
+            ).Else(
+                level_bin.eq((level << log2_int(nbins)) >> log2_int(fifo_depth))
+            )
+        self.sync += \
+            If(self._fifo_histogram_clear.re,
+                [histogram[i].eq(0) for i in range(nbins)]
+            ).Elif(histogram[level_bin] != (2**32 - 1),
+                histogram[level_bin].eq(histogram[level_bin] + 1)
+            )
+        self.comb += self._fifo_histogram.status.eq(histogram[self._fifo_histogram_select.storage])
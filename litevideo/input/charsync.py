@@ -2,7 +2,7 @@ from functools import reduce
 from operator import or_
 
 from migen import *
-from migen.genlib.cdc import MultiReg
+from migen.genlib.cdc import MultiReg, BusSynchronizer
 
 from litex.soc.interconnect.csr import *
 
@@ -10,13 +10,25 @@ from litevideo.input.common import control_tokens
 
 
 class CharSync(Module, AutoCSR):
-    def __init__(self, required_controls=8):
+    """Character synchronization
+
+    Finds the alignment of the 10-bit characters in the raw data from runs of required_controls
+    control tokens at the same bit offset.
+
+    By default the offset of the control token found in each word is tracked and must stay the same
+    for required_controls words. With parallel_search, each of the 10 offsets has its own run counter
+    and the first offset completing a run is selected, so that control tokens also matching at
+    another offset don't restart the search. lock_time reports the pixel clock cycles from the reset
+    of the pix clock domain to the synchronization (latched when synced rises, 0 before).
+    """
+    def __init__(self, required_controls=8, parallel_search=False):
         self.raw_data = Signal(10)
         self.synced = Signal()
         self.data = Signal(10)
 
         self._char_synced = CSRStatus()
         self._ctl_pos = CSRStatus(bits_for(9))
+        self._lock_time = CSRStatus(32)
 
         # # #
 
@@ -25,35 +37,78 @@ class CharSync(Module, AutoCSR):
         raw = Signal(20)
         self.comb += raw.eq(Cat(raw_data1, self.raw_data))
 
-        found_control = Signal()
-        control_position = Signal(max=10)
-        self.sync.pix += found_control.eq(0)
-        for i in range(10):
-            self.sync.pix += If(reduce(or_, [raw[i:i+10] == t for t in control_tokens]),
-                  found_control.eq(1),
-                  control_position.eq(i)
-            )
-
-        control_counter = Signal(max=required_controls)
-        previous_control_position = Signal(max=10)
         word_sel = Signal(max=10)
-        self.sync.pix += [
-            If(found_control & (control_position == previous_control_position),
-                If(control_counter == (required_controls - 1),
-                    control_counter.eq(0),
-                    self.synced.eq(1),
-                    word_sel.eq(control_position)
-                ).Else(
-                    control_counter.eq(control_counter + 1)
+
+        if parallel_search:
+            found_controls = Signal(10)
+            self.sync.pix += [found_controls[i].eq(reduce(or_, [raw[i:i+10] == t for t in control_tokens]))
+                for i in range(10)]
+
+            completed = Signal(10)
+            for i in range(10):
+                control_counter = Signal(max=required_controls, name="control_counter" + str(i))
+                self.comb += completed[i].eq(found_controls[i] & (control_counter == (required_controls - 1)))
+                self.sync.pix += \
+                    If(found_controls[i] & ~completed[i],
+                        control_counter.eq(control_counter + 1)
+                    ).Else(
+                        control_counter.eq(0)
+                    )
+
+            # first offset completing its run
+            stmt = If(completed[0], self.synced.eq(1), word_sel.eq(0))
+            for i in range(1, 10):
+                stmt = stmt.Elif(completed[i], self.synced.eq(1), word_sel.eq(i))
+            self.sync.pix += stmt
+        else:
+            found_control = Signal()
+            control_position = Signal(max=10)
+            self.sync.pix += found_control.eq(0)
+            for i in range(10):
+                self.sync.pix += If(reduce(or_, [raw[i:i+10] == t for t in control_tokens]),
+                      found_control.eq(1),
+                      control_position.eq(i)
                 )
-            ).Else(
-                control_counter.eq(0)
+
+            control_counter = Signal(max=required_controls)
+            previous_control_position = Signal(max=10)
+            self.sync.pix += [
+                If(found_control & (control_position == previous_control_position),
+                    If(control_counter == (required_controls - 1),
+                        control_counter.eq(0),
+                        self.synced.eq(1),
+                        word_sel.eq(control_position)
+                    ).Else(
+                        control_counter.eq(control_counter + 1)
+                    )
+                ).Else(
+                    control_counter.eq(0)
+                ),
+                previous_control_position.eq(control_position)
+            ]
+
+        # only the latched value crosses to sys (as a whole word), the counter is not synchronized
+        lock_counter = Signal(32)
+        lock_time = Signal(32)
+        synced_r = Signal()
+        self.sync.pix += [
+            synced_r.eq(self.synced),
+            If(~self.synced & (lock_counter != (2**32 - 1)),
+                lock_counter.eq(lock_counter + 1)
             ),
-            previous_control_position.eq(control_position)
+            If(self.synced & ~synced_r,
+                lock_time.eq(lock_counter)
+            )
         ]
+
         self.specials += [
             MultiReg(self.synced, self._char_synced.status),
             MultiReg(word_sel, self._ctl_pos.status)
         ]
+        self.submodules.sync_lock_time = BusSynchronizer(32, "pix", "sys")
+        self.comb += [
+            self.sync_lock_time.i.eq(lock_time),
+            self._lock_time.status.eq(self.sync_lock_time.o)
+        ]
 
         self.sync.pix += self.data.eq(raw >> word_sel)
@@ -32,6 +32,12 @@ class _Slot(Module, AutoCSR):
         ]
 
 
+# Ring mode: the slots are used as a ring of preconfigured buffers (the _address of the slots),
+# advanced by hardware. Frames are written to slot _producer, slots _consumer to _producer - 1 hold
+# the captured frames and software releases them one by one (oldest first) by writing _release, so
+# that _consumer is only updated by hardware. When a frame completes and the ring is full, either
+# the oldest frame (_ring_policy=0) or the new frame (_ring_policy=1) is dropped and counted in
+# _dropped_frames.
 class _SlotArray(Module, AutoCSR):
     def __init__(self, nslots, addr_bits, alignment_bits):
         self.submodules.ev = EventManager()
@@ -40,13 +46,22 @@ class _SlotArray(Module, AutoCSR):
         self.address_valid = Signal()
         self.address_done = Signal()
 
+        self._ring_enable = CSRStorage()
+        self._ring_policy = CSRStorage()
+        self._producer = CSRStatus(bits_for(nslots - 1))
+        self._consumer = CSRStatus(bits_for(nslots - 1))
+        self._release = CSR()
+        self._dropped_frames = CSRStatus(32)
+
         # # #
 
         slots = [_Slot(addr_bits, alignment_bits) for i in range(nslots)]
         for n, slot in enumerate(slots):
             setattr(self.submodules, "slot"+str(n), slot)
             setattr(self.ev, "slot"+str(n), slot.ev_source)
-        self.ev.finalize()
+        self.ev.frame = EventSourcePulse()
+
+        ring = self._ring_enable.storage
 
         change_slot = Signal()
         current_slot = Signal(max=nslots)
@@ -54,29 +69,106 @@ class _SlotArray(Module, AutoCSR):
                          for n, slot in reversed(list(enumerate(slots)))])
         self.comb += change_slot.eq(~self.address_valid | self.address_done)
 
+        producer = self._producer.status
+        producer_next = Signal(max=nslots)
+        consumer = self._consumer.status
+        consumer_next = Signal(max=nslots)
         self.comb += [
-            self.address.eq(Array(slot.address for slot in slots)[current_slot]),
-            self.address_valid.eq(Array(slot.address_valid for slot in slots)[current_slot])
+            producer_next.eq(Mux(producer == (nslots - 1), 0, producer + 1)),
+            consumer_next.eq(Mux(consumer == (nslots - 1), 0, consumer + 1))
         ]
+
+        self.comb += \
+            If(ring,
+                self.address.eq(Array(slot.address for slot in slots)[producer]),
+                self.address_valid.eq(1)
+            ).Else(
+                self.address.eq(Array(slot.address for slot in slots)[current_slot]),
+                self.address_valid.eq(Array(slot.address_valid for slot in slots)[current_slot])
+            )
         self.comb += [slot.address_reached.eq(self.address_reached) for slot in slots]
-        self.comb += [slot.address_done.eq(self.address_done & (current_slot == n))
+        self.comb += [slot.address_done.eq(self.address_done & ~ring & (current_slot == n))
                           for n, slot in enumerate(slots)]
 
+        # ring advance (a slot released on the cycle a frame completes is available to this frame)
+        release = Signal()
+        full = Signal()
+        self.comb += [
+            release.eq(self._release.re & (consumer != producer)),
+            full.eq((producer_next == consumer) & ~release),
+            self.ev.frame.trigger.eq(ring & self.address_done & (~full | ~self._ring_policy.storage))
+        ]
+        self.sync += [
+            If(~ring,
+                consumer.eq(0)
+            ).Elif(release | (self.address_done & full & ~self._ring_policy.storage),
+                consumer.eq(consumer_next)
+            ),
+            If(~ring,
+                producer.eq(0)
+            ).Elif(self.address_done,
+                If(~full | ~self._ring_policy.storage,
+                    producer.eq(producer_next)
+                ),
+                If(full,
+                    self._dropped_frames.status.eq(self._dropped_frames.status + 1)
+                )
+            )
+        ]
+
 
 class DMA(Module):
-    def __init__(self, dram_port, nslots):
+    """DMA
+
+    Writes the captured frames to the memory slots.
+
+    Words are written in aligned bursts of burst_length words: a burst is only started once all its
+    words are available, so that bursts are issued back to back to the DRAM controller. The cycles
+    during which a write had to wait for the DRAM in the last frame are reported in
+    _write_stall_cycles.
+
+    The capture progress of the current frame is reported in _lines_done (lines written to memory,
+    from the eol flags of the words) and the lines event is generated every _lines_per_event lines
+    (0 disables it), so that software can start processing a frame before it is complete.
+
+    While pause is set (e.g. after an input mode change), the frames are dropped and a frame being
+    written is aborted (its slot stays loaded and is reused by the next frame).
+
+    The skipped event is generated on each frame_skipped pulse (frames not captured because of the
+    frame rate divider of the FrameExtraction), so that software knows when no frame is coming.
+    """
+    def __init__(self, dram_port, nslots, burst_length=1):
         bus_aw = dram_port.aw
         bus_dw = dram_port.dw
         alignment_bits = bits_for(bus_dw//8) - 1
 
         fifo_word_width = bus_dw
-        self.frame = stream.Endpoint([("sof", 1), ("pixels", fifo_word_width)])
+        self.frame = stream.Endpoint([("sof", 1), ("eol", 1), ("pixels", fifo_word_width)])
+        self.pause = Signal()
+        self.frame_skipped = Signal()
         self._frame_size = CSRStorage(bus_aw + alignment_bits)
+        self._write_stall_cycles = CSRStatus(32)
+        self._lines_done = CSRStatus(16)
+        self._lines_per_event = CSRStorage(16)
         self.submodules._slot_array = _SlotArray(nslots, bus_aw, alignment_bits)
         self.ev = self._slot_array.ev
+        self.ev.lines = EventSourcePulse()
+        self.ev.skipped = EventSourcePulse()
+        self.ev.finalize()
+
+        assert burst_length == 2**log2_int(burst_length)
 
         # # #
 
+        # burst coalescing
+        if burst_length > 1:
+            coalescer = stream.SyncFIFO([("sof", 1), ("eol", 1), ("pixels", fifo_word_width)], 2*burst_length)
+            self.submodules += coalescer
+            self.comb += self.frame.connect(coalescer.sink)
+            frame = coalescer.source
+        else:
+            frame = self.frame
+
         # address generator + maximum memory word count to prevent DMA buffer
         # overrun
         reset_words = Signal()
@@ -91,7 +183,9 @@ class DMA(Module):
         self.sync += [
             If(reset_words,
                 current_address.eq(self._slot_array.address),
-                mwords_remaining.eq(self._frame_size.storage[alignment_bits:])
+                # the last word of a frame can be partial (with rgb24)
+                mwords_remaining.eq(self._frame_size.storage[alignment_bits:] +
+                                    (self._frame_size.storage[:alignment_bits] != 0))
             ).Elif(count_word,
                 current_address.eq(current_address + 1),
                 mwords_remaining.eq(mwords_remaining - 1)
@@ -101,48 +195,140 @@ class DMA(Module):
         memory_word = Signal(bus_dw)
         pixbits = []
         for i in range(bus_dw//16):
-            pixbits.append(self.frame.pixels)
+            pixbits.append(frame.pixels)
         self.comb += memory_word.eq(Cat(*pixbits))
 
         # bus accessor
-        self.submodules._bus_accessor = LiteDRAMDMAWriter(dram_port)
+        self.submodules._bus_accessor = LiteDRAMDMAWriter(dram_port, max(16, burst_length))
         self.comb += [
             self._bus_accessor.sink.address.eq(current_address),
             self._bus_accessor.sink.data.eq(memory_word)
         ]
 
+        # writes in flight (accepted by the bus accessor, not yet written to the DRAM)
+        issued = Signal()
+        written = Signal()
+        writes_pending = Signal(max=max(16, burst_length) + 2)
+        self.comb += [
+            issued.eq(self._bus_accessor.sink.valid & self._bus_accessor.sink.ready),
+            written.eq(dram_port.wdata.valid & dram_port.wdata.ready)
+        ]
+        self.sync += writes_pending.eq(writes_pending + issued - written)
+
+        # lines progress: the eol flags follow the writes in flight and lines are counted once written
+        eol_fifo = stream.SyncFIFO([("eol", 1)], max(16, burst_length) + 2)
+        self.submodules += eol_fifo
+        self.comb += [
+            eol_fifo.sink.valid.eq(issued),
+            eol_fifo.sink.eol.eq(frame.eol),
+            eol_fifo.source.ready.eq(written)
+        ]
+        line_written = Signal()
+        lines_done = self._lines_done.status
+        lines_since_event = Signal(16)
+        self.comb += [
+            line_written.eq(written & eol_fifo.source.eol),
+            self.ev.lines.trigger.eq(line_written & (self._lines_per_event.storage != 0) &
+                                     (lines_since_event == (self._lines_per_event.storage - 1)))
+        ]
+
+        # skipped frames
+        self.comb += self.ev.skipped.trigger.eq(self.frame_skipped)
+
+        # bursts: the words up to the next aligned address (or the end of the frame) must be available
+        burst_active = Signal()
+        burst_ready = Signal()
+        if burst_length > 1:
+            burst_words = Signal(max=burst_length + 1)
+            self.comb += [
+                burst_words.eq(burst_length - current_address[:log2_int(burst_length)]),
+                If(mwords_remaining < burst_words,
+                    burst_ready.eq(coalescer.level >= mwords_remaining)
+                ).Else(
+                    burst_ready.eq(coalescer.level >= burst_words)
+                )
+            ]
+            self.sync += \
+                If(reset_words,
+                    burst_active.eq(0)
+                ).Elif(count_word,
+                    burst_active.eq(current_address[:log2_int(burst_length)] != (burst_length - 1))
+                )
+        else:
+            self.comb += burst_ready.eq(1)
+
+        # write stall cycles
+        stall = Signal()
+        stall_cycles = Signal(32)
+        self.sync += \
+            If(reset_words,
+                stall_cycles.eq(0)
+            ).Elif(stall,
+                stall_cycles.eq(stall_cycles + 1)
+            )
+
+        self.sync += \
+            If(reset_words & frame.valid & frame.sof,
+                lines_done.eq(0),
+                lines_since_event.eq(0)
+            ).Elif(line_written,
+                lines_done.eq(lines_done + 1),
+                If(self.ev.lines.trigger,
+                    lines_since_event.eq(0)
+                ).Else(
+                    lines_since_event.eq(lines_since_event + 1)
+                )
+            )
+
         # control FSM
         fsm = FSM()
         self.submodules += fsm
 
         fsm.act("WAIT_SOF",
             reset_words.eq(1),
-            self.frame.ready.eq(~self._slot_array.address_valid |
-                                ~self.frame.sof),
+            frame.ready.eq(~self._slot_array.address_valid |
+                           ~frame.sof |
+                           self.pause),
             If(self._slot_array.address_valid &
-               self.frame.sof &
-               self.frame.valid,
+               frame.sof &
+               frame.valid &
+               ~self.pause,
                NextState("TRANSFER_PIXELS")
             )
         )
         fsm.act("TRANSFER_PIXELS",
-            self.frame.ready.eq(self._bus_accessor.sink.ready),
-            If(self.frame.valid,
-                self._bus_accessor.sink.valid.eq(1),
-                If(self._bus_accessor.sink.ready,
-                    count_word.eq(1),
-                    If(last_word,
-                        NextState("EOF")
+            If(self.pause,
+                NextState("ABORT")
+            ).Elif(frame.valid & (burst_active | burst_ready),
+                If(eol_fifo.sink.ready,
+                    frame.ready.eq(self._bus_accessor.sink.ready),
+                    self._bus_accessor.sink.valid.eq(1),
+                    stall.eq(~self._bus_accessor.sink.ready),
+                    If(self._bus_accessor.sink.ready,
+                        count_word.eq(1),
+                        If(last_word,
+                            NextState("EOF")
+                        )
                     )
+                ).Else(
+                    # no room for the eol flag of the word
+                    stall.eq(1)
                 )
             )
         )
         fsm.act("EOF",
-            If(~dram_port.wdata.valid,
+            If(writes_pending == 0,
                 self._slot_array.address_done.eq(1),
+                NextValue(self._write_stall_cycles.status, stall_cycles),
+                NextState("WAIT_SOF")
+            )
+        )
+        fsm.act("ABORT",
+            If(writes_pending == 0,
                 NextState("WAIT_SOF")
             )
         )
 
     def get_csrs(self):
-        return [self._frame_size] + self._slot_array.get_csrs()
+        return [self._frame_size, self._write_stall_cycles,
+                self._lines_done, self._lines_per_event] + self._slot_array.get_csrs()
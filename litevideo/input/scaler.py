@@ -0,0 +1,199 @@
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import *
+
+
+class Downscaler(Module, AutoCSR):
+    """Downscaler
+
+    Downscales the frames by hfactor x vfactor (1 to max_factor) with a box filter: each output pixel
+    is the average of a box of hfactor x vfactor source pixels. The boxes not entirely in the frame
+    (on the right and bottom edges) are dropped.
+
+    The horizontal sums are accumulated on the fly and the vertical sums in a line memory. The
+    output lines are buffered and replayed at the pixel rate right after the last source line of
+    their boxes, so the outputs have the same timings (valid, vsync, de, r, g, b) as the inputs and
+    can be fed to a FrameExtraction.
+    """
+    def __init__(self, max_hres=2048, max_factor=8):
+        # in pix clock domain
+        self.valid_i = Signal()
+        self.vsync_i = Signal()
+        self.de_i = Signal()
+        self.r_i = Signal(8)
+        self.g_i = Signal(8)
+        self.b_i = Signal(8)
+
+        self.valid_o = Signal()
+        self.vsync_o = Signal()
+        self.de_o = Signal()
+        self.r_o = Signal(8)
+        self.g_o = Signal(8)
+        self.b_o = Signal(8)
+
+        self._hfactor = CSRStorage(bits_for(max_factor), reset=1)
+        self._vfactor = CSRStorage(bits_for(max_factor), reset=1)
+
+        # # #
+
+        hfactor = Signal(bits_for(max_factor))
+        vfactor = Signal(bits_for(max_factor))
+        self.specials += [
+            MultiReg(self._hfactor.storage, hfactor, "pix"),
+            MultiReg(self._vfactor.storage, vfactor, "pix")
+        ]
+
+        # average = (sum*reciprocal + 0.5) >> 16
+        area = Signal(max=max_factor**2 + 1)
+        reciprocal = Signal(17)
+        reciprocals = Array([0] + [(2**16 + n//2)//n for n in range(1, max_factor**2 + 1)])
+        self.sync.pix += [
+            area.eq(hfactor*vfactor),
+            reciprocal.eq(reciprocals[area])
+        ]
+
+        pixel_valid = Signal()
+        de_r = Signal()
+        vsync_r = Signal()
+        line_end = Signal()
+        new_frame = Signal()
+        self.comb += [
+            pixel_valid.eq(self.valid_i & self.de_i),
+            line_end.eq(de_r & ~self.de_i),
+            new_frame.eq(self.vsync_i & ~vsync_r)
+        ]
+        self.sync.pix += [
+            de_r.eq(self.de_i),
+            vsync_r.eq(self.vsync_i)
+        ]
+
+        hsum_bits = 8 + bits_for(max_factor - 1)
+        vsum_bits = 8 + bits_for(max_factor**2 - 1)
+        channels = [self.r_i, self.g_i, self.b_i]
+
+        # horizontal sums
+        px = Signal(max=max_factor)  # pixel in the box
+        ox = Signal(max=max_hres)    # output pixel
+        ly = Signal(max=max_factor)  # line in the box
+        last_line = Signal()
+        self.comb += last_line.eq(ly == (vfactor - 1))
+
+        hacc = [Signal(hsum_bits) for c in channels]
+        hsum = [Signal(hsum_bits) for c in channels]
+        hdone = Signal()
+        self.comb += [
+            [hsum[i].eq(Mux(px == 0, 0, hacc[i]) + c) for i, c in enumerate(channels)],
+            hdone.eq(pixel_valid & (px == (hfactor - 1)))
+        ]
+        self.sync.pix += [
+            If(~self.de_i,
+                px.eq(0),
+                ox.eq(0)
+            ).Elif(pixel_valid,
+                [hacc[i].eq(hsum[i]) for i in range(len(channels))],
+                If(hdone,
+                    px.eq(0),
+                    ox.eq(ox + 1)
+                ).Else(
+                    px.eq(px + 1)
+                )
+            ),
+            If(new_frame,
+                ly.eq(0)
+            ).Elif(line_end,
+                If(last_line,
+                    ly.eq(0)
+                ).Else(
+                    ly.eq(ly + 1)
+                )
+            )
+        ]
+
+        # vertical sums
+        vacc = Memory(3*vsum_bits, max_hres)
+        vacc_rdport = vacc.get_port(clock_domain="pix")
+        vacc_wrport = vacc.get_port(write_capable=True, clock_domain="pix")
+        self.specials += vacc, vacc_rdport, vacc_wrport
+
+        stage1 = Record([("valid", 1), ("first", 1), ("last", 1), ("x", len(ox))] +
+                        [("hsum" + str(i), hsum_bits) for i in range(len(channels))])
+        self.sync.pix += [
+            stage1.valid.eq(hdone),
+            stage1.first.eq(ly == 0),
+            stage1.last.eq(last_line),
+            stage1.x.eq(ox),
+            [getattr(stage1, "hsum" + str(i)).eq(hsum[i]) for i in range(len(channels))]
+        ]
+
+        vsum = [Signal(vsum_bits) for c in channels]
+        self.comb += [
+            vacc_rdport.adr.eq(ox),
+            [vsum[i].eq(Mux(stage1.first, 0, vacc_rdport.dat_r[vsum_bits*i:vsum_bits*(i+1)]) +
+                        getattr(stage1, "hsum" + str(i))) for i in range(len(channels))],
+            vacc_wrport.adr.eq(stage1.x),
+            vacc_wrport.dat_w.eq(Cat(*vsum)),
+            vacc_wrport.we.eq(stage1.valid & ~stage1.last)
+        ]
+
+        stage2 = Record([("valid", 1), ("x", len(ox))] +
+                        [("vsum" + str(i), vsum_bits) for i in range(len(channels))])
+        self.sync.pix += [
+            stage2.valid.eq(stage1.valid & stage1.last),
+            stage2.x.eq(stage1.x),
+            [getattr(stage2, "vsum" + str(i)).eq(vsum[i]) for i in range(len(channels))]
+        ]
+
+        # averages, written to the output line memory
+        averages = []
+        for i in range(len(channels)):
+            product = Signal(vsum_bits + 17 + 1)
+            self.comb += product.eq(getattr(stage2, "vsum" + str(i))*reciprocal + 2**15)
+            averages.append(product[16:24])
+        line = Memory(24, max_hres)
+        line_rdport = line.get_port(clock_domain="pix")
+        line_wrport = line.get_port(write_capable=True, clock_domain="pix")
+        self.specials += line, line_rdport, line_wrport
+        self.comb += [
+            line_wrport.adr.eq(stage2.x),
+            line_wrport.dat_w.eq(Cat(*averages)),
+            line_wrport.we.eq(stage2.valid)
+        ]
+
+        # output lines replay, once the last average of the line is written
+        replay_start = Signal()
+        replay_length = Signal(max=max_hres + 1)
+        start_delay = [Signal() for i in range(2)]
+        self.sync.pix += [
+            start_delay[0].eq(line_end & last_line),
+            start_delay[1].eq(start_delay[0]),
+            replay_start.eq(start_delay[1]),
+            If(line_end & last_line,
+                replay_length.eq(ox)
+            )
+        ]
+
+        replay = Signal()
+        rx = Signal(max=max_hres + 1)
+        self.comb += line_rdport.adr.eq(rx)
+        self.sync.pix += \
+            If(replay_start,
+                replay.eq(replay_length != 0),
+                rx.eq(0)
+            ).Elif(replay,
+                If(rx == (replay_length - 1),
+                    replay.eq(0)
+                ),
+                rx.eq(rx + 1)
+            )
+
+        self.sync.pix += [
+            self.valid_o.eq(self.valid_i),
+            self.vsync_o.eq(self.vsync_i),
+            self.de_o.eq(replay)
+        ]
+        self.comb += [
+            self.r_o.eq(line_rdport.dat_r[:8]),
+            self.g_o.eq(line_rdport.dat_r[8:16]),
+            self.b_o.eq(line_rdport.dat_r[16:24])
+        ]
@@ -0,0 +1,90 @@
+import random
+
+from migen import *
+
+from litevideo.input.charsync import CharSync
+from litevideo.input.common import control_tokens
+
+
+required_controls = 8
+
+
+def aliasing_word(token, prng):
+    # data word forming a control token at another offset with the token that follows it
+    while True:
+        word = prng.randrange(1024)
+        raw = word | (token << 10)
+        if word not in control_tokens and any((raw >> i) & 0x3ff in control_tokens for i in range(1, 10)):
+            return word
+
+
+def characters():
+    prng = random.Random(3)
+    words = []
+    # blanking runs too short to synchronize
+    for i in range(3):
+        words += [prng.randrange(1024) for i in range(12)]
+        words += [prng.choice(control_tokens) for i in range(required_controls - 1)]
+    # runs of required_controls control tokens, a control token also matching at another offset
+    # before the first one
+    for i in range(4):
+        token = prng.choice(control_tokens)
+        words += [prng.randrange(1024) for i in range(11)] + [aliasing_word(token, prng), token]
+        words += [prng.choice(control_tokens) for i in range(required_controls - 1)]
+    # longer runs
+    for i in range(4):
+        words += [prng.randrange(1024) for i in range(12)]
+        words += [prng.choice(control_tokens) for i in range(required_controls + 4)]
+    return words
+
+
+def first_run_end(words):
+    # index of the word completing the first run of required_controls control tokens
+    count = 0
+    for n, word in enumerate(words):
+        count = count + 1 if word in control_tokens else 0
+        if count == required_controls:
+            return n
+
+
+def raw_generator(dut, words, offset, status):
+    # serialized characters (lsb first), shifted by offset bits
+    bits = [0]*offset + [(word >> i) & 1 for word in words for i in range(10)]
+    data = []
+    for n in range(len(bits)//10):
+        yield dut.raw_data.eq(sum(b << i for i, b in enumerate(bits[10*n:10*n + 10])))
+        yield
+        if (yield dut.synced):
+            status.setdefault("synced", n)
+            data.append((yield dut.data))
+    for i in range(8):
+        yield
+    status["ctl_pos"] = (yield dut._ctl_pos.status)
+    status["lock_time"] = (yield dut._lock_time.status)
+    status["data"] = data
+
+
+def check(parallel_search, offset):
+    dut = CharSync(required_controls, parallel_search)
+    words = characters()
+    status = {}
+    run_simulation(dut, {"pix": [raw_generator(dut, words, offset, status)]}, {"pix": 10, "sys": 10})
+
+    print("parallel_search: {}, offset: {}, {}".format(parallel_search, offset,
+        {k: v for k, v in status.items() if k != "data"}))
+    if parallel_search:
+        # synchronized by the first complete run
+        assert 0 <= status["synced"] - first_run_end(words) <= 3
+    assert status["ctl_pos"] == offset
+    # lock time in pix cycles from the reset
+    assert abs(status["lock_time"] - status["synced"]) <= 1
+    # the characters are realigned (with the latency of the realignment)
+    data = status["data"][-32:]
+    assert any(words[n:n + len(data)] == data for n in range(len(words)))
+    return status["synced"]
+
+
+if __name__ == "__main__":
+    for offset in [0, 3, 7, 9]:
+        # the run following the aliasing control token restarts the sequential search only
+        assert check(True, offset) < check(False, offset)
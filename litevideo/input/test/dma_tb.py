@@ -0,0 +1,172 @@
+import random
+
+from migen import *
+
+from litex.soc.interconnect.csr import AutoCSR
+from litex.soc.interconnect.csr_bus import CSRBankArray
+
+from litedram.common import LiteDRAMPort
+
+from litevideo.input.dma import DMA
+
+
+class TB(Module, AutoCSR):
+    def __init__(self, nslots, burst_length=1, with_csr_bank=True):
+        self.dram_port = LiteDRAMPort(mode="write", aw=32, dw=32)
+        self.submodules.dma = DMA(self.dram_port, nslots, burst_length)
+        if with_csr_bank:
+            # the slot status/address written by the DMA are updated by the CSR bank
+            self.submodules.csr_bank = CSRBankArray(self, lambda name, memory: 0)
+
+
+@passive
+def dram_generator(dram_port, memory, throttle):
+    # memory: word address -> data, the command and data are accepted randomly when throttled
+    prng = random.Random(1)
+    pending = []
+    while True:
+        yield dram_port.cmd.ready.eq(not throttle or prng.random() < 0.9)
+        yield dram_port.wdata.ready.eq(len(pending) > 0 and (not throttle or prng.random() < 0.7))
+        yield
+        if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+            pending.append((yield dram_port.cmd.adr))
+        if (yield dram_port.wdata.valid) and (yield dram_port.wdata.ready):
+            memory[pending.pop(0)] = (yield dram_port.wdata.data)
+
+
+def frame_generator(dut, words, prng=None):
+    i = 0
+    while i < len(words):
+        yield dut.frame.valid.eq(prng is None or prng.random() < 0.5)
+        yield dut.frame.sof.eq(i == 0)
+        yield dut.frame.pixels.eq(words[i])
+        yield
+        if (yield dut.frame.valid) and (yield dut.frame.ready):
+            i += 1
+    yield dut.frame.valid.eq(0)
+
+
+# burst coalescing
+
+frame_words = 40
+base = 0x103  # unaligned
+
+
+@passive
+def burst_monitor_generator(dut, burst_length, gaps):
+    # a burst that has started must be issued back to back, up to its last (aligned) word
+    in_burst = False
+    while True:
+        valid = (yield dut._bus_accessor.sink.valid)
+        if in_burst and not valid:
+            gaps.append(address)
+        if valid and (yield dut._bus_accessor.sink.ready):
+            address = (yield dut._bus_accessor.sink.address)
+            in_burst = (address + 1)%burst_length != 0 and address + 1 < base + frame_words
+        yield
+
+
+def burst_generator(dut, status):
+    prng = random.Random(2)
+    yield dut._frame_size.storage.eq(frame_words*4)
+    yield dut._slot_array.slot0._address.storage.eq(base*4)
+    yield dut._slot_array.slot0._status.storage.eq(1)
+    for i in range(4):
+        yield
+    yield from frame_generator(dut, [0x1000 + i for i in range(frame_words)], prng)
+    for i in range(256):
+        yield
+    status["slot_status"] = (yield dut._slot_array.slot0._status.storage)
+    status["slot_address"] = (yield dut._slot_array.slot0._address.storage)
+    status["write_stall_cycles"] = (yield dut._write_stall_cycles.status)
+
+
+def check_bursts(burst_length):
+    tb = TB(2, burst_length)
+    memory = {}
+    gaps = []
+    status = {}
+    generators = [
+        burst_generator(tb.dma, status),
+        burst_monitor_generator(tb.dma, burst_length, gaps),
+        dram_generator(tb.dram_port, memory, throttle=True)
+    ]
+    run_simulation(tb, generators)
+
+    print("burst_length: {}, {}".format(burst_length, status))
+    assert [memory.get(base + i) for i in range(frame_words)] == [0x1000 + i for i in range(frame_words)]
+    assert len(memory) == frame_words
+    assert gaps == [], "bursts interrupted after {}".format(gaps)
+    # the slot is pending with the end address of the frame
+    assert status["slot_status"] == 2
+    assert status["slot_address"] == (base + frame_words)*4
+    assert status["write_stall_cycles"] > 0
+
+
+# ring mode
+
+nslots = 3
+ring_frame_words = 8
+ring_bases = [0x400, 0x800, 0xc00]
+
+
+def ring_generator(dut, policy, nframes, release_after, status):
+    slot_array = dut._slot_array
+    yield dut._frame_size.storage.eq(ring_frame_words*4)
+    for n, address in enumerate(ring_bases):
+        yield getattr(slot_array, "slot" + str(n))._address.storage.eq(address*4)
+    yield slot_array._ring_enable.storage.eq(1)
+    yield slot_array._ring_policy.storage.eq(policy)
+    events = 0
+    for frame in range(nframes):
+        yield from frame_generator(dut, [(frame << 8) + i for i in range(ring_frame_words)])
+        if frame in release_after:
+            # software is done with the oldest frame
+            yield slot_array._release.re.eq(1)
+            yield
+            yield slot_array._release.re.eq(0)
+        for i in range(32):
+            events += (yield slot_array.ev.frame.trigger)
+            yield
+    status["producer"] = (yield slot_array._producer.status)
+    status["consumer"] = (yield slot_array._consumer.status)
+    status["dropped_frames"] = (yield slot_array._dropped_frames.status)
+    status["events"] = events
+
+
+def check_ring(policy):
+    # without CSR bank, so that _release can be pulsed by the generator
+    tb = TB(nslots, with_csr_bank=False)
+    memory = {}
+    status = {}
+    nframes = 5
+    generators = [
+        ring_generator(tb.dma, policy, nframes, [2], status),
+        dram_generator(tb.dram_port, memory, throttle=False)
+    ]
+    run_simulation(tb, generators)
+
+    print("ring_policy: {}, {}".format(policy, status))
+    # frame held by each slot
+    slots = [memory[address] >> 8 for address in ring_bases]
+    if policy == 0:
+        # the oldest frames are dropped, the ring holds the last frames
+        kept = [3, 4]
+    else:
+        # the new frames are dropped, the ring holds the frames before the ring was full
+        kept = [1, 2]
+    held = []
+    consumer = status["consumer"]
+    while consumer != status["producer"]:
+        held.append(slots[consumer])
+        consumer = (consumer + 1)%nslots
+    assert held == kept
+    assert status["dropped_frames"] == 2
+    assert status["events"] == nframes - (status["dropped_frames"] if policy else 0)
+
+
+if __name__ == "__main__":
+    for burst_length in [1, 4, 8]:
+        check_bursts(burst_length)
+    for policy in [0, 1]:
+        check_ring(policy)
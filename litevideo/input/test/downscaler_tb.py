@@ -0,0 +1,93 @@
+import random
+
+from migen import *
+
+from litevideo.input.scaler import Downscaler
+
+
+hres, vres = 20, 9
+hblank, vblank = 10, 5
+nframes = 3
+
+
+def image(frame):
+    prng = random.Random(frame)
+    return [[(prng.randrange(256), prng.randrange(256), prng.randrange(256)) for x in range(hres)]
+            for y in range(vres)]
+
+
+def reference(pixels, hfactor, vfactor):
+    # box filter, the partial boxes on the right and bottom edges are dropped
+    area = hfactor*vfactor
+    reciprocal = (2**16 + area//2)//area
+    lines = []
+    for by in range(vres//vfactor):
+        line = []
+        for bx in range(hres//hfactor):
+            box = [pixels[by*vfactor + j][bx*hfactor + i] for j in range(vfactor) for i in range(hfactor)]
+            line.append(tuple(((sum(p[c] for p in box)*reciprocal + 2**15) >> 16) & 0xff for c in range(3)))
+        lines.append(line)
+    return lines
+
+
+def pix_generator(dut, hfactor, vfactor):
+    yield dut._hfactor.storage.eq(hfactor)
+    yield dut._vfactor.storage.eq(vfactor)
+    for i in range(8):
+        yield
+    yield dut.valid_i.eq(1)
+    for frame in range(nframes):
+        pixels = image(frame)
+        for y in range(vres + vblank):
+            for x in range(hres + hblank):
+                de = x < hres and y < vres
+                r, g, b = pixels[y][x] if de else (0, 0, 0)
+                yield dut.de_i.eq(int(de))
+                yield dut.vsync_i.eq(int(y == vres + 2))
+                yield dut.r_i.eq(r)
+                yield dut.g_i.eq(g)
+                yield dut.b_i.eq(b)
+                yield
+    for i in range(hres + hblank):
+        yield
+
+
+@passive
+def capture_generator(dut, frames):
+    # frames of lines of pixels, from the output timings
+    line = []
+    de_r = 0
+    vsync_r = 0
+    while True:
+        if (yield dut.valid_o):
+            de = (yield dut.de_o)
+            vsync = (yield dut.vsync_o)
+            if vsync and not vsync_r:
+                frames.append([])
+            if de:
+                line.append(((yield dut.r_o), (yield dut.g_o), (yield dut.b_o)))
+            elif de_r:
+                if frames:
+                    frames[-1].append(line)
+                line = []
+            de_r = de
+            vsync_r = vsync
+        yield
+
+
+def check(hfactor, vfactor):
+    dut = Downscaler(max_hres=64)
+    frames = []
+    generators = {"pix": [pix_generator(dut, hfactor, vfactor), capture_generator(dut, frames)]}
+    run_simulation(dut, generators, {"pix": 10, "sys": 10})
+
+    print("{}x{}: {} frames".format(hfactor, vfactor, len(frames)))
+    # frames are captured from the vsync of the previous frame (the last one has no pixels)
+    assert len(frames) == nframes and frames[-1] == []
+    for frame, lines in enumerate(frames[:-1], 1):
+        assert lines == reference(image(frame), hfactor, vfactor), "frame {:d}".format(frame)
+
+
+if __name__ == "__main__":
+    for hfactor, vfactor in [(1, 1), (2, 2), (3, 2), (4, 3), (8, 8)]:
+        check(hfactor, vfactor)
@@ -0,0 +1,221 @@
+from migen import *
+
+from litevideo.input.analysis import FrameExtraction
+
+
+pixel_widths = {"ycbcr422": 16, "rgb": 32, "rgb24": 24, "rgb565": 16, "y8": 8}
+
+word_width = 64
+hblank = 10
+vblank = 4
+resolutions = [(16, 8), (16, 8), (12, 6), (12, 6)]  # resolution change on the third frame
+
+
+def rgb(x, y):
+    return (x*17 + y*5) & 0xff, (x*3 + y*29) & 0xff, (255 - x*11 - y) & 0xff
+
+
+def encode(mode, r, g, b):
+    if mode in ["rgb", "rgb24"]:
+        return b | (g << 8) | (r << 16)
+    if mode == "rgb565":
+        return (r >> 3) | ((g >> 2) << 5) | ((b >> 3) << 11)
+    return None  # converted to luma/chroma
+
+
+fifo_depth = 64
+
+
+class TB(Module):
+    def __init__(self, mode, pixels_per_clock):
+        cd = "pix" if pixels_per_clock == 1 else "capture"
+        self.submodules.frame = FrameExtraction(word_width, fifo_depth, mode, pixels_per_clock, cd)
+
+
+def pix_generator(dut):
+    yield dut.valid_i.eq(1)
+    for i in range(8):
+        yield
+    for hres, vres in resolutions:
+        # vsync first, so that the first line of the capture follows the reset or the change
+        for y in range(vres + vblank):
+            for x in range(hres + hblank):
+                r, g, b = rgb(x, y - 2)
+                yield dut.vsync.eq(int(y == 0))
+                yield dut.de.eq(int(x < hres and 2 <= y < 2 + vres))
+                yield dut.r.eq(r)
+                yield dut.g.eq(g)
+                yield dut.b.eq(b)
+                yield
+    yield dut.vsync.eq(1)
+    for i in range(256):
+        yield
+
+
+def capture_generator(dut, words):
+    yield dut.frame.ready.eq(1)
+    while True:
+        if (yield dut.frame.valid):
+            words.append(((yield dut.frame.sof), (yield dut.frame.eol), (yield dut.frame.pixels)))
+        yield
+
+
+def capture(mode, pixels_per_clock, parameters):
+    tb = TB(mode, pixels_per_clock)
+    words = []
+    status = {}
+
+    def config_generator():
+        for name, value in parameters.items():
+            yield getattr(tb.frame, "_" + name).storage.eq(value)
+
+    @passive
+    def skipped_generator():
+        while True:
+            status["skipped_frames"] = (yield tb.frame._skipped_frames.status)
+            yield
+
+    generators = {
+        "pix": [config_generator(), pix_generator(tb.frame)],
+        "sys": [passive(capture_generator)(tb.frame, words), skipped_generator()]
+    }
+    clocks = {"sys": 10, "pix": 10}
+    if pixels_per_clock > 1:
+        clocks["capture"] = 10*pixels_per_clock
+    run_simulation(tb, generators, clocks)
+
+    # frames of (pixels, indexes of the eol words)
+    frames = []
+    for sof, eol, data in words:
+        if sof:
+            frames.append(([], []))
+        if frames:
+            frames[-1][0].append(data)
+            if eol:
+                frames[-1][1].append(len(frames[-1][0]) - 1)
+    pixel_width = pixel_widths[mode]
+    captured = []
+    for data, eols in frames:
+        bits = "".join("{:0{}b}".format(d, word_width) for d in data)
+        pixels = [int(bits[i:i+pixel_width], 2) for i in range(0, len(bits) - pixel_width + 1, pixel_width)]
+        captured.append((pixels, eols))
+    return captured, status["skipped_frames"]
+
+
+def model(mode, full, hres, vres, parameters):
+    # pixels and indexes of the eol words of a frame, from the full frame
+    x0 = parameters.get("roi_x", 0)
+    y0 = parameters.get("roi_y", 0)
+    if mode == "ycbcr422":
+        x0 &= ~1
+    width = min(parameters.get("roi_width", 0) or hres, hres - x0)
+    height = min(parameters.get("roi_height", 0) or vres, vres - y0)
+    hstep = 2**parameters.get("hdecimation", 0)
+    vstep = 2**parameters.get("vdecimation", 0)
+    pixels = []
+    eols = []
+    for y in range(y0, y0 + height, vstep):
+        for i, x in enumerate(range(x0, x0 + width, hstep)):
+            p = full[y*hres + x]
+            if mode == "ycbcr422" and hstep > 1 and i%2:
+                # odd pixels take the chroma of the other pixel of the pair
+                p = (p & 0xff) | (full[y*hres + x + 1] & 0xff00)
+            pixels.append(p)
+        eol = (len(pixels)*pixel_widths[mode] - 1)//word_width
+        if eol not in eols:
+            eols.append(eol)  # lines can end in the same word
+    return pixels, eols
+
+
+def check_fifo_monitoring(pixels_per_clock):
+    # the frames are only read after the start of the second frame: the first frame fills the
+    # FIFO, the second one overflows
+    tb = TB("rgb", pixels_per_clock)
+    status = {}
+
+    def read_generator(dut):
+        for i in range(400):
+            yield
+        yield dut.frame.ready.eq(1)
+
+    def status_generator(dut):
+        status["fifo_level_max"] = []
+        for i in range(2000):
+            sof_read = (yield dut.frame.valid) and (yield dut.frame.ready) and (yield dut.frame.sof)
+            yield
+            if sof_read:
+                # maximum level since the previous start of frame
+                status["fifo_level_max"].append((yield dut._fifo_level_max.status))
+        for name in ["overflow_x", "overflow_y"]:
+            status[name] = (yield getattr(dut, "_" + name).status)
+        status["overflow"] = (yield dut._overflow.w)
+
+    generators = {
+        "pix": [pix_generator(tb.frame)],
+        "sys": [read_generator(tb.frame), status_generator(tb.frame)]
+    }
+    clocks = {"sys": 10, "pix": 10}
+    if pixels_per_clock > 1:
+        clocks["capture"] = 10*pixels_per_clock
+    run_simulation(tb, generators, clocks)
+    print("fifo monitoring: {}".format(status))
+    assert status["overflow"] == 1
+    assert status["fifo_level_max"][0] == fifo_depth
+    # the first word of the second frame (2 rgb pixels), completed by the group of its last pixel
+    assert status["overflow_y"] == 0
+    assert status["overflow_x"] == 2 - pixels_per_clock
+
+
+def check(mode, pixels_per_clock, parameters, references):
+    frames, skipped_frames = capture(mode, pixels_per_clock, parameters)
+    print(mode, pixels_per_clock, parameters, "frames: {:d}".format(len(frames)))
+    expected = resolutions[::parameters.get("frame_divider", 1)]
+    assert len(frames) == len(expected)
+    assert skipped_frames == len(resolutions) - len(expected)
+    for (pixels, eols), (hres, vres) in zip(frames, expected):
+        ref_pixels, ref_eols = model(mode, references[hres], hres, vres, parameters)
+        # the last word is padded with zeros
+        nwords = (len(ref_pixels)*pixel_widths[mode] + word_width - 1)//word_width
+        padding = nwords*word_width//pixel_widths[mode] - len(ref_pixels)
+        assert pixels == ref_pixels + [0]*padding
+        assert eols == ref_eols, "eols {} expected {}".format(eols, ref_eols)
+
+
+if __name__ == "__main__":
+    regions = [
+        {"roi_x": 2, "roi_y": 1, "roi_width": 8, "roi_height": 5},
+        {"roi_x": 3, "roi_width": 9, "roi_y": 2, "hdecimation": 1, "vdecimation": 1},
+        {"roi_x": 4, "hdecimation": 2, "vdecimation": 2},
+        {"roi_x": 6, "roi_width": 40, "roi_y": 3, "roi_height": 20}  # beyond the frame
+    ]
+
+    for mode in ["rgb", "rgb24", "rgb565", "y8", "ycbcr422"]:
+        # full frames, in each mode and pixels per clock
+        references = {}
+        for pixels_per_clock in [1, 2]:
+            frames, skipped_frames = capture(mode, pixels_per_clock, {})
+            print(mode, pixels_per_clock, "frames: {:d}".format(len(frames)))
+            assert len(frames) == len(resolutions)
+            for (pixels, eols), (hres, vres) in zip(frames, resolutions):
+                if encode(mode, 0, 0, 0) is not None:
+                    direct = [encode(mode, *rgb(x, y)) for y in range(vres) for x in range(hres)]
+                    assert pixels == direct
+                # the luma/chroma conversion is checked against the single pixel per clock capture
+                references.setdefault(hres, pixels)
+                assert pixels == references[hres]
+                assert eols == model(mode, references[hres], hres, vres, {})[1]
+
+        # regions of interest and decimation
+        for pixels_per_clock in [1, 2]:
+            for parameters in regions:
+                if mode in ["rgb565", "ycbcr422"] or parameters is regions[1]:
+                    check(mode, pixels_per_clock, parameters, references)
+
+    # frame rate divider
+    references = {hres: [encode("rgb565", *rgb(x, y)) for y in range(vres) for x in range(hres)]
+                  for hres, vres in resolutions}
+    check("rgb565", 1, {"frame_divider": 2}, references)
+
+    # fifo level and overflow position
+    for pixels_per_clock in [1, 2]:
+        check_fifo_monitoring(pixels_per_clock)
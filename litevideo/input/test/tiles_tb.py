@@ -0,0 +1,78 @@
+import random
+
+from migen import *
+
+from litevideo.input.tiles import TileChangeDetector
+
+
+tile_size = 4
+max_hres, max_vres = 256, 16
+hres, vres = 150, 10  # partial tiles in the last column and the last row
+hblank, vblank = 20, 6
+
+ntx = max_hres//tile_size
+nty = (max_vres + tile_size - 1)//tile_size
+words_per_row = ntx//32
+
+# pixels changed in each frame (changes are reverted in the next frame)
+changes = [[], [], [(5, 5)], [(149, 9), (0, 0), (64, 3)], [], []]
+
+
+def image(frame):
+    prng = random.Random(1)
+    pixels = [[(prng.randrange(256), prng.randrange(256), prng.randrange(256)) for x in range(hres)]
+              for y in range(vres)]
+    for x, y in changes[frame]:
+        r, g, b = pixels[y][x]
+        pixels[y][x] = (r ^ 1, g, b)
+    return pixels
+
+
+def tiles(pixels):
+    return {(x//tile_size, y//tile_size) for x, y in pixels}
+
+
+def pix_generator(dut, reports):
+    yield dut.valid_i.eq(1)
+    for frame in range(len(changes)):
+        pixels = image(frame)
+        for y in range(vres + vblank):
+            for x in range(hres + hblank):
+                de = x < hres and y < vres
+                r, g, b = pixels[y][x] if de else (0, 0, 0)
+                yield dut.de.eq(int(de))
+                yield dut.vsync.eq(int(y == vres + 2))
+                yield dut.r.eq(r)
+                yield dut.g.eq(g)
+                yield dut.b.eq(b)
+                yield
+        # dirty tiles of the frame (reported after its vsync)
+        bank = (yield dut._bank.status)
+        dirty = set()
+        for ty in range(nty):
+            for w in range(words_per_row):
+                word = (yield dut.bitmap[(bank*nty + ty)*words_per_row + w])
+                dirty |= {(32*w + bit, ty) for bit in range(32) if (word >> bit) & 1}
+        reports.append((bank, (yield dut._dirty_tiles.status), dirty))
+
+
+if __name__ == "__main__":
+    dut = TileChangeDetector(max_hres, max_vres, tile_size)
+    reports = []
+    run_simulation(dut, {"pix": [pix_generator(dut, reports)]}, {"pix": 10, "sys": 10})
+
+    all_tiles = {(tx, ty) for tx in range((hres + tile_size - 1)//tile_size)
+                          for ty in range((vres + tile_size - 1)//tile_size)}
+    last_row = {(tx, ty) for tx, ty in all_tiles if ty == vres//tile_size}
+    expected = [
+        all_tiles - last_row,  # the last (partial) row is evaluated from the second frame
+        last_row
+    ]
+    for frame in range(2, len(changes)):
+        expected.append(tiles(changes[frame]) | tiles(changes[frame - 1]))
+    for frame, ((bank, dirty_tiles, dirty), reference) in enumerate(zip(reports, expected)):
+        print("frame {:d}: bank {:d}, {:d} dirty tiles".format(frame, bank, dirty_tiles))
+        # banks alternate on each frame
+        assert bank == frame%2
+        assert dirty == reference, "frame {:d}: {} expected {}".format(frame, sorted(dirty), sorted(reference))
+        assert dirty_tiles == len(reference)
@@ -0,0 +1,196 @@
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import *
+
+
+def rotl(v, n):
+    return Cat(v[len(v)-n:], v[:len(v)-n])
+
+
+class TileChangeDetector(Module, AutoCSR):
+    """Tile change detector
+
+    Detects the tiles of tile_size x tile_size pixels that changed since the previous frame: a
+    checksum of each tile is computed on the fly and compared with the checksum of the tile in the
+    previous frame, stored in block RAM.
+
+    The dirty tiles of the last frame are reported in the bitmap memory (tile tx, ty is bit tx%32
+    of word ty*max_hres/(32*tile_size) + tx//32 of the bank) and counted in dirty_tiles. The bitmap
+    has 2 banks alternating on each frame, bank is the one holding the last frame; only the words
+    covering the frame are updated. The last tile row of frames whose height is not a multiple of
+    tile_size is only evaluated from the second frame of a resolution (the height of the previous
+    frame is used).
+    """
+    def __init__(self, max_hres=2048, max_vres=1200, tile_size=16):
+        # in pix clock domain
+        self.valid_i = Signal()
+        self.vsync = Signal()
+        self.de = Signal()
+        self.r = Signal(8)
+        self.g = Signal(8)
+        self.b = Signal(8)
+
+        ntx = max_hres//tile_size
+        nty = (max_vres + tile_size - 1)//tile_size
+        assert ntx >= 32
+        assert ntx & (ntx - 1) == 0
+        words_per_row = ntx//32
+
+        self._bank = CSRStatus()
+        self._dirty_tiles = CSRStatus(bits_for(ntx*nty))
+        self.specials.bitmap = Memory(32, 2*words_per_row*nty)
+        self.bitmap.bus_read_only = True
+
+        # # #
+
+        pixel_valid = Signal()
+        pixel = Signal(24)
+        self.comb += [
+            pixel_valid.eq(self.valid_i & self.de),
+            pixel.eq(Cat(self.b, self.g, self.r))
+        ]
+
+        de_r = Signal()
+        vsync_r = Signal()
+        line_end = Signal()
+        new_frame = Signal()
+        self.comb += [
+            line_end.eq(de_r & ~self.de),
+            new_frame.eq(self.vsync & ~vsync_r)
+        ]
+        self.sync.pix += [
+            de_r.eq(self.de),
+            vsync_r.eq(self.vsync)
+        ]
+
+        # position
+        px = Signal(max=tile_size)  # pixel in the tile
+        tx = Signal(max=ntx)
+        ly = Signal(max=tile_size)  # line in the tile
+        ty = Signal(max=nty)
+        lines = Signal(max=max_vres + 1)
+        frame_lines = Signal(max=max_vres + 1)
+        last_line = Signal()
+        self.comb += last_line.eq((ly == (tile_size - 1)) | (lines == (frame_lines - 1)))
+
+        # tiles are completed at their last pixel in the line, or at the end of the line
+        commit_pixel = Signal()
+        commit_partial = Signal()
+        commit = Signal()
+        self.comb += [
+            commit_pixel.eq(pixel_valid & (px == (tile_size - 1))),
+            commit_partial.eq(line_end & (px != 0)),
+            commit.eq(commit_pixel | commit_partial)
+        ]
+
+        self.sync.pix += [
+            If(new_frame,
+                px.eq(0),
+                tx.eq(0),
+                ly.eq(0),
+                ty.eq(0),
+                lines.eq(0),
+                frame_lines.eq(lines)
+            ).Elif(line_end,
+                px.eq(0),
+                tx.eq(0),
+                lines.eq(lines + 1),
+                If(last_line,
+                    ly.eq(0),
+                    ty.eq(ty + 1)
+                ).Else(
+                    ly.eq(ly + 1)
+                )
+            ).Elif(pixel_valid,
+                If(px == (tile_size - 1),
+                    px.eq(0),
+                    tx.eq(tx + 1)
+                ).Else(
+                    px.eq(px + 1)
+                )
+            )
+        ]
+
+        # checksums: pixels are accumulated in the line of the tile, lines in the column of tiles
+        columns = Memory(32, ntx)
+        checksums = Memory(32, ntx*nty)
+        columns_rdport = columns.get_port(clock_domain="pix")
+        columns_wrport = columns.get_port(write_capable=True, clock_domain="pix")
+        checksums_rdport = checksums.get_port(clock_domain="pix")
+        checksums_wrport = checksums.get_port(write_capable=True, clock_domain="pix")
+        self.specials += columns, checksums, \
+            columns_rdport, columns_wrport, checksums_rdport, checksums_wrport
+
+        line_sum = Signal(32)
+        line_sum_next = Signal(32)
+        column_sum = Signal(32)
+        self.comb += [
+            line_sum_next.eq(rotl(line_sum, 5) + pixel),
+            If(pixel_valid,
+                column_sum.eq(rotl(Mux(ly == 0, 0, columns_rdport.dat_r), 7) ^ line_sum_next)
+            ).Else(
+                column_sum.eq(rotl(Mux(ly == 0, 0, columns_rdport.dat_r), 7) ^ line_sum)
+            )
+        ]
+        self.sync.pix += \
+            If(commit | line_end,
+                line_sum.eq(0)
+            ).Elif(pixel_valid,
+                line_sum.eq(line_sum_next)
+            )
+
+        evaluate = Signal()
+        dirty = Signal()
+        self.comb += [
+            columns_rdport.adr.eq(tx),
+            columns_wrport.adr.eq(tx),
+            columns_wrport.dat_w.eq(column_sum),
+            columns_wrport.we.eq(commit & ~last_line),
+
+            checksums_rdport.adr.eq(Cat(tx, ty)),
+            checksums_wrport.adr.eq(Cat(tx, ty)),
+            checksums_wrport.dat_w.eq(column_sum),
+            checksums_wrport.we.eq(evaluate),
+
+            evaluate.eq(commit & last_line),
+            dirty.eq(evaluate & (checksums_rdport.dat_r != column_sum))
+        ]
+
+        # dirty tiles bitmap
+        bank = Signal()
+        word_bits = Signal(32)
+        word_pending = Signal()
+        word = Signal(32)
+        bitmap_wrport = self.bitmap.get_port(write_capable=True, clock_domain="pix")
+        self.specials += bitmap_wrport
+        self.comb += [
+            word.eq(word_bits | (dirty << tx[:5])),
+            bitmap_wrport.adr.eq(Cat(tx[5:], ty) + Mux(bank, words_per_row*nty, 0)),
+            bitmap_wrport.dat_w.eq(word),
+            bitmap_wrport.we.eq((evaluate & (tx[:5] == 31)) |
+                                (line_end & last_line & (word_pending | evaluate)))
+        ]
+        self.sync.pix += \
+            If(bitmap_wrport.we,
+                word_bits.eq(0),
+                word_pending.eq(0)
+            ).Elif(evaluate,
+                word_bits.eq(word),
+                word_pending.eq(1)
+            )
+
+        dirty_tiles = Signal(bits_for(ntx*nty))
+        frame_dirty_tiles = Signal(bits_for(ntx*nty))
+        self.sync.pix += \
+            If(new_frame,
+                bank.eq(~bank),
+                frame_dirty_tiles.eq(dirty_tiles),
+                dirty_tiles.eq(0)
+            ).Elif(dirty,
+                dirty_tiles.eq(dirty_tiles + 1)
+            )
+        self.specials += [
+            MultiReg(~bank, self._bank.status),
+            MultiReg(frame_dirty_tiles, self._dirty_tiles.status)
+        ]
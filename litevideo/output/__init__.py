@@ -6,11 +6,17 @@ from litex.soc.interconnect.csr import *
 from litevideo.output.common import *
 from litevideo.output.core import VideoOutCore
 from litevideo.output.driver import Driver
+from litevideo.output.compositor import Compositor, Cursor
+from litevideo.output.palette import rgb565_to_rgb, Palette
 
 from litevideo.csc.ycbcr2rgb import YCbCr2RGB
 from litevideo.csc.ycbcr422to444 import YCbCr422to444
 
 
+# modes converted to a rgb stream before the driver
+rgb_modes = ["rgb", "rle", "rgb565", "indexed"]
+
+
 class TimingDelay(Module):
     def __init__(self, latency):
         self.sink = stream.Endpoint(frame_timing_layout)
@@ -31,31 +37,91 @@ class VideoOut(Module, AutoCSR):
     """Video out
 
     Generates a video from memory.
+
+    The pix clock domain (pixel clock) is generated by the clocking of the Driver and the core runs
+    in the clock domain of dram_port. With pixels_per_clock > 1, this clock domain must be provided
+    by the caller and run at the pixel clock divided by pixels_per_clock (e.g. generated from the
+    pixel clock by the same clocking), a PixelGearbox moving the pixels to the pix clock domain.
     """
     def __init__(self, device, pads, dram_port,
         mode="rgb",
         fifo_depth=512,
-        external_clocking=None):
+        external_clocking=None,
+        pixels_per_clock=1,
+        burst_length=1,
+        nbuffers=1,
+        overlay_dram_ports=None,
+        with_cursor=False,
+        with_scaler=False,
+        genlock_stream=None,
+        loopback_stream=None):
         cd = dram_port.cd
-
-        self.submodules.core = core = VideoOutCore(dram_port, mode, fifo_depth)
-        self.submodules.driver = driver = Driver(device, pads, mode, external_clocking)
+        if pixels_per_clock > 1 and cd == "pix":
+            raise ValueError("DRAM port clock domain must run at pix/{} with {} pixels per clock".format(
+                pixels_per_clock, pixels_per_clock))
+
+        self.submodules.core = core = VideoOutCore(dram_port, mode, fifo_depth,
+            pixels_per_clock=pixels_per_clock,
+            burst_length=burst_length,
+            nbuffers=nbuffers,
+            with_scaler=with_scaler,
+            genlock_stream=genlock_stream,
+            loopback_stream=loopback_stream)
+        if nbuffers > 1:
+            self.ev = core.ev
+
+        # rgb conversion of packed modes
+        source = core.source
+        if mode == "rgb565":
+            rgb = stream.Endpoint(video_out_layout(24, pixels_per_clock))
+            self.comb += source.connect(rgb, omit=["data"])
+            for i in range(pixels_per_clock):
+                self.comb += rgb.data[i*24:(i+1)*24].eq(rgb565_to_rgb(source.data[i*16:(i+1)*16]))
+            source = rgb
+        elif mode == "indexed":
+            if pixels_per_clock > 1:
+                raise ValueError("Video mode {} not supported with {} pixels per clock".format(
+                    mode, pixels_per_clock))
+            self.submodules.palette = palette = ClockDomainsRenamer(cd)(Palette())
+            self.comb += source.connect(palette.sink)
+            source = palette.source
+
+        if (overlay_dram_ports is not None or with_cursor) and (mode not in rgb_modes or pixels_per_clock > 1):
+            raise ValueError("Overlays/cursor are only supported in rgb modes with 1 pixel per clock")
+        if overlay_dram_ports is not None:
+            self.submodules.compositor = compositor = ClockDomainsRenamer(cd)(
+                Compositor(overlay_dram_ports, fifo_depth))
+            self.comb += source.connect(compositor.sink)
+            source = compositor.source
+        if with_cursor:
+            self.submodules.cursor = cursor = ClockDomainsRenamer(cd)(Cursor())
+            self.comb += source.connect(cursor.sink)
+            source = cursor.source
+        self.submodules.driver = driver = Driver(device, pads, mode, external_clocking,
+            pixels_per_clock=pixels_per_clock, cd=cd)
 
         if mode == "raw":
-            self.comb += [
-                core.source.connect(driver.sink, omit=["data"]),
-                driver.sink.c0.eq(core.source.data[0:10]),
-                driver.sink.c1.eq(core.source.data[10:20]),
-                driver.sink.c2.eq(core.source.data[20:30])
-            ]
-        elif mode == "rgb":
-            self.comb += [
-                core.source.connect(driver.sink, omit=["data"]),
-                driver.sink.r.eq(core.source.data[0:8]),
-                driver.sink.g.eq(core.source.data[8:16]),
-                driver.sink.b.eq(core.source.data[16:24])
-            ]
+            self.comb += source.connect(driver.sink, omit=["data"])
+            for i in range(pixels_per_clock):
+                data = source.data[i*32:(i+1)*32]
+                self.comb += [
+                    driver.sink.c0[i*10:(i+1)*10].eq(data[0:10]),
+                    driver.sink.c1[i*10:(i+1)*10].eq(data[10:20]),
+                    driver.sink.c2[i*11:(i+1)*11].eq(data[20:30])
+                ]
+        elif mode in rgb_modes:
+            self.comb += source.connect(driver.sink, omit=["data"])
+            for i in range(pixels_per_clock):
+                data = source.data[i*24:(i+1)*24]
+                self.comb += [
+                    driver.sink.r[i*8:(i+1)*8].eq(data[0:8]),
+                    driver.sink.g[i*8:(i+1)*8].eq(data[8:16]),
+                    driver.sink.b[i*8:(i+1)*8].eq(data[16:24])
+                ]
         elif mode == "ycbcr422":
+            if pixels_per_clock > 1:
+                raise ValueError("Video mode {} not supported with {} pixels per clock".format(
+                    mode, pixels_per_clock))
             ycbcr422to444 = ClockDomainsRenamer(cd)(YCbCr422to444())
             ycbcr2rgb = ClockDomainsRenamer(cd)(YCbCr2RGB())
             timing_delay = TimingDelay(ycbcr422to444.latency + ycbcr2rgb.latency)
@@ -96,3 +162,5 @@ class VideoOut(Module, AutoCSR):
             ]
         else:
             raise ValueError("Video mode {} not supported".format(mode))
+
+    autocsr_exclude = {"ev"}
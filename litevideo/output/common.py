@@ -32,17 +32,21 @@ frame_timing_layout = [
 
 color_bar_parameter_layout = [("hres", hbits)]
 
-def video_out_layout(dw):
+def video_out_layout(dw, pixels_per_clock=1):
     param_layout = frame_timing_layout
-    payload_layout = [("data", dw)]
+    payload_layout = [("data", dw*pixels_per_clock)]
     return stream.EndpointDescription(payload_layout, param_layout)
 
-def phy_layout(mode):
+def phy_layout(mode, pixels_per_clock=1):
     if mode == "raw":
         param_layout = frame_timing_layout # not used
-        payload_layout = [("c0", 10), ("c1", 10), ("c2", 11)]
+        payload_layout = [("c0", 10*pixels_per_clock),
+                          ("c1", 10*pixels_per_clock),
+                          ("c2", 11*pixels_per_clock)]
         return stream.EndpointDescription(payload_layout, param_layout)
     else:
         param_layout = frame_timing_layout
-        payload_layout = [("r", 8), ("g", 8), ("b", 8)]
+        payload_layout = [("r", 8*pixels_per_clock),
+                          ("g", 8*pixels_per_clock),
+                          ("b", 8*pixels_per_clock)]
         return stream.EndpointDescription(payload_layout, param_layout)
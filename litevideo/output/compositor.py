@@ -0,0 +1,303 @@
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+from litevideo.output.common import *
+from litevideo.output.core import DMAReader
+
+
+def blend(fg, bg, alpha):
+    # alpha is extended to 0..256 so that 255 is fully opaque
+    a = alpha + alpha[7]
+    return (a*fg + (256 - a)*bg)[8:16]
+
+
+class PixelPosition(Module):
+    """Pixel position
+
+    Tracks the x/y position of the pixels of a video stream from its de/vsync signals.
+    """
+    def __init__(self, endpoint):
+        self.x = x = Signal(hbits)
+        self.y = y = Signal(vbits)
+        self.start = start = Signal()  # start of frame
+
+        # # #
+
+        de_r = Signal()
+        vsync_r = Signal()
+        self.comb += start.eq(endpoint.valid & endpoint.ready & endpoint.vsync & ~vsync_r)
+        self.sync += \
+            If(endpoint.valid & endpoint.ready,
+                de_r.eq(endpoint.de),
+                vsync_r.eq(endpoint.vsync),
+                If(endpoint.de,
+                    x.eq(x + 1)
+                ).Else(
+                    x.eq(0)
+                ),
+                If(start,
+                    y.eq(0)
+                ).Elif(~endpoint.de & de_r,
+                    y.eq(y + 1)
+                )
+            )
+
+
+class OverlayPlane(Module, AutoCSR):
+    """Overlay plane
+
+    Reads a width x height rectangle of 32-bit pixels ("rgb" mode of VideoOutCore) from memory and
+    places it at x, y on the display. alpha sets the opacity of the plane (255: opaque) and, when
+    colorkey_enable is set, pixels equal to colorkey are transparent.
+
+    The plane must be fully on screen and disabled while its geometry is changed: its DMA fetches
+    width x height pixels per frame. The pixels that were not provided in time (underflows) are
+    dropped when they arrive, and the DMA is restarted at the start of a frame if the previous
+    frame was not entirely read, so the plane stays in place.
+    """
+    def __init__(self, dram_port, fifo_depth=512):
+        assert dram_port.dw == 32
+        self.start = Signal()  # start of frame
+        self.source = source = stream.Endpoint([("data", 24)])  # pixels of the plane, in raster order
+
+        # parameters of the current frame
+        self.active = Signal()
+        self.x = Signal(hbits)
+        self.y = Signal(vbits)
+        self.width = Signal(hbits)
+        self.height = Signal(vbits)
+        self.alpha = Signal(8)
+        self.colorkey = Signal(24)
+        self.colorkey_enable = Signal()
+
+        self._enable = CSRStorage()
+        self._base = CSRStorage(32)
+        self._x = CSRStorage(hbits)
+        self._y = CSRStorage(vbits)
+        self._width = CSRStorage(hbits)
+        self._height = CSRStorage(vbits)
+        self._alpha = CSRStorage(8, reset=255)
+        self._colorkey = CSRStorage(24)
+        self._colorkey_enable = CSRStorage()
+
+        # # #
+
+        self.submodules.dma = dma = DMAReader(dram_port, fifo_depth)
+
+        params = {}
+        for name in ["enable", "base", "x", "y", "width", "height", "alpha", "colorkey", "colorkey_enable"]:
+            csr = getattr(self, "_" + name)
+            params[name] = Signal(len(csr.storage))
+            self.specials += MultiReg(csr.storage, params[name])
+
+        # parameters are only updated at the start of a frame
+        self.sync += \
+            If(self.start,
+                self.active.eq(params["enable"]),
+                self.x.eq(params["x"]),
+                self.y.eq(params["y"]),
+                self.width.eq(params["width"]),
+                self.height.eq(params["height"]),
+                self.alpha.eq(params["alpha"]),
+                self.colorkey.eq(params["colorkey"]),
+                self.colorkey_enable.eq(params["colorkey_enable"])
+            )
+
+        npixels = Signal(hbits + vbits)
+        length = Signal(32)
+        self.sync += [
+            npixels.eq(self.width*self.height),
+            length.eq(npixels*4)
+        ]
+
+        missed = Signal(hbits + vbits)    # pixels not provided in time, to drop
+        consumed = Signal(hbits + vbits)  # pixels of the dma frame consumed
+        underflow = Signal()
+        drop = Signal()
+        restart = Signal()
+        self.comb += [
+            source.valid.eq(dma.source.valid & (missed == 0)),
+            source.data.eq(dma.source.data[:24]),
+            underflow.eq(source.ready & ~source.valid),
+            drop.eq(dma.source.valid & (missed != 0)),
+            dma.source.ready.eq((source.ready & source.valid) | drop),
+
+            # restart the dma when the previous frame was not entirely read, flush it when disabled
+            restart.eq(self.start & ((consumed != 0) | (missed != 0))),
+            dma.abort.eq(~self.active | restart),
+            dma.sink.valid.eq(self.active),
+            dma.sink.base.eq(params["base"]),
+            dma.sink.length.eq(length)
+        ]
+        self.sync += [
+            If(~self.active | restart,
+                missed.eq(0),
+                consumed.eq(0)
+            ).Else(
+                missed.eq(missed + underflow - drop),
+                If(dma.source.valid & dma.source.ready,
+                    If(consumed == (npixels - 1),
+                        consumed.eq(0)
+                    ).Else(
+                        consumed.eq(consumed + 1)
+                    )
+                )
+            )
+        ]
+
+
+class Compositor(Module, AutoCSR):
+    """Compositor
+
+    Blends overlay planes (one per DRAM port of dram_ports) over the video stream of VideoOutCore
+    ("rgb" mode). Plane 0 is the bottom plane, each plane is blended in its own pipeline stage. A
+    plane that can't provide its pixel in time (underflow) is transparent for this pixel.
+    """
+    def __init__(self, dram_ports, fifo_depth=512):
+        self.sink = sink = stream.Endpoint(video_out_layout(24))
+        self.source = source = stream.Endpoint(video_out_layout(24))
+
+        # # #
+
+        stage_layout = [("valid", 1), ("data", 24), ("x", hbits), ("y", vbits)] + frame_timing_layout
+
+        self.submodules.position = position = PixelPosition(sink)
+
+        # pipeline
+        ce = Signal()
+        self.comb += [
+            ce.eq(source.ready),
+            sink.ready.eq(ce)
+        ]
+        stage = Record(stage_layout)
+        self.comb += [
+            stage.valid.eq(sink.valid),
+            stage.data.eq(sink.data),
+            stage.x.eq(position.x),
+            stage.y.eq(position.y),
+            stage.de.eq(sink.de),
+            stage.hsync.eq(sink.hsync),
+            stage.vsync.eq(sink.vsync)
+        ]
+
+        self.planes = []
+        for n, dram_port in enumerate(dram_ports):
+            plane = OverlayPlane(dram_port, fifo_depth)
+            setattr(self.submodules, "plane" + str(n), plane)
+            self.planes.append(plane)
+            self.comb += plane.start.eq(position.start)
+
+            inside = Signal()
+            transparent = Signal()
+            self.comb += [
+                inside.eq(plane.active & stage.valid & stage.de &
+                          (stage.x >= plane.x) & (stage.x < (plane.x + plane.width)) &
+                          (stage.y >= plane.y) & (stage.y < (plane.y + plane.height))),
+                plane.source.ready.eq(inside & ce),
+                transparent.eq(~inside | ~plane.source.valid |
+                               (plane.colorkey_enable & (plane.source.data == plane.colorkey)))
+            ]
+
+            next_stage = Record(stage_layout)
+            self.sync += \
+                If(ce,
+                    next_stage.eq(stage),
+                    If(~transparent,
+                        [next_stage.data[8*i:8*(i+1)].eq(blend(plane.source.data[8*i:8*(i+1)],
+                                                               stage.data[8*i:8*(i+1)],
+                                                               plane.alpha)) for i in range(3)]
+                    )
+                )
+            stage = next_stage
+
+        self.comb += [
+            source.valid.eq(stage.valid),
+            source.data.eq(stage.data),
+            source.de.eq(stage.de),
+            source.hsync.eq(stage.hsync),
+            source.vsync.eq(stage.vsync)
+        ]
+
+
+class Cursor(Module, AutoCSR):
+    """Cursor
+
+    Blends a size x size hardware cursor sprite stored in block RAM (mem) over the video stream
+    ("rgb" mode) with its top-left corner at x, y. Sprite pixels are 32-bit words with the color in
+    the 24 lsbs (same format as the frame buffer pixels) and the alpha (255: opaque) in the 8 msbs.
+    """
+    def __init__(self, size=64):
+        self.sink = sink = stream.Endpoint(video_out_layout(24))
+        self.source = source = stream.Endpoint(video_out_layout(24))
+
+        self._enable = CSRStorage()
+        self._x = CSRStorage(hbits)
+        self._y = CSRStorage(vbits)
+        self.specials.mem = Memory(32, size*size)
+
+        # # #
+
+        self.submodules.position = position = PixelPosition(sink)
+
+        enable = Signal()
+        x = Signal(hbits)
+        y = Signal(vbits)
+        self.specials += [
+            MultiReg(self._enable.storage, enable),
+            MultiReg(self._x.storage, x),
+            MultiReg(self._y.storage, y)
+        ]
+
+        # pipeline
+        ce = Signal()
+        self.comb += [
+            ce.eq(source.ready),
+            sink.ready.eq(ce)
+        ]
+
+        # stage 1: sprite read
+        dx = Signal(hbits)
+        dy = Signal(vbits)
+        inside = Signal()
+        self.comb += [
+            dx.eq(position.x - x),
+            dy.eq(position.y - y),
+            inside.eq(enable & sink.de &
+                      (position.x >= x) & (dx < size) &
+                      (position.y >= y) & (dy < size))
+        ]
+        rdport = self.mem.get_port(has_re=True)
+        self.specials += rdport
+        self.comb += [
+            rdport.re.eq(ce),
+            rdport.adr.eq(Cat(dx[:log2_int(size)], dy[:log2_int(size)]))
+        ]
+
+        stage = Record([("valid", 1), ("data", 24), ("inside", 1)] + frame_timing_layout)
+        self.sync += \
+            If(ce,
+                stage.valid.eq(sink.valid),
+                stage.data.eq(sink.data),
+                stage.inside.eq(inside),
+                stage.de.eq(sink.de),
+                stage.hsync.eq(sink.hsync),
+                stage.vsync.eq(sink.vsync)
+            )
+
+        # stage 2: blending
+        self.sync += \
+            If(ce,
+                source.valid.eq(stage.valid),
+                source.data.eq(stage.data),
+                If(stage.inside,
+                    [source.data[8*i:8*(i+1)].eq(blend(rdport.dat_r[8*i:8*(i+1)],
+                                                       stage.data[8*i:8*(i+1)],
+                                                       rdport.dat_r[24:32])) for i in range(3)]
+                ),
+                source.de.eq(stage.de),
+                source.hsync.eq(stage.hsync),
+                source.vsync.eq(stage.vsync)
+            )
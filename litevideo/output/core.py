@@ -3,10 +3,13 @@ from migen.genlib.cdc import MultiReg, PulseSynchronizer
 
 from litex.soc.interconnect import stream
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect.csr_eventmanager import *
 
 from litedram.frontend.dma import LiteDRAMDMAReader
 
 from litevideo.output.common import *
+from litevideo.output.rle import RLEDecoder
+from litevideo.output.scaler import Scaler
 from litevideo.output.hdmi.s6 import S6HDMIOutClocking, S6HDMIOutPHY
 from litevideo.output.hdmi.s7 import S7HDMIOutClocking, S7HDMIOutPHY
 
@@ -38,14 +41,279 @@ class Initiator(Module, AutoCSR):
         self.comb += cdc.source.connect(self.source)   # FIFO's output ("source") is now our output
 
 
+class PageFlipper(Module, AutoCSR):
+    """Page flipper
+
+    Selects the frame buffer scanned out among nbuffers frame buffers.
+
+    Software sets the base of the frame buffers in base0..baseN and selects the next frame buffer to
+    display with next_buffer. The DMA switches to next_buffer when it starts reading a new frame and
+    the flip is completed when this frame starts being displayed (end of the current frame), which
+    is signaled by the flip event. The previously displayed frame buffer can then be reused.
+    """
+    def __init__(self, cd, nbuffers):
+        # in cd clock domain
+        self.dma_start = Signal()   # DMA starts reading a new frame
+        self.frame_end = Signal()   # timing generator ends the frame
+        self.base = Signal(32)      # base of the frame buffer read by the DMA
+
+        for i in range(nbuffers):
+            setattr(self, "base" + str(i), CSRStorage(32, name="base" + str(i)))
+        self.next_buffer = CSRStorage(bits_for(nbuffers - 1))
+        self.current_buffer = CSRStatus(bits_for(nbuffers - 1))
+
+        self.submodules.ev = EventManager()
+        self.ev.flip = EventSourcePulse()
+        self.ev.finalize()
+
+        # # #
+
+        sync = getattr(self.sync, cd)
+
+        bases = []
+        for i in range(nbuffers):
+            base = Signal(32)
+            self.specials += MultiReg(getattr(self, "base" + str(i)).storage, base, cd)
+            bases.append(base)
+        next_buffer = Signal(bits_for(nbuffers - 1))
+        self.specials += MultiReg(self.next_buffer.storage, next_buffer, cd)
+
+        # the DMA reads ahead of the display: it switches buffer first...
+        dma_buffer = Signal(bits_for(nbuffers - 1))
+        sync += If(self.dma_start, dma_buffer.eq(next_buffer))
+        self.comb += self.base.eq(Array(bases)[dma_buffer])
+
+        # ...and the display follows at the end of the current frame
+        display_buffer = Signal(bits_for(nbuffers - 1))
+        flip_done = Signal()
+        sync += [
+            flip_done.eq(0),
+            If(self.frame_end,
+                display_buffer.eq(dma_buffer),
+                flip_done.eq(display_buffer != dma_buffer)
+            )
+        ]
+        self.specials += MultiReg(display_buffer, self.current_buffer.status)
+
+        flip_done_synchronizer = PulseSynchronizer(cd, "sys")
+        self.submodules += flip_done_synchronizer
+        self.comb += [
+            flip_done_synchronizer.i.eq(flip_done),
+            self.ev.flip.trigger.eq(flip_done_synchronizer.o)
+        ]
+
+
+class GenlockController(Module, AutoCSR):
+    """Genlock controller
+
+    Locks the frame timing of the timing generator to the frames of genlock_stream (e.g. the video
+    captured by HDMIIn) with a latency of target pixel clocks.
+
+    The phase of the output frames (pixel clocks from the start of the genlock frame to the start
+    of the output frame) is measured on each frame, its error to target is reported in phase and
+    accumulated in the histogram memory (bins of 2**hist_shift pixel clocks, centered on target).
+    When enable is set, the last line of the output frame is stretched or shortened (by at most
+    max_step pixel clocks, which must be lower than hscan - hsync_end so that the shortened line
+    still ends after its hsync) to cancel the error and track the difference of frame periods.
+    """
+    def __init__(self, cd, genlock_stream, nbins=64):
+        # in cd clock domain
+        self.frame_start = Signal()             # timing generator starts a frame
+        self.adjust = Signal((hbits + 1, True)) # adjustment of the last line of the frame
+
+        nbits = hbits + vbits
+        self.enable = CSRStorage()
+        self.target = CSRStorage(nbits)
+        self.max_step = CSRStorage(hbits - 1)
+        self.hist_shift = CSRStorage(bits_for(nbits))
+        self.phase = CSRStatus(nbits + 1)   # signed
+        self.period = CSRStatus(nbits)
+        self.specials.histogram = Memory(32, nbins)
+
+        # # #
+
+        sync = getattr(self.sync, cd)
+
+        enable = Signal()
+        target = Signal(nbits)
+        max_step = Signal(hbits - 1)
+        hist_shift = Signal(bits_for(nbits))
+        self.specials += [
+            MultiReg(self.enable.storage, enable, cd),
+            MultiReg(self.target.storage, target, cd),
+            MultiReg(self.max_step.storage, max_step, cd),
+            MultiReg(self.hist_shift.storage, hist_shift, cd)
+        ]
+
+        # start of the genlock frames
+        vsync = Signal()
+        vsync_r = Signal()
+        sof = Signal()
+        self.specials += MultiReg(genlock_stream.vsync, vsync, cd)
+        sync += vsync_r.eq(vsync)
+        self.comb += sof.eq(vsync & ~vsync_r)
+
+        # phase measurement
+        counter = Signal(nbits)
+        period = Signal(nbits)
+        sync += \
+            If(sof,
+                counter.eq(0),
+                period.eq(counter + 1)
+            ).Elif(counter != (2**nbits - 1),
+                counter.eq(counter + 1)
+            )
+
+        # the difference must be signed for the wrap comparisons (counter < target on early frames)
+        difference = Signal((nbits + 2, True))
+        half_period = Signal(nbits)
+        self.comb += [
+            difference.eq(counter - target),
+            half_period.eq(period >> 1)
+        ]
+
+        error = Signal((nbits + 2, True))
+        error_valid = Signal()
+        sync += [
+            error_valid.eq(self.frame_start),
+            If(self.frame_start,
+                # wrap the error to -period/2..period/2
+                If(difference >= half_period,
+                    error.eq(difference - period)
+                ).Elif((difference + half_period) < 0,
+                    error.eq(difference + period)
+                ).Else(
+                    error.eq(difference)
+                )
+            )
+        ]
+        self.specials += [
+            MultiReg(error, self.phase.status),
+            MultiReg(period, self.period.status)
+        ]
+
+        # line timing adjustment (proportional-integral, the integral term follows the difference
+        # between the genlock and output frame periods)
+        def clamp(v):
+            return Mux(v > max_step, max_step, Mux(v < -max_step, -max_step, v))
+
+        integral = Signal((hbits + 1, True))
+        integral_next = Signal((hbits + 1, True))
+        self.comb += integral_next.eq(clamp(integral - error))
+        sync += \
+            If(error_valid,
+                If(~enable,
+                    integral.eq(0),
+                    self.adjust.eq(0)
+                ).Else(
+                    integral.eq(integral_next),
+                    self.adjust.eq(clamp(integral_next - error))
+                )
+            )
+
+        # histogram
+        hist_bin = Signal((nbits + 2, True))
+        self.comb += hist_bin.eq((error >> hist_shift) + nbins//2)
+        port = self.histogram.get_port(write_capable=True, clock_domain=cd)
+        self.specials += port
+        update = Signal()
+        sync += update.eq(error_valid)
+        self.comb += [
+            If(hist_bin < 0,
+                port.adr.eq(0)
+            ).Elif(hist_bin >= nbins,
+                port.adr.eq(nbins - 1)
+            ).Else(
+                port.adr.eq(hist_bin)
+            ),
+            port.we.eq(update),
+            port.dat_w.eq(port.dat_r + 1)
+        ]
+
+
+class Loopback(Module, AutoCSR):
+    """Loopback
+
+    When enable is set, streams the frames of loopback_stream (the words of the FrameExtraction of
+    a HDMIIn, as they would be written to memory, in sys clock domain) to the output instead of the
+    frames read from memory, through a FIFO of depth words with clock domain crossing.
+
+    The frames are aligned on the output frames: at the end of an output frame (frame_end), the
+    words left from the input frame are dropped up to the next start of frame, and a start of frame
+    received before the end of the output frame is held (the output frame is completed with black).
+    Like with the DMA, the output waits for the words that are not yet received. Input and output
+    frames must have the same resolution and pixel format and the output should be genlocked to the
+    input with a latency of a few lines (fitting in the FIFO).
+    """
+    def __init__(self, cd, loopback_stream, depth=512):
+        dw = len(loopback_stream.pixels)
+
+        # in cd clock domain
+        self.frame_end = Signal()
+        self.enabled = Signal()
+        self.source = source = stream.Endpoint([("data", dw)])
+
+        self.enable = CSRStorage()
+
+        # # #
+
+        sync = getattr(self.sync, cd)
+
+        self.specials += MultiReg(self.enable.storage, self.enabled, cd)
+
+        fifo = stream.AsyncFIFO([("sof", 1), ("pixels", dw)], depth)
+        fifo = ClockDomainsRenamer({"write": "sys", "read": cd})(fifo)
+        self.submodules += fifo
+        self.comb += loopback_stream.connect(fifo.sink, omit={"eol"})
+
+        sof_expected = Signal(reset=1)
+        sync += \
+            If(~self.enabled | self.frame_end,
+                sof_expected.eq(1)
+            ).Elif(fifo.source.valid & fifo.source.ready & fifo.source.sof,
+                sof_expected.eq(0)
+            )
+
+        self.comb += \
+            If(~self.enabled,
+                fifo.source.ready.eq(1)
+            ).Elif(sof_expected,
+                # drop the words up to the start of the next frame
+                source.valid.eq(fifo.source.valid & fifo.source.sof),
+                source.data.eq(fifo.source.pixels),
+                fifo.source.ready.eq(~fifo.source.sof | source.ready)
+            ).Elif(fifo.source.sof,
+                # hold the start of the next frame until the end of the output frame (black)
+                source.valid.eq(1)
+            ).Else(
+                source.valid.eq(fifo.source.valid),
+                source.data.eq(fifo.source.pixels),
+                fifo.source.ready.eq(source.ready)
+            )
+
+
 class DMAReader(Module, AutoCSR):
     """DMA reader
 
     Generates the data stream of a frame.
+
+    Read requests are issued in aligned bursts of burst_length words. A new burst is only started
+    when the words requested and not yet consumed stay below the watermark CSR and the reads in
+    flight (requested but not yet returned by the DRAM) stay below the max_pending CSR, which keeps
+    the prefetch bounded without oversizing the FIFO.
+
+    abort drops the current frame: the requests stop and the data not yet consumed is flushed
+    before a new frame is started.
     """
-    def __init__(self, dram_port, fifo_depth=512, genlock_stream=None):
+    def __init__(self, dram_port, fifo_depth=512, burst_length=1):
         self.sink = sink = stream.Endpoint(frame_dma_layout)  # "inputs" are the DMA frame parameters
         self.source = source = stream.Endpoint([("data", dram_port.dw)])  # "output" is the data stream
+        self.abort = Signal()
+
+        assert burst_length == 2**log2_int(burst_length)
+        assert burst_length <= fifo_depth
+        self.watermark = CSRStorage(bits_for(fifo_depth), reset=fifo_depth)
+        self.max_pending = CSRStorage(bits_for(fifo_depth), reset=fifo_depth)
 
         # # #
 
@@ -56,69 +324,89 @@ class DMAReader(Module, AutoCSR):
         base = Signal(dram_port.aw)
         length = Signal(dram_port.aw)
         offset = Signal(dram_port.aw)
-        self.delay_base = CSRStorage(32)
+        address = Signal(dram_port.aw)
         self.comb += [
             base.eq(sink.base[shift:]),   # ignore the lower bits of the base + length to match the DMA's expectations
             length.eq(sink.length[shift:]), # need to noodle on what that expectation is, exactly...
+            address.eq(base + offset)
         ]
 
-        if genlock_stream != None:
-            self.v = Signal()
-            self.v_r = Signal()
-            self.sof = Signal()
-            self.sync += [
-                self.v.eq(genlock_stream.vsync),
-                self.v_r.eq(self.v),
-                self.sof.eq(self.v & ~self.v_r),
-            ]
+        # outstanding requests tracking
+        issued = Signal()
+        returned = Signal()
+        consumed = Signal()
+        requested = Signal(max=fifo_depth + 1)  # words requested and not yet consumed
+        pending = Signal(max=fifo_depth + 1)    # words requested and not yet returned
+        self.level = level = Signal(max=fifo_depth + 1)  # words returned and not yet consumed
+        self.comb += [
+            issued.eq(self.dma.sink.valid & self.dma.sink.ready),
+            returned.eq(dram_port.rdata.valid & dram_port.rdata.ready),
+            consumed.eq(self.dma.source.valid & self.dma.source.ready)
+        ]
+        self.sync += [
+            requested.eq(requested + issued - consumed),
+            pending.eq(pending + issued - returned),
+            level.eq(level + returned - consumed)
+        ]
 
-        if genlock_stream == None:
-            fsm.act("IDLE",
-                NextValue(offset, 0),
-                If(sink.valid,  # if our parameters are valid, start reading
-                       NextState("READ")
-                    ).Else(
-                        dram_port.flush.eq(1),
-                    )
-                )
-            fsm.act("READ",
-                self.dma.sink.valid.eq(1),  # tell the DMA reader that we've got a valid address for it
-                If(self.dma.sink.ready, # if the LiteDRAMDMAReader shows it's ready for an address (e.g. taken the current address)
-                    NextValue(offset, offset + 1), # increment the offset
-                    If(offset == (length - 1),  # at the end...
-                        self.sink.ready.eq(1),  # indicate we're ready for more parameters
-                        NextState("IDLE")
-                    )
+        # burst throttling
+        watermark = Signal(bits_for(fifo_depth))
+        max_pending = Signal(bits_for(fifo_depth))
+        self.specials += [
+            MultiReg(self.watermark.storage, watermark),
+            MultiReg(self.max_pending.storage, max_pending)
+        ]
+        burst_active = Signal()
+        burst_allowed = Signal()
+        burst_end = Signal()
+        self.comb += [
+            burst_allowed.eq(((requested + burst_length) <= watermark) &
+                             ((pending + burst_length) <= max_pending)),
+            burst_end.eq((address & (burst_length - 1)) == (burst_length - 1)) # bursts end on an aligned address
+        ]
+
+        fsm.act("IDLE",
+            NextValue(offset, 0),
+            NextValue(burst_active, 0),
+            If(self.abort,
+                NextState("ABORT")
+            ).Elif(sink.valid,  # if our parameters are valid, start reading
+                   NextState("READ")
+                ).Else(
+                    dram_port.flush.eq(1),
                 )
             )
-        else:
-            fsm.act("IDLE",
-                NextValue(offset, self.delay_base.storage),
-                If(sink.valid,  # if our parameters are valid, start reading
-                       NextState("READ")
-                    ).Else(
-                        dram_port.flush.eq(1),
-                    )
-                )
-            fsm.act("READ",
-                self.dma.sink.valid.eq(1),  # tell the DMA reader that we've got a valid address for it
-                If(self.dma.sink.ready, # if the LiteDRAMDMAReader shows it's ready for an address (e.g. taken the current address)
-                    NextValue(offset, offset + 1), # increment the offset
-                    If(offset == (length - 1),  # at the end...
-                        self.sink.ready.eq(1),  # indicate we're ready for more parameters
-                        NextState("WAIT_SOF")
-                    )
+        fsm.act("READ",
+            self.dma.sink.valid.eq((burst_active | burst_allowed) & ~self.abort),  # tell the DMA reader that we've got a valid address for it
+            If(self.abort,
+                NextState("ABORT")
+            ).Elif(self.dma.sink.valid & self.dma.sink.ready, # if the LiteDRAMDMAReader shows it's ready for an address (e.g. taken the current address)
+                NextValue(offset, offset + 1), # increment the offset
+                NextValue(burst_active, ~burst_end),  # once started, a burst is issued without throttling
+                If(offset == (length - 1),  # at the end...
+                    self.sink.ready.eq(1),  # indicate we're ready for more parameters
+                    NextState("IDLE")
                 )
             )
-            fsm.act("WAIT_SOF",  # wait till vsync/start of frame
-                If(self.sof,
-                   NextState("IDLE")
-                )
+        )
+        fsm.act("ABORT",
+            # wait for the reads in flight and discard the data
+            If((pending == 0) & (level == 0),
+                NextState("IDLE")
             )
+        )
+
+        # the FIFO level can't grow until data is consumed
+        self.stalled = Signal()
+        self.comb += self.stalled.eq(fsm.ongoing("READ") & ~self.dma.sink.valid & (pending == 0))
 
         self.comb += [
-            self.dma.sink.address.eq(base + offset),  # input to the DMA is an address of base + offset
-            self.dma.source.connect(self.source)      # connect the DMA's output to the output of this module
+            self.dma.sink.address.eq(address),  # input to the DMA is an address of base + offset
+            self.dma.source.connect(self.source),      # connect the DMA's output to the output of this module
+            If(fsm.ongoing("ABORT"),
+                self.dma.source.ready.eq(1),
+                self.source.valid.eq(0)
+            )
         ]
 
 
@@ -126,69 +414,95 @@ class TimingGenerator(Module):
     """Timing Generator
 
     Generates the H/V timings of a frame.
+
+    With pixels_per_clock > 1, the horizontal parameters are still expressed in pixels (and must be
+    multiples of pixels_per_clock) but the generator counts in groups of pixels_per_clock pixels.
+
+    The length of the last line of the frame can be adjusted by adjust (used by the genlock).
     """
-    def __init__(self, genlock_stream=None):
+    def __init__(self, pixels_per_clock=1):
         self.sink = sink = stream.Endpoint(frame_parameter_layout)   # "inputs" are the parameter layout (via CSR via initiator)
         self.source = source = stream.Endpoint(frame_timing_layout)  # "outputs" are a frame timing layout
+        self.adjust = Signal((hbits + 1, True))
 
         # # #
-        if genlock_stream == None:
-            hactive = Signal()
-            vactive = Signal()
-            active = Signal()
-
-            hcounter = Signal(hbits)
-            vcounter = Signal(vbits)
+        hactive = Signal()
+        vactive = Signal()
+        active = Signal()
+
+        hcounter = Signal(hbits)
+        vcounter = Signal(vbits)
+
+        # horizontal parameters in pixel groups
+        hshift = log2_int(pixels_per_clock)
+        hres = Signal(hbits)
+        hsync_start = Signal(hbits)
+        hsync_end = Signal(hbits)
+        hscan = Signal(hbits)
+        self.comb += [
+            hres.eq(sink.hres[hshift:]),
+            hsync_start.eq(sink.hsync_start[hshift:]),
+            hsync_end.eq(sink.hsync_end[hshift:]),
+            hscan.eq(sink.hscan[hshift:])
+        ]
 
-            self.comb += [
-                If(sink.valid,  # if the frame parameters are valid...
-                    active.eq(hactive & vactive),  # go ahead and let the logic update for active, valid
-                    source.valid.eq(1),
-                    If(active,
-                        source.de.eq(1),
-                    )
-                ), ### but else...what? they don't revert to 0, so they stay "stuck" on when sink is invalid???
-                sink.ready.eq(source.ready & source.last)
-            ]
+        line_end = Signal(hbits)
+        self.comb += \
+            If(vcounter == sink.vscan,
+                line_end.eq(hscan + self.adjust)
+            ).Else(
+                line_end.eq(hscan)
+            )
 
-            self.sync += \
-                If(~sink.valid,  # if our parameters aren't valid, reset everything
-                    hactive.eq(0),
-                    vactive.eq(0),
-                    hcounter.eq(0),
-                    vcounter.eq(0)
-                ).Elif(source.ready,  # otherwise, if the thing downstream from us is ready...
-                    source.last.eq(0),  # self.sync is blocking, so this will get over-ridden later as needed
-                    hcounter.eq(hcounter + 1),
-
-                    If(hcounter == 0, hactive.eq(1)),
-                    If(hcounter == sink.hres, hactive.eq(0)),  # sink is our "input" of parameters
-                    If(hcounter == sink.hsync_start, source.hsync.eq(1)),
-                    If(hcounter == sink.hsync_end, source.hsync.eq(0)),
-                    If(hcounter == sink.hscan,  # if we hit the end of the line
-                        hcounter.eq(0),  # reset the counter, overriding the +1 earlier coz this is a "blocking" syntax
-                        If(vcounter == sink.vscan,
-                            vcounter.eq(0),
-                            source.last.eq(1)
-                        ).Else(
-                            vcounter.eq(vcounter + 1)
-                        )
-                    ),
-
-                    If(vcounter == 0, vactive.eq(1)),
-                    If(vcounter == sink.vres, vactive.eq(0)),
-                    If(vcounter == sink.vsync_start, source.vsync.eq(1)),
-                    If(vcounter == sink.vsync_end, source.vsync.eq(0))
+        self.comb += [
+            If(sink.valid,  # if the frame parameters are valid...
+                active.eq(hactive & vactive),  # go ahead and let the logic update for active, valid
+                source.valid.eq(1),
+                If(active,
+                    source.de.eq(1),
                 )
-        else:
-            self.comb += genlock_stream.connect(self.source)
+            ), ### but else...what? they don't revert to 0, so they stay "stuck" on when sink is invalid???
+            sink.ready.eq(source.ready & source.last)
+        ]
 
+        self.sync += \
+            If(~sink.valid,  # if our parameters aren't valid, reset everything
+                hactive.eq(0),
+                vactive.eq(0),
+                hcounter.eq(0),
+                vcounter.eq(0)
+            ).Elif(source.ready,  # otherwise, if the thing downstream from us is ready...
+                source.last.eq(0),  # self.sync is blocking, so this will get over-ridden later as needed
+                hcounter.eq(hcounter + 1),
+
+                If(hcounter == 0, hactive.eq(1)),
+                If(hcounter == hres, hactive.eq(0)),  # sink is our "input" of parameters
+                If(hcounter == hsync_start, source.hsync.eq(1)),
+                If(hcounter == hsync_end, source.hsync.eq(0)),
+                If(hcounter == line_end,  # if we hit the end of the line
+                    hcounter.eq(0),  # reset the counter, overriding the +1 earlier coz this is a "blocking" syntax
+                    If(vcounter == sink.vscan,
+                        vcounter.eq(0),
+                        source.last.eq(1)
+                    ).Else(
+                        vcounter.eq(vcounter + 1)
+                    )
+                ),
+
+                If(vcounter == 0, vactive.eq(1)),
+                If(vcounter == sink.vres, vactive.eq(0)),
+                If(vcounter == sink.vsync_start, source.vsync.eq(1)),
+                If(vcounter == sink.vsync_end, source.vsync.eq(0))
+            )
 
 
 modes_dw = {
     "raw":      32,
     "rgb":      24,
-    "ycbcr422": 16
+    "ycbcr422": 16,
+    "rgb565":   16,
+    "indexed":   8, # palette lookup in VideoOut
+    "rle":      24  # run-length encoded rgb, see litevideo.output.rle
 }
 
 
@@ -196,49 +510,166 @@ class VideoOutCore(Module, AutoCSR):
     """Video out core
 
     Generates a video stream from memory.
+
+    With pixels_per_clock > 1, the core outputs pixels_per_clock pixels per cycle, allowing the core
+    to run at a fraction of the pixel clock. DRAM words wider than pixels_per_clock pixels (e.g. packed
+    rgb565 or indexed pixels) are unpacked over several cycles. As in the frames written by HDMIIn, the
+    first pixel of a DRAM word is in its msbs.
+
+    With nbuffers > 1, a PageFlipper selects the frame buffer to scan out (the base of the Initiator
+    is then unused) and signals completed flips with its event.
+
+    With with_scaler, the frame buffer is read at its native resolution (set in the scaler) and scaled
+    to the resolution of the timing generator ("rgb" mode only).
+
+    With a genlock_stream, a GenlockController locks the output frames to the frames of the stream
+    with a programmable latency (the DMA watermark should then stay below this latency so that the
+    DMA doesn't read ahead of the frame being written).
+
+    With a loopback_stream (the frame stream of a HDMIIn), a Loopback can stream the captured frames
+    directly to the output instead of the frames read from memory: the DMA is then stopped and no
+    DRAM bandwidth is used. loopback_depth words are buffered, so the output should be genlocked to
+    the input with a latency of a few lines.
+
+    When prefetch_lines is non-zero, the start of each frame is held back until prefetch_lines lines
+    are available in the DMA FIFO (or until the DMA can't prefetch more). fifo_level_min reports the
+    minimum FIFO level seen during active video of the last frame.
     """
-    def __init__(self, dram_port, mode="rgb", fifo_depth=512, genlock_stream=None):
+    def __init__(self, dram_port, mode="rgb", fifo_depth=512, genlock_stream=None, pixels_per_clock=1,
+        burst_length=1, nbuffers=1, with_scaler=False, scaler_max_hres=2048, loopback_stream=None,
+        loopback_depth=512):
         try:
             dw = modes_dw[mode]
         except:
             raise ValueError("Unsupported {} video mode".format(mode))
+        if pixels_per_clock not in [1, 2, 4]:
+            raise ValueError("Unsupported {} pixels per clock".format(pixels_per_clock))
+        if mode == "rle" and pixels_per_clock > 1:
+            raise ValueError("Video mode {} not supported with {} pixels per clock".format(mode, pixels_per_clock))
+        pixel_dw = 2**log2_int(dw, need_pow2=False)
         assert dram_port.dw >= dw
-        assert dram_port.dw == 2**log2_int(dw, need_pow2=False)
-        self.source = source = stream.Endpoint(video_out_layout(dw))  # "output" is a video layout that's dw wide
+        assert dram_port.dw%(pixels_per_clock*pixel_dw) == 0
+        if mode == "rle":
+            assert dram_port.dw == pixel_dw
+        if genlock_stream != None and pixels_per_clock > 1:
+            raise ValueError("Genlock not supported with {} pixels per clock".format(pixels_per_clock))
+        if with_scaler and (mode != "rgb" or pixels_per_clock > 1):
+            raise ValueError("Scaler is only supported in rgb mode with 1 pixel per clock")
+        if loopback_stream is not None:
+            if mode == "rle":
+                raise ValueError("Loopback not supported in {} video mode".format(mode))
+            assert len(loopback_stream.pixels) == dram_port.dw
+        self.source = source = stream.Endpoint(video_out_layout(dw, pixels_per_clock))  # "output" is a video layout that's dw*pixels_per_clock wide
 
         self.underflow_enable = CSRStorage()
         self.underflow_update = CSR()
         self.underflow_counter = CSRStatus(32)
 
+        if genlock_stream == None:
+            self.prefetch_lines = CSRStorage(vbits)
+        self.fifo_level_min = CSRStatus(bits_for(fifo_depth))
+
         # # #
 
         cd = dram_port.cd
 
         self.submodules.initiator = initiator = Initiator(cd)
+        self.submodules.timing = timing = ClockDomainsRenamer(cd)(TimingGenerator(pixels_per_clock))
+        self.submodules.dma = dma = ClockDomainsRenamer(cd)(DMAReader(dram_port, fifo_depth, burst_length))
+
+        sync = getattr(self.sync, cd)
+
+        # genlock
+        if genlock_stream != None:
+            self.submodules.genlock = genlock = GenlockController(cd, genlock_stream)
+            self.comb += [
+                genlock.frame_start.eq(timing.source.valid & timing.source.ready & timing.source.last),
+                timing.adjust.eq(genlock.adjust)
+            ]
+
+        # loopback
+        loopback_enabled = Signal()
+        if loopback_stream is not None:
+            self.submodules.loopback = loopback = Loopback(cd, loopback_stream, loopback_depth)
+            self.comb += [
+                loopback.frame_end.eq(~initiator.source.valid |
+                                      (timing.source.valid & timing.source.ready & timing.source.last)),
+                loopback_enabled.eq(loopback.enabled)
+            ]
+
+        # pixels stream
+        pixels = dma.source
+        if loopback_stream is not None:
+            pixels = stream.Endpoint([("data", dram_port.dw)])
+            self.comb += \
+                If(loopback_enabled,
+                    loopback.source.connect(pixels)
+                ).Else(
+                    dma.source.connect(pixels)
+                )
+        if dram_port.dw > pixel_dw and mode != "rle":
+            words = stream.Endpoint([("data", dram_port.dw)])
+            self.comb += [
+                pixels.connect(words, omit={"data"}),
+                # the first pixel of a DRAM word is in its msbs, swap the pixels for the unpacker
+                words.data.eq(Cat(*reversed([pixels.data[i*pixel_dw:(i+1)*pixel_dw]
+                    for i in range(dram_port.dw//pixel_dw)])))
+            ]
+            pixels = words
+        if dram_port.dw > pixels_per_clock*pixel_dw:
+            self.submodules.unpacker = unpacker = ClockDomainsRenamer(cd)(
+                stream.Converter(dram_port.dw, pixels_per_clock*pixel_dw))
+            self.comb += pixels.connect(unpacker.sink)
+            pixels = unpacker.source
+        if mode == "rle":
+            self.submodules.decoder = decoder = ClockDomainsRenamer(cd)(RLEDecoder())
+            self.comb += dma.source.connect(decoder.sink)
+            pixels = decoder.source
+        if with_scaler:
+            self.submodules.scaler = scaler = ClockDomainsRenamer(cd)(ResetInserter()(Scaler(scaler_max_hres)))
+            self.comb += [
+                pixels.connect(scaler.sink),
+                scaler.reset.eq(~initiator.source.valid),
+                scaler.hres.eq(initiator.source.hres),
+                scaler.vres.eq(initiator.source.vres)
+            ]
+            pixels = scaler.source
+
+        # prefetch (in rle mode, each word holds at least one pixel)
+        prefetch_wait = Signal()
         if genlock_stream == None:
-            self.submodules.timing = timing = ClockDomainsRenamer(cd)(TimingGenerator())
-        else:
-            self.submodules.timing = timing = ClockDomainsRenamer(cd)(TimingGenerator(genlock_stream))
-        self.submodules.dma = dma = ClockDomainsRenamer(cd)(DMAReader(dram_port, fifo_depth, genlock_stream))
+            prefetch_lines = Signal(vbits)
+            prefetch_words = Signal(hbits + vbits)
+            self.specials += MultiReg(self.prefetch_lines.storage, prefetch_lines, cd)
+            # lines read by the DMA (source lines of the scaler)
+            dma_hres = scaler.src_hres if with_scaler else timing.sink.hres
+            sync += [
+                prefetch_words.eq(prefetch_lines*dma_hres[log2_int(dram_port.dw//pixel_dw):]),
+                If(~initiator.source.valid | (timing.source.valid & timing.source.ready & timing.source.last),
+                    prefetch_wait.eq(1)  # hold the start of the frame...
+                ).Elif((dma.level >= prefetch_words) | dma.stalled | loopback_enabled,
+                    prefetch_wait.eq(0)  # ...until enough lines are prefetched
+                )
+            ]
 
         # ctrl path
         self.comb += timing.sink.valid.eq(initiator.source.valid) # if the CSR FIFO data is valid, timing may proceed
 
         self.comb += [
             # dispatch initiator parameters to timing & dma
-            dma.sink.valid.eq(initiator.source.valid),   # the DMA's parameter input "pushed" from the initiator, so connect the valids
+            dma.sink.valid.eq(initiator.source.valid & ~loopback_enabled),   # the DMA's parameter input "pushed" from the initiator, so connect the valids
             initiator.source.ready.eq(timing.sink.ready), # timing's parameters come from initiator, but this is "pulled" by timing so connect readys
 
             # combine timing and dma
-            source.valid.eq(timing.source.valid & (~timing.source.de | dma.source.valid)), # our output is valid only when timing's outputs are valid and (when the dma's output is valid or de is low)
+            source.valid.eq(timing.source.valid & ~prefetch_wait & (~timing.source.de | pixels.valid)), # our output is valid only when timing's outputs are valid and (when the dma's output is valid or de is low)
               # the "or de is low" thing seems like a hack to fix some edge case??
             # flush dma/timing when disabled
             If(~initiator.source.valid,  # if the initiator's (e.g. CSR) outputs aren't valid
                 timing.source.ready.eq(1), # force the outputs to 1 to keep the DMA running
-                dma.source.ready.eq(1)
+                pixels.ready.eq(1)
             ).Elif(source.valid & source.ready, # else if our DMA output stream has valid data, and is ready to accept addresses
                 timing.source.ready.eq(1),  # output stream of timing is ready to go, which kicks off the timing generator...
-                dma.source.ready.eq(timing.source.de | (mode == "raw"))  # and the DMA's DMAReader source ready is tied to the timing's DE signal
+                pixels.ready.eq(timing.source.de | (mode == "raw"))  # and the DMA's DMAReader source ready is tied to the timing's DE signal
             )
         ]
 
@@ -246,15 +677,27 @@ class VideoOutCore(Module, AutoCSR):
         self.comb += [
             # dispatch initiator parameters to timing & dma
             initiator.source.connect(timing.sink, keep=list_signals(frame_parameter_layout)), # initiator is a compound source, so use "keep" to demux. initiator sources config data to the timer
-            initiator.source.connect(dma.sink, keep=list_signals(frame_dma_layout)),  # the initiator sources parameters to the DMA, which are DMA layout config data
 
             # combine timing and dma
             source.de.eq(timing.source.de),  # manually assign this block's video de, hsync, vsync outputs,, to the respective timing or DMA outputs
             source.hsync.eq(timing.source.hsync),
             source.vsync.eq(timing.source.vsync),
-            source.data.eq(dma.source.data)
+            source.data.eq(Cat(*[pixels.data[i*pixel_dw:i*pixel_dw+dw] for i in range(pixels_per_clock)]))  # unpack the pixels of the DRAM word
         ]
 
+        # dma parameters
+        if nbuffers == 1:
+            self.comb += initiator.source.connect(dma.sink, keep=list_signals(frame_dma_layout))  # the initiator sources parameters to the DMA, which are DMA layout config data
+        else:
+            self.submodules.pageflipper = pageflipper = PageFlipper(cd, nbuffers)
+            self.ev = pageflipper.ev
+            self.comb += [
+                initiator.source.connect(dma.sink, keep=["length"]),
+                dma.sink.base.eq(pageflipper.base),
+                pageflipper.dma_start.eq(~initiator.source.valid | (dma.sink.valid & dma.sink.ready)),
+                pageflipper.frame_end.eq(timing.source.valid & timing.source.ready & timing.source.last)
+            ]
+
         # underflow detection
         underflow_enable = Signal()
         underflow_update = Signal()
@@ -266,10 +709,9 @@ class VideoOutCore(Module, AutoCSR):
             underflow_update_synchronizer.i.eq(self.underflow_update.re),
             underflow_update.eq(underflow_update_synchronizer.o)
         ]
-        sync = getattr(self.sync, cd)
         sync += [
             If(underflow_enable,
-                If(~source.valid,  # count whenever the source isn't valid...
+                If(~source.valid & ~prefetch_wait,  # count whenever the source isn't valid...
                     underflow_counter.eq(underflow_counter + 1)
                 )
             ).Else(
@@ -279,3 +721,18 @@ class VideoOutCore(Module, AutoCSR):
                 self.underflow_counter.status.eq(underflow_counter)
             )
         ]
+
+        # fifo level monitoring
+        level_min = Signal(max=fifo_depth + 1, reset=fifo_depth)
+        level_min_st = Signal(max=fifo_depth + 1)
+        sync += [
+            If(timing.source.valid & timing.source.ready & timing.source.last,
+                level_min_st.eq(level_min),
+                level_min.eq(fifo_depth)
+            ).Elif(timing.source.valid & timing.source.de & (dma.level < level_min),
+                level_min.eq(dma.level)
+            )
+        ]
+        self.specials += MultiReg(level_min_st, self.fifo_level_min.status)
+
+    autocsr_exclude = {"ev"}
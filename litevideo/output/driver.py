@@ -36,13 +36,55 @@ class VGAPHY(Module):
         ]
 
 
+class PixelGearbox(Module):
+    """Pixel Gearbox
+
+    Converts a stream of pixels_per_clock pixels per cycle ("write" clock domain) to a stream of
+    one pixel per cycle ("read" clock domain). Timing signals are replicated on each pixel of a group.
+    """
+    def __init__(self, mode, pixels_per_clock, fifo_depth=16):
+        self.sink = sink = stream.Endpoint(phy_layout(mode, pixels_per_clock))
+        self.source = source = stream.Endpoint(phy_layout(mode))
+
+        # # #
+
+        payload = [(name, width//pixels_per_clock) for name, width in sink.description.payload_layout]
+        timing = list_signals(frame_timing_layout)
+        pixel_width = sum(width for name, width in payload) + len(timing)
+
+        cdc = stream.AsyncFIFO([("data", pixel_width*pixels_per_clock)], fifo_depth)
+        converter = stream.Converter(pixel_width*pixels_per_clock, pixel_width)
+        converter = ClockDomainsRenamer("read")(converter)
+        self.submodules += cdc, converter
+
+        # pack pixels (first pixel in lsbs)
+        pixels = []
+        for i in range(pixels_per_clock):
+            pixels += [getattr(sink, name)[i*width:(i+1)*width] for name, width in payload]
+            pixels += [getattr(sink, name) for name in timing]
+        self.comb += [
+            sink.connect(cdc.sink, keep={"valid", "ready"}),
+            cdc.sink.data.eq(Cat(*pixels)),
+            cdc.source.connect(converter.sink),
+            converter.source.connect(source, keep={"valid", "ready"})
+        ]
+
+        # unpack pixel, blank when no pixel is available
+        pixel = Cat(*([getattr(source, name) for name, width in payload] +
+                      [getattr(source, name) for name in timing]))
+        self.comb += If(converter.source.valid, pixel.eq(converter.source.data))
+
+
 class Driver(Module, AutoCSR):
     """Driver
 
     Low level video interface module.
+
+    With pixels_per_clock > 1, the sink receives pixels_per_clock pixels per cycle of the cd clock
+    domain and a PixelGearbox serializes them to the PHY's pixel clock domain.
     """
-    def __init__(self, device, pads, mode, external_clocking=None):
-        self.sink = sink = stream.Endpoint(phy_layout(mode))
+    def __init__(self, device, pads, mode, external_clocking=None, pixels_per_clock=1, cd="pix"):
+        self.sink = sink = stream.Endpoint(phy_layout(mode, pixels_per_clock))
 
         # # #
 
@@ -51,6 +93,14 @@ class Driver(Module, AutoCSR):
         # clocking
         self.submodules.clocking = clocking_cls[family](pads, external_clocking)
 
+        # gearbox
+        if pixels_per_clock > 1:
+            gearbox = PixelGearbox(mode, pixels_per_clock)
+            gearbox = ClockDomainsRenamer({"write": cd, "read": "pix"})(gearbox)
+            self.submodules.gearbox = gearbox
+            self.comb += sink.connect(gearbox.sink)
+            sink = gearbox.source
+
         # phy
         vga = hasattr(pads, "hsync_n")
         if vga:
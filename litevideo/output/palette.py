@@ -0,0 +1,48 @@
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+from litevideo.output.common import *
+
+
+def rgb565_to_rgb(pixel):
+    """Expands a rgb565 pixel (r in lsbs) to a rgb pixel, replicating the msbs in the lsbs."""
+    r, g, b = pixel[0:5], pixel[5:11], pixel[11:16]
+    return Cat(r[2:], r, g[4:], g, b[2:], b)
+
+
+class Palette(Module, AutoCSR):
+    """Palette
+
+    Converts a stream of 8-bit indexed pixels to rgb pixels through a 256-entry palette stored in
+    block RAM (mem, entries in "rgb" format).
+    """
+    def __init__(self):
+        self.sink = sink = stream.Endpoint(video_out_layout(8))
+        self.source = source = stream.Endpoint(video_out_layout(24))
+
+        self.specials.mem = Memory(24, 256)
+
+        # # #
+
+        ce = Signal()
+        self.comb += [
+            ce.eq(source.ready),
+            sink.ready.eq(ce)
+        ]
+
+        rdport = self.mem.get_port(has_re=True)
+        self.specials += rdport
+        self.comb += [
+            rdport.re.eq(ce),
+            rdport.adr.eq(sink.data),
+            source.data.eq(rdport.dat_r)
+        ]
+        self.sync += \
+            If(ce,
+                source.valid.eq(sink.valid),
+                source.de.eq(sink.de),
+                source.hsync.eq(sink.hsync),
+                source.vsync.eq(sink.vsync)
+            )
@@ -0,0 +1,74 @@
+"""Run-length encoded frame buffers
+
+Compressed frame buffer format ("rle" mode of VideoOutCore):
+
+Each 32-bit word of the frame buffer describes a run of identical pixels:
+
+  31......24 23..................0
+  run_length        pixel
+  (length-1)  (same format as "rgb")
+
+Runs contain 1 to 256 pixels and never cross a line boundary, so a line always starts on a new
+word. The frame buffer length programmed in the Initiator is the number of words * 4.
+"""
+
+from migen import *
+
+from litex.soc.interconnect import stream
+
+
+max_run_length = 256
+
+
+def rle_encode(pixels, hres):
+    """Encode a frame (list of 24-bit pixels in raster order) to a list of 32-bit words."""
+    assert len(pixels)%hres == 0
+    words = []
+    for line in range(len(pixels)//hres):
+        run_pixel = None
+        run_length = 0
+        for pixel in pixels[line*hres:(line+1)*hres]:
+            if pixel == run_pixel and run_length < max_run_length:
+                run_length += 1
+            else:
+                if run_pixel is not None:
+                    words.append(((run_length - 1) << 24) | run_pixel)
+                run_pixel = pixel & 0xffffff
+                run_length = 1
+        words.append(((run_length - 1) << 24) | run_pixel)
+    return words
+
+
+def rle_decode(words):
+    """Decode a list of 32-bit words to a list of 24-bit pixels (reference model)."""
+    pixels = []
+    for word in words:
+        pixels += [word & 0xffffff]*((word >> 24) + 1)
+    return pixels
+
+
+class RLEDecoder(Module):
+    """RLE decoder
+
+    Expands the runs of a compressed frame buffer to pixels.
+    """
+    def __init__(self):
+        self.sink = sink = stream.Endpoint([("data", 32)])
+        self.source = source = stream.Endpoint([("data", 24)])
+
+        # # #
+
+        count = Signal(8)
+        self.comb += [
+            source.valid.eq(sink.valid),
+            source.data.eq(sink.data[:24]),
+            sink.ready.eq(source.ready & (count == sink.data[24:]))  # last pixel of the run
+        ]
+        self.sync += \
+            If(source.valid & source.ready,
+                If(sink.ready,
+                    count.eq(0)
+                ).Else(
+                    count.eq(count + 1)
+                )
+            )
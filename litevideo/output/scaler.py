@@ -0,0 +1,221 @@
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+from litevideo.output.common import *
+
+
+scale_frac_bits = 12  # scale factors are unsigned 4.12 fixed point numbers
+
+
+def interpolate(a, b, w):
+    # (a*(256-w) + b*w)/256
+    return (a*(256 - w) + b*w)[8:16]
+
+
+class Scaler(Module, AutoCSR):
+    """Scaler
+
+    Scales a frame of src_hres x src_vres rgb pixels to the hres x vres frame of the timing
+    generator using nearest neighbour (filter=0) or bilinear (filter=1) interpolation.
+
+    hscale/vscale are the source pixels per output pixel (4.12 fixed point, i.e. src_hres*4096/hres),
+    so values < 4096 upscale and values > 4096 downscale.
+
+    The source frame is written in raster order in 4 line buffers (split in even/odd columns so that
+    the 2 horizontal neighbours can be read in parallel). Output pixels are computed ahead of the
+    display in a small FIFO, as soon as the 2 source lines they need are available.
+    """
+    def __init__(self, max_hres=2048, fifo_depth=16):
+        self.sink = sink = stream.Endpoint([("data", 24)])
+        self.source = source = stream.Endpoint([("data", 24)])
+
+        # output resolution (from the timing generator parameters)
+        self.hres = Signal(hbits)
+        self.vres = Signal(vbits)
+
+        self._src_hres = CSRStorage(hbits)
+        self._src_vres = CSRStorage(vbits)
+        self._hscale = CSRStorage(16, reset=2**scale_frac_bits)
+        self._vscale = CSRStorage(16, reset=2**scale_frac_bits)
+        self._filter = CSRStorage()
+
+        # # #
+
+        nlines = 4
+        depth = max_hres//2
+
+        self.src_hres = src_hres = Signal(hbits)  # source line length (read by the DMA)
+        src_vres = Signal(vbits)
+        hscale = Signal(16)
+        vscale = Signal(16)
+        bilinear = Signal()
+        self.specials += [
+            MultiReg(self._src_hres.storage, src_hres),
+            MultiReg(self._src_vres.storage, src_vres),
+            MultiReg(self._hscale.storage, hscale),
+            MultiReg(self._vscale.storage, vscale),
+            MultiReg(self._filter.storage, bilinear)
+        ]
+
+        # line buffers [line][column parity]
+        wrports = []
+        rdports = []
+        for line in range(nlines):
+            for parity in range(2):
+                mem = Memory(24, depth)
+                wrport = mem.get_port(write_capable=True)
+                rdport = mem.get_port()
+                self.specials += mem, wrport, rdport
+                wrports.append(wrport)
+                rdports.append(rdport)
+
+        # output position
+        restart = Signal()
+        ox = Signal(hbits)
+        oy = Signal(vbits)
+        sx = Signal(hbits + scale_frac_bits)
+        sy = Signal(vbits + scale_frac_bits)
+        x0 = Signal(hbits)
+        y0 = Signal(vbits)
+        self.comb += [
+            x0.eq(sx[scale_frac_bits:]),
+            y0.eq(sy[scale_frac_bits:])
+        ]
+
+        # line buffers writer
+        wx = Signal(hbits)
+        wline = Signal(vbits + 1)  # number of source lines written
+        self.comb += [
+            # don't overwrite lines still needed by the output
+            sink.ready.eq((wline < (y0 + nlines)) & (wline != src_vres)),
+        ]
+        for n, wrport in enumerate(wrports):
+            self.comb += [
+                wrport.adr.eq(wx[1:]),
+                wrport.dat_w.eq(sink.data),
+                wrport.we.eq(sink.valid & sink.ready &
+                             (wline[:log2_int(nlines)] == n//2) &
+                             (wx[0] == n%2))
+            ]
+        self.sync += \
+            If(restart,
+                wx.eq(0),
+                wline.eq(0)
+            ).Elif(sink.valid & sink.ready,
+                If(wx == (src_hres - 1),
+                    wx.eq(0),
+                    wline.eq(wline + 1)
+                ).Else(
+                    wx.eq(wx + 1)
+                )
+            )
+
+        # output pixels generator
+        inflight = Signal(max=fifo_depth + 1)
+        issue = Signal()
+        last_line = Signal()
+        self.comb += last_line.eq(y0 >= (src_vres - 1))
+
+        self.submodules.fsm = fsm = FSM(reset_state="WAIT_LINES")
+        fsm.act("WAIT_LINES",
+            # wait until the 2 source lines of the output line are available
+            If(wline > Mux(last_line, y0, y0 + 1),
+                NextState("LINE")
+            )
+        )
+        fsm.act("LINE",
+            issue.eq(inflight < fifo_depth),
+            If(issue,
+                NextValue(sx, sx + hscale),
+                NextValue(ox, ox + 1),
+                If(ox == (self.hres - 1),
+                    NextValue(sx, 0),
+                    NextValue(sy, sy + vscale),
+                    NextValue(ox, 0),
+                    NextValue(oy, oy + 1),
+                    If(oy == (self.vres - 1),
+                        NextState("WAIT_FRAME")
+                    ).Else(
+                        NextState("WAIT_LINES")
+                    )
+                )
+            )
+        )
+        fsm.act("WAIT_FRAME",
+            # wait until the whole source frame has been received
+            If(wline == src_vres,
+                restart.eq(1),
+                NextValue(sy, 0),
+                NextValue(oy, 0),
+                NextState("WAIT_LINES")
+            )
+        )
+
+        # stage 0: line buffers read
+        fx = Signal(8)
+        fy = Signal(8)
+        self.comb += [
+            If(bilinear & (x0 < (src_hres - 1)),
+                fx.eq(sx[scale_frac_bits-8:scale_frac_bits])
+            ),
+            If(bilinear & ~last_line,
+                fy.eq(sy[scale_frac_bits-8:scale_frac_bits])
+            )
+        ]
+        for n, rdport in enumerate(rdports):
+            if n%2:
+                self.comb += rdport.adr.eq(x0[1:])
+            else:
+                self.comb += rdport.adr.eq((x0 + x0[0])[1:])
+
+        stage1 = Record([("valid", 1), ("odd", 1), ("top", log2_int(nlines)), ("fx", 8), ("fy", 8)])
+        self.sync += [
+            stage1.valid.eq(issue),
+            stage1.odd.eq(x0[0]),
+            stage1.top.eq(y0[:log2_int(nlines)]),
+            stage1.fx.eq(fx),
+            stage1.fy.eq(fy)
+        ]
+
+        # stage 1: horizontal interpolation
+        even = Array(rdports[2*i].dat_r for i in range(nlines))
+        odd = Array(rdports[2*i+1].dat_r for i in range(nlines))
+        p = {}
+        for name, line in [("top", stage1.top), ("bottom", stage1.top + 1)]:
+            left = Signal(24, name=name + "_left")
+            right = Signal(24, name=name + "_right")
+            line_idx = Signal(log2_int(nlines), name=name + "_line")
+            self.comb += [
+                line_idx.eq(line),
+                If(stage1.odd,
+                    left.eq(odd[line_idx]),
+                    right.eq(even[line_idx])
+                ).Else(
+                    left.eq(even[line_idx]),
+                    right.eq(odd[line_idx])
+                )
+            ]
+            p[name] = Signal(24, name=name)
+            self.sync += [p[name][8*i:8*(i+1)].eq(
+                interpolate(left[8*i:8*(i+1)], right[8*i:8*(i+1)], stage1.fx)) for i in range(3)]
+
+        stage2 = Record([("valid", 1), ("fy", 8)])
+        self.sync += [
+            stage2.valid.eq(stage1.valid),
+            stage2.fy.eq(stage1.fy)
+        ]
+
+        # stage 2: vertical interpolation
+        fifo = stream.SyncFIFO([("data", 24)], fifo_depth)
+        self.submodules += fifo
+        self.sync += [
+            fifo.sink.valid.eq(stage2.valid),
+            [fifo.sink.data[8*i:8*(i+1)].eq(
+                interpolate(p["top"][8*i:8*(i+1)], p["bottom"][8*i:8*(i+1)], stage2.fy)) for i in range(3)]
+        ]
+        self.comb += fifo.source.connect(source)
+
+        self.sync += inflight.eq(inflight + issue - (source.valid & source.ready))
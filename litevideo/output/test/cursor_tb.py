@@ -0,0 +1,97 @@
+from migen import *
+
+from litevideo.output.compositor import Cursor
+
+
+size = 4
+hres, vres = 16, 8
+hblank, vblank = 8, 4
+# (enable, x, y) of each frame
+positions = [(0, 3, 2), (1, 3, 2), (1, 14, 6), (1, 0, 0)]
+
+
+def background(x, y):
+    return (x*8) | ((y*16) << 8) | (0x40 << 16)
+
+
+def sprite_pixel(i):
+    # opaque, transparent and half transparent pixels
+    alpha = [255, 0, 128][i%3]
+    return (alpha << 24) | 0xc00000 | (i*8 << 8) | (0xff - i)
+
+
+def blend(fg, bg, alpha):
+    a = alpha + (alpha >> 7)
+    return sum(((a*((fg >> 8*i) & 0xff) + (256 - a)*((bg >> 8*i) & 0xff)) >> 8) << 8*i for i in range(3))
+
+
+def reference(x, y, enable, cx, cy):
+    pixel = background(x, y)
+    if enable and cx <= x < cx + size and cy <= y < cy + size:
+        fg = sprite_pixel((y - cy)*size + (x - cx))
+        pixel = blend(fg & 0xffffff, pixel, fg >> 24)
+    return pixel
+
+
+class TB(Module):
+    def __init__(self):
+        self.submodules.cursor = Cursor(size)
+        # backpressure on every other cycle
+        self.sync += self.cursor.source.ready.eq(~self.cursor.source.ready)
+
+
+def set_position(dut, frame):
+    enable, x, y = positions[frame]
+    for name, value in [("enable", enable), ("x", x), ("y", y)]:
+        yield getattr(dut.cursor, "_" + name).storage.eq(value)
+
+
+def video_generator(dut):
+    for i in range(size*size):
+        yield dut.cursor.mem[i].eq(sprite_pixel(i))
+    yield from set_position(dut, 0)
+    for i in range(4):
+        yield
+    sink = dut.cursor.sink
+    for frame in range(len(positions)):
+        for v in range(vres + vblank):
+            for h in range(hres + hblank):
+                if v == vres + 2 and h == 0 and frame + 1 < len(positions):
+                    # move the cursor during the vertical blanking
+                    yield from set_position(dut, frame + 1)
+                yield sink.valid.eq(1)
+                yield sink.de.eq(int(h < hres and v < vres))
+                yield sink.hsync.eq(int(h == hres + 2))
+                yield sink.vsync.eq(int(v == vres + 1))
+                yield sink.data.eq(background(h, v))
+                yield
+                while not (yield sink.ready):
+                    yield
+    for i in range(16):
+        yield
+
+
+@passive
+def video_capture_generator(dut, frames):
+    pixels = []
+    while True:
+        if ((yield dut.cursor.source.valid) and
+            (yield dut.cursor.source.ready)):
+            if (yield dut.cursor.source.de):
+                pixels.append((yield dut.cursor.source.data))
+            elif (yield dut.cursor.source.vsync) and pixels:
+                frames.append(pixels)
+                pixels = []
+        yield
+
+
+if __name__ == "__main__":
+    tb = TB()
+    frames = []
+    run_simulation(tb, [video_generator(tb), video_capture_generator(tb, frames)])
+
+    print("frames: {:d}".format(len(frames)))
+    assert len(frames) == len(positions)
+    for frame, (pixels, (enable, cx, cy)) in enumerate(zip(frames, positions)):
+        expected = [reference(x, y, enable, cx, cy) for y in range(vres) for x in range(hres)]
+        assert pixels == expected, "frame {:d}".format(frame)
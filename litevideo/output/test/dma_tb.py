@@ -0,0 +1,171 @@
+from migen import *
+
+from litedram.common import LiteDRAMPort
+
+from litevideo.output.core import DMAReader, VideoOutCore
+
+
+burst_length = 4
+watermark = 16
+max_pending = 8
+frame_words = 48
+
+
+class DRAMModel:
+    """Pipelined read port: returns the address as data, latency cycles after the command"""
+    def __init__(self, latency=8):
+        self.latency = latency
+        self.commands = []  # (cycle, address) of the accepted commands
+        self.valid = []     # cmd.valid of each cycle
+        self.max_pending = 0
+
+    @passive
+    def generator(self, dram_port):
+        cycle = 0
+        inflight = []
+        while True:
+            # handshakes of the current cycle
+            self.valid.append((yield dram_port.cmd.valid))
+            if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+                address = (yield dram_port.cmd.adr)
+                self.commands.append((cycle, address))
+                inflight.append((cycle + self.latency, address))
+            if (yield dram_port.rdata.valid) and (yield dram_port.rdata.ready):
+                inflight.pop(0)
+            self.max_pending = max(self.max_pending, len(inflight))
+            # next cycle
+            cycle += 1
+            yield dram_port.cmd.ready.eq(cycle%16 != 15)
+            if inflight and inflight[0][0] <= cycle:
+                yield dram_port.rdata.valid.eq(1)
+                yield dram_port.rdata.data.eq(inflight[0][1])
+            else:
+                yield dram_port.rdata.valid.eq(0)
+            yield
+
+
+# DMAReader: aligned bursts, throttling and abort
+
+class TB(Module):
+    def __init__(self):
+        self.dram_port = LiteDRAMPort(mode="read", aw=32, dw=32)
+        self.submodules.dma = DMAReader(self.dram_port, fifo_depth=32, burst_length=burst_length)
+
+
+def main_generator(dut, consumed):
+    yield dut.watermark.storage.eq(watermark)
+    yield dut.max_pending.storage.eq(max_pending)
+    for i in range(8):
+        yield
+    for frame, base in enumerate([0x100, 0x200, 0x300]):
+        start = len(consumed)
+        yield dut.sink.base.eq(base*4)
+        yield dut.sink.length.eq(frame_words*4)
+        yield dut.sink.valid.eq(1)
+        while True:
+            if frame == 1 and len(consumed) >= start + 10:
+                # abort the second frame after 10 words
+                yield dut.sink.valid.eq(0)
+                yield dut.abort.eq(1)
+                for i in range(32):
+                    yield
+                yield dut.abort.eq(0)
+                break
+            if (yield dut.sink.ready):
+                yield dut.sink.valid.eq(0)
+                yield
+                break
+            yield
+        if frame != 1:
+            while len(consumed) < start + frame_words:
+                yield
+    for i in range(64):
+        yield
+
+
+@passive
+def source_generator(dut, dram, consumed, requested):
+    cycle = 0
+    while True:
+        yield dut.source.ready.eq(cycle%3 != 0)
+        yield
+        if (yield dut.source.valid) and (yield dut.source.ready):
+            consumed.append((yield dut.source.data))
+        if len(consumed) < frame_words:
+            requested.append(len(dram.commands) - len(consumed))
+        cycle += 1
+
+
+def check_bursts(commands, valid, base):
+    # the commands of a frame are only interrupted between aligned bursts
+    commands = [(cycle, address) for cycle, address in commands if base <= address < base + frame_words]
+    assert [address for cycle, address in commands] == list(range(base, base + frame_words))
+    for (start, a), (end, b) in zip(commands, commands[1:]):
+        if not all(valid[start:end + 1]):
+            assert b%burst_length == 0, "burst interrupted at {:x}".format(b)
+
+
+# VideoOutCore: underflows with a DRAM latency longer than the prefetch
+
+class CoreTB(Module):
+    def __init__(self):
+        self.dram_port = LiteDRAMPort(mode="read", aw=32, dw=32, cd="video")
+        self.submodules.core = VideoOutCore(self.dram_port, fifo_depth=64, burst_length=burst_length)
+        self.comb += self.core.source.ready.eq(1)
+
+
+def core_generator(dut, max_pending, underflows):
+    yield dut.core.dma.max_pending.storage.eq(max_pending)
+    yield dut.core.prefetch_lines.storage.eq(1)
+    for name, value in [("hres", 16), ("hsync_start", 18), ("hsync_end", 20), ("hscan", 24),
+                        ("vres", 8), ("vsync_start", 9), ("vsync_end", 10), ("vscan", 12),
+                        ("base", 0), ("length", 16*8*4)]:
+        yield getattr(dut.core.initiator, name).storage.eq(value)
+    yield
+    yield dut.core.initiator.enable.storage.eq(1)
+    for i in range(16):
+        yield
+    yield dut.core.underflow_enable.storage.eq(1)
+    for i in range(3*24*12):
+        yield
+    yield dut.core.underflow_update.re.eq(1)
+    yield
+    yield dut.core.underflow_update.re.eq(0)
+    for i in range(16):
+        yield
+    underflows.append((yield dut.core.underflow_counter.status))
+
+
+def check_underflows(max_pending):
+    tb = CoreTB()
+    dram = DRAMModel(latency=40)
+    underflows = []
+    run_simulation(tb, {"sys": [core_generator(tb, max_pending, underflows)],
+        "video": [dram.generator(tb.dram_port)]}, {"sys": 10, "video": 10})
+    print("max_pending: {}, underflows: {}".format(max_pending, underflows[0]))
+    return underflows[0]
+
+
+def check_dma():
+    tb = TB()
+    dram = DRAMModel()
+    consumed = []
+    requested = []
+    run_simulation(tb.dma, [main_generator(tb.dma, consumed), source_generator(tb.dma, dram, consumed, requested),
+        dram.generator(tb.dram_port)])
+    frames = [list(range(base, base + frame_words)) for base in [0x100, 0x200, 0x300]]
+    aborted = len(consumed) - 2*frame_words
+    print("words consumed in the aborted frame: {}".format(aborted))
+    assert 10 <= aborted < frame_words
+    assert consumed == frames[0] + frames[1][:aborted] + frames[2]
+    check_bursts(dram.commands, dram.valid, 0x100)
+    check_bursts(dram.commands, dram.valid, 0x300)
+    assert max(requested) <= watermark
+    assert dram.max_pending <= max_pending
+
+
+if __name__ == "__main__":
+    check_dma()
+    # with enough reads in flight, the latency is hidden
+    assert check_underflows(64) == 0
+    assert check_underflows(burst_length) > 0
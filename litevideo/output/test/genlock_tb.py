@@ -0,0 +1,52 @@
+from migen import *
+
+from litevideo.output.common import hbits, vbits
+from litevideo.output.core import GenlockController
+
+
+period = 1000
+target = 100
+
+
+class TB(Module):
+    def __init__(self):
+        self.genlock_stream = Record([("vsync", 1)])
+        self.submodules.genlock = GenlockController("sys", self.genlock_stream)
+
+
+def to_signed(value, nbits):
+    return value - 2**nbits if value & 2**(nbits - 1) else value
+
+
+def main_generator(dut, offsets, phases):
+    yield dut.genlock.target.storage.eq(target)
+    yield dut.genlock.max_step.storage.eq(16)
+    # first genlock frame: measures the period
+    for frame in range(len(offsets) + 1):
+        yield dut.genlock_stream.vsync.eq(1)
+        for i in range(period):
+            if i == 4:
+                yield dut.genlock_stream.vsync.eq(0)
+            if frame > 0 and i == (target + offsets[frame - 1]):
+                yield dut.genlock.frame_start.eq(1)
+            else:
+                yield dut.genlock.frame_start.eq(0)
+            if frame > 0 and i == (target + offsets[frame - 1] + 8):
+                phases.append(to_signed((yield dut.genlock.phase.status), hbits + vbits + 1))
+            yield
+
+
+if __name__ == "__main__":
+    tb = TB()
+    offsets = [-20, 30, period//2 + 100, 0]  # early, late, wrapped to early, on target
+    phases = []
+    run_simulation(tb, main_generator(tb, offsets, phases))
+    print("phases: {}".format(phases))
+    # the start of the genlock frame is seen 3 cycles late (vsync synchronizer and edge detection)
+    expected = []
+    for offset in offsets:
+        error = offset - 3
+        if error >= period//2:
+            error -= period
+        expected.append(error)
+    assert phases == expected, "expected {}".format(expected)
@@ -0,0 +1,96 @@
+from migen import *
+
+from litedram.common import LiteDRAMPort
+
+from litevideo.input.analysis import FrameExtraction
+from litevideo.output.core import VideoOutCore
+
+
+word_width = 64  # 4 rgb565 pixels per word
+hres, vres = 8, 4
+hblank, vblank = 8, 3
+nframes = 4
+
+
+class TB(Module):
+    def __init__(self):
+        self.submodules.frame = FrameExtraction(word_width, 64, "rgb565")
+        self.dram_port = LiteDRAMPort(mode="read", aw=32, dw=word_width, cd="video")
+        self.submodules.core = VideoOutCore(self.dram_port, mode="rgb565",
+            loopback_stream=self.frame.frame, loopback_depth=32)
+        self.comb += self.core.source.ready.eq(1)
+
+
+def pixel(frame, x, y):
+    # distinct rgb565 pixel values (r in lsbs), r/g/b of 8 bits
+    return 8*x, 4*y, 8*frame
+
+
+def rgb565(r, g, b):
+    return (r >> 3) | ((g >> 2) << 5) | ((b >> 3) << 11)
+
+
+def pix_generator(dut):
+    yield dut.valid_i.eq(1)
+    for i in range(8):
+        yield
+    for frame in range(nframes):
+        for y in range(vres + vblank):
+            for x in range(hres + hblank):
+                r, g, b = pixel(frame, x, y - 1)
+                yield dut.vsync.eq(int(y == 0))
+                yield dut.de.eq(int(x < hres and 1 <= y < 1 + vres))
+                yield dut.r.eq(r)
+                yield dut.g.eq(g)
+                yield dut.b.eq(b)
+                yield
+
+
+def main_generator(dut):
+    yield dut.core.loopback.enable.storage.eq(1)
+    yield dut.core.initiator.hres.storage.eq(hres)
+    yield dut.core.initiator.hsync_start.storage.eq(hres + 2)
+    yield dut.core.initiator.hsync_end.storage.eq(hres + 4)
+    yield dut.core.initiator.hscan.storage.eq(hres + hblank)
+    yield dut.core.initiator.vres.storage.eq(vres)
+    yield dut.core.initiator.vsync_start.storage.eq(vres + 1)
+    yield dut.core.initiator.vsync_end.storage.eq(vres + 2)
+    yield dut.core.initiator.vscan.storage.eq(vres + vblank)
+    yield dut.core.initiator.length.storage.eq(hres*vres*2)
+    for i in range(16):
+        yield
+    yield dut.core.initiator.enable.storage.eq(1)
+    yield
+
+
+@passive
+def video_capture_generator(dut, frames):
+    pixels = []
+    while True:
+        if ((yield dut.core.source.valid) and
+            (yield dut.core.source.ready)):
+            if (yield dut.core.source.de):
+                pixels.append((yield dut.core.source.data))
+            elif (yield dut.core.source.vsync) and pixels:
+                frames.append(pixels)
+                pixels = []
+        yield
+
+
+if __name__ == "__main__":
+    tb = TB()
+    frames = []
+    generators = {
+        "pix":   [pix_generator(tb.frame)],
+        "sys":   [main_generator(tb)],
+        "video": [video_capture_generator(tb, frames)]
+    }
+    clocks = {"pix": 10, "sys": 10, "video": 10}
+    run_simulation(tb, generators, clocks)
+
+    print("frames: {}".format(frames))
+    references = [[rgb565(*pixel(frame, x, y)) for y in range(vres) for x in range(hres)]
+        for frame in range(nframes)]
+    assert len(frames) >= 2
+    for pixels in frames:
+        assert pixels in references, "unexpected frame {}".format(pixels)
@@ -0,0 +1,104 @@
+from migen import *
+
+from litedram.common import LiteDRAMPort
+
+from litevideo.output.core import VideoOutCore
+
+
+hres, vres = 8, 4
+nbuffers = 3
+bases = [0x1000, 0x2000, 0x3000]
+
+
+class TB(Module):
+    def __init__(self):
+        self.dram_port = LiteDRAMPort(mode="read", aw=32, dw=32, cd="video")
+        self.submodules.core = VideoOutCore(self.dram_port, fifo_depth=16, nbuffers=nbuffers)
+        self.comb += self.core.source.ready.eq(1)
+
+
+@passive
+def dram_generator(dram_port):
+    # returns the word address as data
+    while True:
+        yield dram_port.cmd.ready.eq(1)
+        yield
+        if (yield dram_port.cmd.valid):
+            address = (yield dram_port.cmd.adr)
+            yield dram_port.cmd.ready.eq(0)
+            yield dram_port.rdata.valid.eq(1)
+            yield dram_port.rdata.data.eq(address)
+            yield
+            yield dram_port.rdata.valid.eq(0)
+
+
+@passive
+def video_capture_generator(dut, frames):
+    pixels = []
+    while True:
+        if ((yield dut.core.source.valid) and
+            (yield dut.core.source.ready)):
+            if (yield dut.core.source.de):
+                pixels.append((yield dut.core.source.data))
+            elif (yield dut.core.source.vsync) and pixels:
+                frames.append(pixels)
+                pixels = []
+        yield
+
+
+def frame_duration():
+    return (hres + 8)*(vres + 4)
+
+
+def main_generator(dut, frames, flips):
+    pageflipper = dut.core.pageflipper
+    for i, base in enumerate(bases):
+        yield getattr(pageflipper, "base" + str(i)).storage.eq(base*4)
+    yield pageflipper.ev.enable.storage.eq(1)
+    for name, value in [("hres", hres), ("hsync_start", hres + 2), ("hsync_end", hres + 4),
+                        ("hscan", hres + 8), ("vres", vres), ("vsync_start", vres + 1),
+                        ("vsync_end", vres + 2), ("vscan", vres + 4), ("length", hres*vres*4)]:
+        yield getattr(dut.core.initiator, name).storage.eq(value)
+    yield
+    yield dut.core.initiator.enable.storage.eq(1)
+    for buffer in [1, 2, 0, 2]:
+        for i in range(2*frame_duration()):
+            yield
+        # flip in the middle of a frame, the flip event is seen when the new buffer is displayed
+        yield pageflipper.next_buffer.storage.eq(buffer)
+        for i in range(3*frame_duration()):
+            if (yield pageflipper.ev.flip.pending):
+                flips.append((buffer, len(frames), (yield pageflipper.current_buffer.status)))
+                # clear the event (write to pending)
+                yield pageflipper.ev.pending.r.eq(1)
+                yield pageflipper.ev.pending.re.eq(1)
+                yield
+                yield pageflipper.ev.pending.re.eq(0)
+                break
+            yield
+    for i in range(2*frame_duration()):
+        yield
+
+
+if __name__ == "__main__":
+    tb = TB()
+    frames = []
+    flips = []
+    generators = {
+        "sys":   [main_generator(tb, frames, flips)],
+        "video": [video_capture_generator(tb, frames), dram_generator(tb.dram_port)]
+    }
+    run_simulation(tb, generators, {"sys": 10, "video": 10})
+
+    # frames are read from a single buffer (no tearing)
+    buffers = []
+    for pixels in frames:
+        buffer = bases.index(pixels[0] & ~0xfff)
+        assert pixels == list(range(bases[buffer], bases[buffer] + hres*vres)), "torn frame"
+        buffers.append(buffer)
+    print("buffers: {}".format(buffers))
+    print("flips: {}".format(flips))
+    assert len(flips) == 4
+    for buffer, frame, current_buffer in flips:
+        assert current_buffer == buffer
+        assert buffers[frame] == buffer and buffers[frame - 1] != buffer
@@ -0,0 +1,56 @@
+import random
+
+from migen import *
+
+from litevideo.output.rle import rle_encode, rle_decode, RLEDecoder
+
+
+class TB(Module):
+    def __init__(self):
+        self.submodules.decoder = RLEDecoder()
+
+
+def generate_frame(hres, vres):
+    pixels = []
+    for i in range(hres*vres):
+        if pixels and random.randrange(4):
+            pixels.append(pixels[-1])
+        else:
+            pixels.append(random.randrange(2**24))
+    return pixels
+
+
+def sink_generator(dut, words):
+    for word in words:
+        yield dut.decoder.sink.valid.eq(1)
+        yield dut.decoder.sink.data.eq(word)
+        yield
+        while not (yield dut.decoder.sink.ready):
+            yield
+    yield dut.decoder.sink.valid.eq(0)
+
+
+def source_generator(dut, pixels, length):
+    while len(pixels) < length:
+        yield dut.decoder.source.ready.eq(random.randrange(2))
+        yield
+        if ((yield dut.decoder.source.valid) and
+            (yield dut.decoder.source.ready)):
+            pixels.append((yield dut.decoder.source.data))
+
+
+if __name__ == "__main__":
+    hres, vres = 64, 8
+    frame = generate_frame(hres, vres)
+    words = rle_encode(frame, hres)
+    assert rle_decode(words) == frame
+    print("compression ratio: {:.2f}".format(len(frame)/len(words)))
+
+    tb = TB()
+    pixels = []
+    generators = [sink_generator(tb, words), source_generator(tb, pixels, len(frame))]
+    run_simulation(tb, generators, vcd_name="sim.vcd")
+
+    errors = sum(p != f for p, f in zip(pixels, frame))
+    print("errors: {:d}".format(errors))
+    assert errors == 0
@@ -0,0 +1,114 @@
+from migen import *
+
+from litedram.common import LiteDRAMPort
+
+from litevideo.output.core import VideoOutCore
+
+
+class TB(Module):
+    def __init__(self):
+        self.dram_port = LiteDRAMPort(mode="read", aw=32, dw=32, cd="video")
+        self.submodules.core = VideoOutCore(self.dram_port, with_scaler=True, scaler_max_hres=64)
+        self.sync.video += self.core.source.ready.eq(~self.core.source.ready)
+
+
+def source_frame(src_hres, src_vres):
+    return [(x*30) | ((y*30) << 8) | (((x + y)*15) << 16) for y in range(src_vres) for x in range(src_hres)]
+
+
+def interpolate(a, b, w):
+    return (a*(256 - w) + b*w) >> 8
+
+
+def reference(src, src_hres, src_vres, hres, vres, bilinear):
+    hscale = src_hres*4096//hres
+    vscale = src_vres*4096//vres
+    def pixel(x, y, c):
+        return (src[min(y, src_vres - 1)*src_hres + min(x, src_hres - 1)] >> 8*c) & 0xff
+    frame = []
+    for oy in range(vres):
+        y0, fy = (oy*vscale) >> 12, ((oy*vscale) >> 4) & 0xff
+        if not bilinear or y0 >= src_vres - 1:
+            fy = 0
+        for ox in range(hres):
+            x0, fx = (ox*hscale) >> 12, ((ox*hscale) >> 4) & 0xff
+            if not bilinear or x0 >= src_hres - 1:
+                fx = 0
+            value = 0
+            for c in range(3):
+                top = interpolate(pixel(x0, y0, c), pixel(x0 + 1, y0, c), fx)
+                bottom = interpolate(pixel(x0, y0 + 1, c), pixel(x0 + 1, y0 + 1, c), fx)
+                value |= interpolate(top, bottom, fy) << 8*c
+            frame.append(value)
+    return frame
+
+
+@passive
+def dram_generator(dram_port, src):
+    while True:
+        yield dram_port.cmd.ready.eq(1)
+        yield
+        if (yield dram_port.cmd.valid):
+            address = (yield dram_port.cmd.adr)
+            yield dram_port.cmd.ready.eq(0)
+            yield dram_port.rdata.valid.eq(1)
+            yield dram_port.rdata.data.eq(src[address%len(src)])
+            yield
+            yield dram_port.rdata.valid.eq(0)
+
+
+@passive
+def video_capture_generator(dut, frames):
+    pixels = []
+    while True:
+        if ((yield dut.core.source.valid) and
+            (yield dut.core.source.ready)):
+            if (yield dut.core.source.de):
+                pixels.append((yield dut.core.source.data))
+            elif (yield dut.core.source.vsync) and pixels:
+                frames.append(pixels)
+                pixels = []
+        yield
+
+
+def main_generator(dut, src_hres, src_vres, hres, vres, bilinear):
+    for name, value in [("hres", hres), ("hsync_start", hres + 2), ("hsync_end", hres + 4),
+                        ("hscan", hres + 8), ("vres", vres), ("vsync_start", vres + 2),
+                        ("vsync_end", vres + 4), ("vscan", vres + 8),
+                        ("base", 0), ("length", src_hres*src_vres*4)]:
+        yield getattr(dut.core.initiator, name).storage.eq(value)
+    scaler = dut.core.scaler
+    for name, value in [("src_hres", src_hres), ("src_vres", src_vres),
+                        ("hscale", src_hres*4096//hres), ("vscale", src_vres*4096//vres),
+                        ("filter", bilinear)]:
+        yield getattr(scaler, "_" + name).storage.eq(value)
+    for i in range(16):
+        yield
+    yield dut.core.initiator.enable.storage.eq(1)
+    for i in range(4*2*(hres + 8)*(vres + 8)):
+        yield
+
+
+def check(src_hres, src_vres, hres, vres, bilinear):
+    tb = TB()
+    src = source_frame(src_hres, src_vres)
+    frames = []
+    generators = {
+        "sys":   [main_generator(tb, src_hres, src_vres, hres, vres, bilinear)],
+        "video": [video_capture_generator(tb, frames), dram_generator(tb.dram_port, src)]
+    }
+    run_simulation(tb, generators, {"sys": 10, "video": 10})
+
+    expected = reference(src, src_hres, src_vres, hres, vres, bilinear)
+    print("{}x{} -> {}x{} {}: {} frames".format(src_hres, src_vres, hres, vres,
+        ["nearest", "bilinear"][bilinear], len(frames)))
+    assert len(frames) >= 2
+    for pixels in frames:
+        assert pixels == expected
+
+
+if __name__ == "__main__":
+    for bilinear in [0, 1]:
+        # upscaling and downscaling
+        check(4, 4, 8, 6, bilinear)
+        check(8, 6, 4, 4, bilinear)